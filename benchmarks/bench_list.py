@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Benchmark for fetching the list of notes, serial versus pipelined.
+
+Usage: bench_list.py [-l <latency_in_ms>] [<number_of_notes> ...]
+
+This starts a private dbus session bus and a fake RemoteControl service for
+each number of notes (1000, 10000 and 50000 by default). It then measures the
+wall time taken by Tomtom.build_note_list, which is what "tomtom list" spends
+most of its time on, with and without pipelined mode.
+
+"""
+import os
+import sys
+import time
+import optparse
+
+BENCH_DIR = os.path.dirname( os.path.abspath(__file__) )
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "src") )
+
+import dbus
+from dbus.mainloop.glib import DBusGMainLoop
+
+from tomtom import core
+from fake_remote import start_session_bus, start_service, stop_service
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+
+def time_note_list(pipelined):
+    """Return the time in seconds spent building the list of all notes."""
+    tomtom = core.Tomtom("Tomboy", pipelined=pipelined)
+
+    start = time.time()
+    notes = list( tomtom.build_note_list() )
+    elapsed = time.time() - start
+
+    return elapsed, len(notes)
+
+def main():
+    """Run the benchmark for all the requested sizes."""
+    parser = optparse.OptionParser(usage=__doc__.splitlines()[2])
+    parser.add_option(
+        "-l", dest="latency", type="int", default=0,
+        help="Latency in milliseconds added to each reply of the service."
+    )
+    options, arguments = parser.parse_args()
+
+    sizes = [int(a) for a in arguments] or DEFAULT_SIZES
+
+    # The main loop must be set before the shared bus connection is made.
+    DBusGMainLoop(set_as_default=True)
+    daemon = start_session_bus()
+
+    print "%8s | %12s | %13s | %8s" % (
+        "notes", "serial (s)", "pipelined (s)", "speedup"
+    )
+
+    try:
+        for size in sizes:
+            service = start_service(size, options.latency)
+
+            try:
+                serial, count = time_note_list(pipelined=False)
+                pipelined, count = time_note_list(pipelined=True)
+            finally:
+                stop_service(service)
+
+            print "%8d | %12.3f | %13.3f | %7.1fx" % (
+                count, serial, pipelined, serial / pipelined
+            )
+    finally:
+        daemon.terminate()
+        daemon.wait()
+
+if __name__ == "__main__":
+    main()
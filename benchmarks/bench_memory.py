@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Benchmark for the memory used by TomboyNote objects.
+
+Usage: bench_memory.py [<number_of_notes>]
+
+This builds notes (100000 by default) from values typed the way dbus returns
+them, once with the dict based note class that tomtom used before
+TomboyNote had slots and native values, and once with the current
+TomboyNote. Each variant runs in its own process. The growth of the process'
+resident memory is reported in bytes per note.
+
+"""
+import os
+import sys
+import gc
+import subprocess
+import optparse
+
+BENCH_DIR = os.path.dirname( os.path.abspath(__file__) )
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "src") )
+
+import dbus
+
+from tomtom import core
+
+DEFAULT_COUNT = 100000
+
+TAG_SETS = [
+    [],
+    ["system:notebook:pim"],
+    ["system:notebook:reminders", "system:notebook:pim"],
+    ["projects"],
+]
+
+class DictNote(object):
+    """The note class as it was: an instance dictionary of dbus values."""
+    def __init__(self, uri, title="", date=dbus.Int64(), tags=[]):
+        super(DictNote, self).__init__()
+        self.uri = uri
+        self.title = title
+        self.tags = tags
+        self.date = date
+
+def dbus_values(number):
+    """Get the values of a note as dbus returns them."""
+    return (
+        dbus.String(u"note://tomboy/%08d-85dd-487d-b614-188242f52241" % number),
+        dbus.String(u"Note number %d" % number),
+        dbus.Int64(1257805144 + number),
+        dbus.Array(
+            [dbus.String(t) for t in TAG_SETS[number % len(TAG_SETS)]],
+            signature="s"
+        ),
+    )
+
+def resident_memory():
+    """Get the resident memory of this process in bytes."""
+    pages = int( open("/proc/self/statm").read().split()[1] )
+
+    return pages * os.sysconf("SC_PAGE_SIZE")
+
+def measure(variant, count):
+    """Build notes and print the memory they take, in bytes per note."""
+    note_class = {"dict": DictNote, "slots": core.TomboyNote}[variant]
+
+    gc.collect()
+    before = resident_memory()
+
+    notes = []
+    for number in xrange(count):
+        uri, title, date, tags = dbus_values(number)
+        notes.append( note_class(uri=uri, title=title, date=date, tags=tags) )
+
+    gc.collect()
+    after = resident_memory()
+
+    print (after - before) / float(count)
+
+def main():
+    """Run each variant in a child process and compare them."""
+    parser = optparse.OptionParser(usage=__doc__.splitlines()[2][7:])
+    # Used by the child processes that measure one variant.
+    parser.add_option(
+        "--measure", dest="variant", choices=["dict", "slots"],
+        help=optparse.SUPPRESS_HELP
+    )
+    options, arguments = parser.parse_args()
+
+    if len(arguments) > 1:
+        parser.error("too many arguments")
+
+    count = DEFAULT_COUNT
+    if arguments:
+        try:
+            count = int(arguments[0])
+        except ValueError:
+            parser.error("invalid number of notes: %s" % arguments[0])
+
+    if options.variant:
+        measure(options.variant, count)
+        return
+
+    results = {}
+    for variant in ["dict", "slots"]:
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__),
+            "--measure", variant, str(count)
+        ])
+        results[variant] = float(output)
+
+    print "%8s | %16s | %16s | %8s" % (
+        "notes", "before (B/note)", "after (B/note)", "saved"
+    )
+    print "%8d | %16.0f | %16.0f | %7.0f%%" % (
+        count, results["dict"], results["slots"],
+        100 * (1 - results["slots"] / results["dict"])
+    )
+
+if __name__ == "__main__":
+    main()
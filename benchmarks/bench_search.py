@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Benchmark for searching notes with regular expressions, with and without
+the index.
+
+Usage: bench_search.py [-s <corpus_size_in_mb>] [-n <note_size_in_kb>]
+                       [<pattern> ...]
+
+This generates a synthetic corpus of notes (100 MB by default) made of random
+words, with rare error codes, names and addresses sprinkled in. Contents are
+served from memory so that only the search itself is measured. Each pattern is
+searched once by scanning all notes and once with the candidates given by the
+index. Results of both searches are compared to verify that they are
+identical.
+
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import optparse
+
+BENCH_DIR = os.path.dirname( os.path.abspath(__file__) )
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "src") )
+
+from tomtom import core, index
+from tomtom.actions import search
+
+DEFAULT_PATTERNS = [
+    r"ERR-[0-9]{4}",
+    r"john\s+doe",
+    r"(street|avenue) of \w+",
+    r"[a-z]+ing\b",
+]
+
+WORDS = """lorem ipsum dolor sit amet consectetur adipiscing elit sed do
+eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad minim
+veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo
+consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat
+nulla pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui
+officia deserunt mollit anim id est laborum""".split()
+
+RARE_LINES = [
+    "ERR-%04d while syncing",
+    "call John Doe about note %d",
+    "meet on the avenue of roses at %d",
+]
+
+class MemoryRemote(object):
+    """Stand-in for the RemoteControl interface serving contents from memory.
+    """
+    def __init__(self, contents):
+        super(MemoryRemote, self).__init__()
+        self.contents = contents
+
+    def GetNoteContents(self, uri):
+        """Get the content of a note."""
+        return self.contents[uri]
+
+def generate_corpus(size, note_size):
+    """Generate notes and their contents totalling `size` bytes."""
+    generator = random.Random(42)
+    notes = []
+    contents = {}
+
+    total = 0
+    number = 0
+    while total < size:
+        lines = ["note %d" % number]
+        length = 0
+        while length < note_size:
+            if generator.random() < 0.002:
+                line = generator.choice(RARE_LINES) % generator.randint(0, 9999)
+            else:
+                line = " ".join(generator.sample(WORDS, 10))
+            lines.append(line)
+            length += len(line) + 1
+
+        uri = "note://tomboy/%d" % number
+        notes.append( core.TomboyNote(uri, "note %d" % number, number, []) )
+        contents[uri] = unicode( "\n".join(lines) )
+
+        total += length
+        number += 1
+
+    return notes, contents
+
+def open_tomtom(contents, word_index):
+    """Get a Tomtom object that reads contents from memory."""
+    tomtom = core.Tomtom.__new__(core.Tomtom)
+    tomtom.application = "Tomboy"
+    tomtom.comm = MemoryRemote(contents)
+    tomtom.index = word_index
+
+    return tomtom
+
+def time_search(tomtom, pattern, notes):
+    """Return the time in seconds spent searching and the results."""
+    action = search.SearchAction()
+    action.tomboy_interface = tomtom
+
+    start = time.time()
+    results = list( action.search_for_text(pattern, notes) )
+    elapsed = time.time() - start
+
+    return elapsed, results
+
+def main():
+    """Run the benchmark for all the requested patterns."""
+    parser = optparse.OptionParser(usage=__doc__.splitlines()[3])
+    parser.add_option(
+        "-s", dest="size", type="int", default=100,
+        help="Size of the corpus in megabytes."
+    )
+    parser.add_option(
+        "-n", dest="note_size", type="int", default=8,
+        help="Size of each note in kilobytes."
+    )
+    options, arguments = parser.parse_args()
+
+    patterns = arguments or DEFAULT_PATTERNS
+
+    notes, contents = generate_corpus(
+        options.size * 1024 * 1024,
+        options.note_size * 1024
+    )
+
+    directory = tempfile.mkdtemp()
+
+    try:
+        word_index = index.WordIndex( os.path.join(directory, "index.sqlite") )
+        indexed = open_tomtom(contents, word_index)
+        scanned = open_tomtom(contents, None)
+
+        start = time.time()
+        word_index.update(notes, indexed.fetch_contents)
+        print "Indexed %d notes (%d MB) in %.1f s" % (
+            len(notes), options.size, time.time() - start
+        )
+        print
+
+        print "%-28s | %8s | %9s | %11s | %8s" % (
+            "pattern", "scan (s)", "index (s)", "candidates", "speedup"
+        )
+
+        for pattern in patterns:
+            scan, expected = time_search(scanned, pattern, notes)
+            indexed_time, results = time_search(indexed, pattern, notes)
+
+            if results != expected:
+                print >> sys.stderr, "Results differ for %s" % pattern
+                sys.exit(1)
+
+            candidates = indexed.search_candidates(pattern, notes)
+            if candidates is None:
+                candidate_count = len(notes)
+            else:
+                candidate_count = len(candidates)
+
+            print "%-28s | %8.2f | %9.2f | %11d | %7.1fx" % (
+                pattern, scan, indexed_time, candidate_count,
+                scan / indexed_time
+            )
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Benchmark for the start up time of the tomtom command.
+
+Usage: bench_startup.py [-r <runs>] [-m <milliseconds>] [<arguments> ...]
+
+This runs tomtom in new processes with arguments that don't need Tomboy or
+Gnote: "-v", "-h" and "list -h" by default, or the given arguments. Each
+command is run once to build the table of actions, then timed over a number
+of runs. The median time is reported, along with the heavy modules that got
+imported.
+
+Python 2 has no "-X importtime" option, so modules are checked by looking
+into sys.modules when each process exits. The exit status is 1 if a command
+imports one of the heavy modules or if its median time is over the limit,
+which makes this usable as a regression check.
+
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+BENCH_DIR = os.path.dirname( os.path.abspath(__file__) )
+SOURCE_DIR = os.path.join(BENCH_DIR, os.pardir, "src")
+
+DEFAULT_COMMANDS = [
+    ["-v"],
+    ["-h"],
+    ["list", "-h"],
+]
+
+# Modules that must not be imported just to print help or the version.
+HEAVY_MODULES = ["dbus", "pkg_resources", "gobject", "multiprocessing"]
+
+# Run tomtom, and report heavy modules that were imported on stderr when the
+# process exits.
+SCRIPT = """
+import sys, atexit
+
+def report():
+    heavy = [m for m in %r if m in sys.modules]
+    sys.__stderr__.write("imported: %%s\\n" %% " ".join(heavy))
+
+atexit.register(report)
+
+sys.argv = ["tomtom"] + sys.argv[1:]
+from tomtom import cli
+cli.exception_wrapped_main()
+""" % (HEAVY_MODULES, )
+
+def run(arguments, environment):
+    """Run tomtom once. Return the time it took and heavy modules imported."""
+    start = time.time()
+    process = subprocess.Popen(
+        [sys.executable, "-c", SCRIPT] + arguments,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=environment
+    )
+    output, errors = process.communicate()
+    elapsed = time.time() - start
+
+    imported = []
+    for line in errors.splitlines():
+        if line.startswith("imported:"):
+            imported = line.split()[1:]
+
+    return elapsed, imported
+
+def median(values):
+    """Get the median of a list of numbers."""
+    values = sorted(values)
+    middle = len(values) // 2
+
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+def main():
+    """Time all the requested commands."""
+    parser = optparse.OptionParser(usage=__doc__.splitlines()[2][7:])
+    parser.add_option(
+        "-r", dest="runs", type="int", default=10,
+        help="Number of timed runs of each command."
+    )
+    parser.add_option(
+        "-m", dest="max_ms", type="float", default=150.0,
+        help="Maximum median time of a command, in milliseconds."
+    )
+    options, arguments = parser.parse_args()
+
+    commands = DEFAULT_COMMANDS
+    if arguments:
+        commands = [arguments]
+
+    cache_home = tempfile.mkdtemp()
+
+    environment = dict(os.environ)
+    environment["XDG_CACHE_HOME"] = cache_home
+    # Don't let a running daemon answer.
+    environment["XDG_RUNTIME_DIR"] = cache_home
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [SOURCE_DIR] + sys.path
+    )
+
+    failed = False
+
+    try:
+        print "%-16s | %10s | %s" % ("command", "median (ms)", "heavy modules")
+
+        for command in commands:
+            # The first run builds the table of actions.
+            run(command, environment)
+
+            times = []
+            for number in xrange(options.runs):
+                elapsed, imported = run(command, environment)
+                times.append(elapsed)
+
+            milliseconds = median(times) * 1000
+
+            print "%-16s | %11.1f | %s" % (
+                " ".join(command), milliseconds, " ".join(imported) or "-"
+            )
+
+            if imported or milliseconds > options.max_ms:
+                failed = True
+    finally:
+        shutil.rmtree(cache_home)
+
+    if failed:
+        print >> sys.stderr, \
+            "Start up is slower than %.0f ms or imports heavy modules." % (
+                options.max_ms,
+            )
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
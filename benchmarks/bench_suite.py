@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Benchmark suite timing tomtom commands end to end.
+
+Usage: bench_suite.py [options] [<scenario> ...]
+
+This starts a private dbus session bus and a fake RemoteControl service
+serving a synthetic store of notes, then runs tomtom commands through
+CommandLine.main the same way the tomtom script does. Each scenario is run
+once with an empty cache and then timed over a number of runs with the cache
+filled by the first run.
+
+Scenarios are "list", "list-tags", "display" and "search" (all of them by
+default). Results are written as JSON so that runs can be kept and compared:
+use "-o" to save them to a file and "-c" to compare with an earlier file.
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import optparse
+
+BENCH_DIR = os.path.dirname( os.path.abspath(__file__) )
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, "src") )
+
+from dbus.mainloop.glib import DBusGMainLoop
+
+from tomtom import cli, TOMTOM_VERSION
+from fake_remote import start_session_bus, start_service, stop_service
+from bench_startup import median
+
+SCENARIOS = [
+    ("list", ["list"]),
+    ("list-tags", ["list", "-b", "book1"]),
+    ("display", ["display"] + ["Note number %d" % i for i in xrange(10)]),
+    ("search", ["search", "john doe"]),
+]
+
+def run_command(arguments):
+    """Run tomtom once through CommandLine.main and return the time it took.
+
+    The output is thrown away. Arguments are the ones that would follow the
+    name of the script on the command line.
+
+    """
+    saved_argv = sys.argv
+    saved_stdout = sys.stdout
+
+    sys.argv = ["tomtom"] + arguments
+    sys.stdout = open(os.devnull, "w")
+
+    start = time.time()
+    try:
+        cli.CommandLine().main()
+    except SystemExit, exc:
+        if exc.code:
+            raise RuntimeError(
+                "tomtom %s exited with status %s" % (
+                    " ".join(arguments), exc.code
+                )
+            )
+    finally:
+        elapsed = time.time() - start
+
+        sys.stdout.close()
+        sys.stdout = saved_stdout
+        sys.argv = saved_argv
+
+    return elapsed
+
+def run_scenario(arguments, runs):
+    """Time a scenario with a cold cache and then with a warm cache.
+
+    Arguments:
+        arguments -- The tomtom command line arguments to run
+        runs -- Number of timed runs with a warm cache
+
+    """
+    cache_home = tempfile.mkdtemp()
+    os.environ["XDG_CACHE_HOME"] = cache_home
+
+    try:
+        cold = run_command(arguments)
+        warm = [run_command(arguments) for number in xrange(runs)]
+    finally:
+        shutil.rmtree(cache_home)
+
+    return {
+        "arguments": arguments,
+        "cold": cold,
+        "warm": warm,
+        "warm_median": median(warm),
+    }
+
+def compare(results, previous):
+    """Print the ratio of times between these results and earlier ones."""
+    print >> sys.stderr, "%-10s | %12s | %12s" % (
+        "scenario", "cold (x)", "warm (x)"
+    )
+
+    for name, result in sorted( results["scenarios"].items() ):
+        before = previous["scenarios"].get(name)
+        if before is None:
+            continue
+
+        print >> sys.stderr, "%-10s | %12.2f | %12.2f" % (
+            name,
+            result["cold"] / before["cold"],
+            result["warm_median"] / before["warm_median"],
+        )
+
+def main():
+    """Run all the requested scenarios and write the results."""
+    parser = optparse.OptionParser(usage=__doc__.splitlines()[2][7:])
+    parser.add_option(
+        "-n", dest="notes", type="int", default=10000,
+        help="Number of notes in the store."
+    )
+    parser.add_option(
+        "-t", dest="tags", type="int", default=10,
+        help="Number of notebooks notes are spread in."
+    )
+    parser.add_option(
+        "-s", dest="content_size", type="int", default=2000,
+        help="Approximate size of the content of notes, in bytes."
+    )
+    parser.add_option(
+        "-l", dest="latency", type="int", default=0,
+        help="Latency in milliseconds added to each reply of the service."
+    )
+    parser.add_option(
+        "-r", dest="runs", type="int", default=5,
+        help="Number of timed runs with a warm cache."
+    )
+    parser.add_option(
+        "-p", dest="pipelined", action="store_true", default=False,
+        help="Run the commands in pipelined mode."
+    )
+    parser.add_option(
+        "-o", dest="output",
+        help="Write the results to this file instead of standard output."
+    )
+    parser.add_option(
+        "-c", dest="compare",
+        help="Compare the results with the ones in this file."
+    )
+    options, arguments = parser.parse_args()
+
+    scenarios = SCENARIOS
+    if arguments:
+        scenarios = [s for s in SCENARIOS if s[0] in arguments]
+
+    # The main loop must be set before the shared bus connection is made.
+    DBusGMainLoop(set_as_default=True)
+    daemon = start_session_bus()
+
+    # Don't let a running daemon answer.
+    runtime_dir = tempfile.mkdtemp()
+    os.environ["XDG_RUNTIME_DIR"] = runtime_dir
+
+    results = {
+        "tomtom_version": TOMTOM_VERSION,
+        "python": platform.python_version(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": {
+            "notes": options.notes,
+            "tags": options.tags,
+            "content_size": options.content_size,
+            "latency": options.latency,
+            "runs": options.runs,
+            "pipelined": options.pipelined,
+        },
+        "scenarios": {},
+    }
+
+    try:
+        service = start_service(
+            options.notes, options.latency, options.tags, options.content_size
+        )
+
+        try:
+            for name, command in scenarios:
+                if options.pipelined:
+                    command = command[:1] + ["--pipelined"] + command[1:]
+
+                results["scenarios"][name] = run_scenario(
+                    command, options.runs
+                )
+        finally:
+            stop_service(service)
+    finally:
+        shutil.rmtree(runtime_dir)
+        daemon.terminate()
+        daemon.wait()
+
+    output = sys.stdout
+    if options.output:
+        output = open(options.output, "w")
+
+    json.dump(results, output, indent=4, sort_keys=True)
+    output.write("\n")
+
+    if options.output:
+        output.close()
+
+    if options.compare:
+        previous_file = open(options.compare)
+        try:
+            compare( results, json.load(previous_file) )
+        finally:
+            previous_file.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Fake Tomboy RemoteControl service used by the benchmarks.
+
+Usage: fake_remote.py [-t <tags>] [-s <content_bytes>] <number_of_notes>
+                      [latency_in_ms]
+
+This serves a synthetic store of notes on the session bus under the name
+"org.gnome.Tomboy". Each note belongs to one of a number of notebooks, and
+every 100th note is a template. Contents are made of random words, with a line
+mentioning John Doe in one note out of 20. Replies can be delayed by a fixed
+latency. Delayed replies are sent from the main loop, so many calls can wait
+for a reply at the same time, like they would with the real application.
+
+The benchmarks start the service with start_session_bus and start_service.
+
+"""
+import os
+import sys
+import time
+import random
+import optparse
+import subprocess
+
+import dbus
+import dbus.service
+import gobject
+from dbus.mainloop.glib import DBusGMainLoop
+
+APPLICATION = "Tomboy"
+BUS_NAME = "org.gnome.%s" % APPLICATION
+INTERFACE = "org.gnome.%s.RemoteControl" % APPLICATION
+
+BENCH_DIR = os.path.dirname( os.path.abspath(__file__) )
+
+DEFAULT_TAG_COUNT = 10
+DEFAULT_CONTENT_SIZE = 200
+
+WORDS = """lorem ipsum dolor sit amet consectetur adipiscing elit sed do
+eiusmod tempor incididunt ut labore et dolore magna aliqua enim ad minim
+veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo
+consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat
+nulla pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui
+officia deserunt mollit anim id est laborum""".split()
+
+def start_session_bus():
+    """Start a private dbus-daemon and point the environment to it."""
+    daemon = subprocess.Popen(
+        ["dbus-daemon", "--session", "--nofork", "--print-address=1"],
+        stdout=subprocess.PIPE
+    )
+    address = daemon.stdout.readline().strip()
+    os.environ["DBUS_SESSION_BUS_ADDRESS"] = address
+
+    return daemon
+
+def start_service(note_count, latency=0, tag_count=DEFAULT_TAG_COUNT,
+        content_size=DEFAULT_CONTENT_SIZE):
+    """Start the fake service and wait for it to own its bus name.
+
+    Arguments:
+        note_count -- Number of notes to serve
+        latency -- Delay in milliseconds before replies are sent (default: 0)
+        tag_count -- Number of notebooks notes are spread in
+        content_size -- Approximate size in bytes of the content of notes
+
+    """
+    service = subprocess.Popen([
+        sys.executable,
+        os.path.join(BENCH_DIR, "fake_remote.py"),
+        "-t", str(tag_count),
+        "-s", str(content_size),
+        str(note_count),
+        str(latency),
+    ])
+
+    bus = dbus.SessionBus()
+    while not bus.name_has_owner(BUS_NAME):
+        time.sleep(0.05)
+
+    return service
+
+def stop_service(service):
+    """Stop the fake service and wait for its bus name to be released."""
+    service.terminate()
+    service.wait()
+
+    bus = dbus.SessionBus()
+    while bus.name_has_owner(BUS_NAME):
+        time.sleep(0.05)
+
+def generate_content(title, index, content_size):
+    """Generate the content of a note, starting with its title."""
+    generator = random.Random(index)
+
+    lines = [title, ""]
+    length = 0
+    while length < content_size:
+        line = " ".join( generator.sample(WORDS, 10) )
+        lines.append(line)
+        length += len(line) + 1
+
+    if index % 20 == 0:
+        lines.insert(2, "call John Doe about note %d" % index)
+
+    return "\n".join(lines)
+
+class FakeRemoteControl(dbus.service.Object):
+    """Synthetic note store exported over dbus."""
+    def __init__(self, bus, note_count, latency=0,
+            tag_count=DEFAULT_TAG_COUNT, content_size=DEFAULT_CONTENT_SIZE):
+        """Generate the notes and export the object on the bus.
+
+        Arguments:
+            bus -- The dbus.Bus to export the object on
+            note_count -- Number of notes to generate
+            latency -- Delay in milliseconds before replies are sent
+            tag_count -- Number of notebooks notes are spread in
+            content_size -- Approximate size in bytes of the content of notes
+
+        """
+        self.bus_name = dbus.service.BusName("org.gnome.%s" % APPLICATION, bus)
+        super(FakeRemoteControl, self).__init__(
+            self.bus_name,
+            "/org/gnome/%s/RemoteControl" % APPLICATION
+        )
+
+        self.latency = latency
+
+        now = int( time.time() )
+        self.uris = []
+        self.notes = {}
+        for index in xrange(note_count):
+            uri = "note://tomboy/%08d-fake" % index
+            title = "Note number %d" % index
+
+            tags = ["system:notebook:book%d" % (index % tag_count)]
+            if index % 100 == 99:
+                tags.append("system:template")
+
+            self.uris.append(uri)
+            self.notes[uri] = {
+                "title": title,
+                "date": now - index * 60,
+                "tags": tags,
+                "content": generate_content(title, index, content_size),
+            }
+
+        self.titles = dict(
+            (note["title"], uri) for (uri, note) in self.notes.items()
+        )
+
+    def respond(self, reply, value):
+        """Send a reply, after the configured latency if there is one."""
+        if not self.latency:
+            reply(value)
+            return
+
+        def send_reply():
+            """Send the delayed reply only once."""
+            reply(value)
+            return False
+
+        gobject.timeout_add(self.latency, send_reply)
+
+    @dbus.service.method(INTERFACE, in_signature="", out_signature="s",
+            async_callbacks=("reply", "error"))
+    def Version(self, reply, error):
+        self.respond(reply, "0.0-fake")
+
+    @dbus.service.method(INTERFACE, in_signature="", out_signature="as",
+            async_callbacks=("reply", "error"))
+    def ListAllNotes(self, reply, error):
+        self.respond(reply, self.uris)
+
+    @dbus.service.method(INTERFACE, in_signature="s", out_signature="s",
+            async_callbacks=("reply", "error"))
+    def FindNote(self, title, reply, error):
+        self.respond(reply, self.titles.get(title, ""))
+
+    @dbus.service.method(INTERFACE, in_signature="s", out_signature="s",
+            async_callbacks=("reply", "error"))
+    def GetNoteTitle(self, uri, reply, error):
+        self.respond(reply, self.notes[uri]["title"])
+
+    @dbus.service.method(INTERFACE, in_signature="s", out_signature="x",
+            async_callbacks=("reply", "error"))
+    def GetNoteChangeDate(self, uri, reply, error):
+        self.respond(reply, self.notes[uri]["date"])
+
+    @dbus.service.method(INTERFACE, in_signature="s", out_signature="as",
+            async_callbacks=("reply", "error"))
+    def GetTagsForNote(self, uri, reply, error):
+        self.respond(reply, self.notes[uri]["tags"])
+
+    @dbus.service.method(INTERFACE, in_signature="s", out_signature="s",
+            async_callbacks=("reply", "error"))
+    def GetNoteContents(self, uri, reply, error):
+        self.respond(reply, self.notes[uri]["content"])
+
+    @dbus.service.method(INTERFACE, in_signature="s", out_signature="as",
+            async_callbacks=("reply", "error"))
+    def GetAllNotesWithTag(self, tag, reply, error):
+        self.respond(
+            reply,
+            [uri for uri in self.uris if tag in self.notes[uri]["tags"]]
+        )
+
+    @dbus.service.method(INTERFACE, in_signature="sb", out_signature="as",
+            async_callbacks=("reply", "error"))
+    def SearchNotes(self, query, case_sensitive, reply, error):
+        words = query.lower().split()
+        self.respond(reply, [
+            uri for uri in self.uris
+            if all(w in self.notes[uri]["content"].lower() for w in words)
+        ])
+
+def main():
+    """Serve the fake notes until the process is killed."""
+    parser = optparse.OptionParser(usage=__doc__.splitlines()[2][7:])
+    parser.add_option(
+        "-t", dest="tag_count", type="int", default=DEFAULT_TAG_COUNT,
+        help="Number of notebooks notes are spread in."
+    )
+    parser.add_option(
+        "-s", dest="content_size", type="int", default=DEFAULT_CONTENT_SIZE,
+        help="Approximate size of the content of notes, in bytes."
+    )
+    options, arguments = parser.parse_args()
+
+    note_count = int(arguments[0])
+    latency = 0
+    if arguments[1:]:
+        latency = int(arguments[1])
+
+    DBusGMainLoop(set_as_default=True)
+    service = FakeRemoteControl(
+        dbus.SessionBus(), note_count, latency,
+        options.tag_count, options.content_size
+    )
+
+    gobject.MainLoop().run()
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ use_setuptools()
 
 from setuptools import setup, find_packages
 
-from src.tomtom.core import TOMTOM_VERSION
+from src.tomtom import TOMTOM_VERSION
 
 setup(
     # General information
@@ -29,6 +29,7 @@ setup(
     entry_points = {
         "console_scripts": [
             "tomtom = tomtom.cli:exception_wrapped_main",
+            "tomtomd = tomtom.daemon:main",
         ],
         "tomtom.actions": [
             "list = tomtom.actions.list:ListAction",
@@ -37,6 +37,12 @@ This defines the use cases and expected results.
 """
 import sys
 import os
+import re
+import json
+import pstats
+import shutil
+import tempfile
+import StringIO
 import mox
 import dbus
 import pkg_resources
@@ -46,6 +52,19 @@ from test_utils import *
 
 from tomtom import cli
 from tomtom import plugins
+from tomtom import registry
+
+class FakeAction1(plugins.ActionPlugin):
+    """Action listed in the main help."""
+    short_description = "this action does something"
+
+class FakeAction2(plugins.ActionPlugin):
+    """Action listed in the main help."""
+    short_description = "this one too"
+
+class FakeAction3(plugins.ActionPlugin):
+    """Action listed in the main help, without a description."""
+    pass
 
 class AcceptanceTests(BasicMocking, CLIMocking):
     """Acceptance tests.
@@ -65,6 +84,16 @@ class AcceptanceTests(BasicMocking, CLIMocking):
         """
         super(AcceptanceTests, self).setUp()
 
+        # Start each test with an empty cache of note information, and make
+        # sure that no running daemon is found.
+        self.old_environment = dict(
+            (name, os.environ.get(name))
+            for name in ["XDG_CACHE_HOME", "XDG_RUNTIME_DIR"]
+        )
+        self.cache_home = tempfile.mkdtemp()
+        os.environ["XDG_CACHE_HOME"] = self.cache_home
+        os.environ["XDG_RUNTIME_DIR"] = self.cache_home
+
         # By default, mock out Tomboy interaction.
         self.mock_out_dbus("Tomboy")
 
@@ -80,15 +109,27 @@ class AcceptanceTests(BasicMocking, CLIMocking):
         dbus.SessionBus = self.old_SessionBus
         dbus.Interface = self.old_Interface
 
+        shutil.rmtree(self.cache_home)
+        for name, value in self.old_environment.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
     def mock_out_dbus(self, application):
         """Mock out dbus interaction with the specified application."""
         self.old_SessionBus = dbus.SessionBus
         self.old_Interface = dbus.Interface
         dbus.SessionBus = self.m.CreateMockAnything()
         dbus.Interface = self.m.CreateMockAnything()
+        self.dbus_interface = self.m.CreateMockAnything()
+
+        self.mock_out_connection(application)
+
+    def mock_out_connection(self, application):
+        """Expect one more connection to the mocked out application."""
         session_bus = self.m.CreateMockAnything()
         dbus_object = self.m.CreateMockAnything()
-        self.dbus_interface = self.m.CreateMockAnything()
 
         dbus.SessionBus()\
             .AndReturn(session_bus)
@@ -101,20 +142,56 @@ class AcceptanceTests(BasicMocking, CLIMocking):
             "org.gnome.%s.RemoteControl" % application
         ).AndReturn(self.dbus_interface)
 
-    def mock_out_listing(self, notes):
+    def mock_out_listing(self, notes, cached=False, limited=False, tags=[],
+            templates=False):
         """Create mocks for note listing via dbus.
 
+        The application is asked for the notes with the requested tags and for
+        templates. Change dates are fetched to verify the cache, before that
+        for all notes if the number of notes is limited. Titles and tags are
+        then fetched for the selected notes that are not in the cache.
+
         Arguments:
             notes -- a list of TomboyNote objects
+            cached -- Boolean, notes are already in the cache (default: False)
+            limited -- Boolean, "-n" is used (default: False)
+            tags -- list of tags requested with "-t" or "-b" (default: [])
+            templates -- Boolean, templates are included (default: False)
 
         """
         self.dbus_interface.ListAllNotes()\
             .AndReturn([n.uri for n in notes])
+
+        if limited:
+            for note in notes:
+                self.dbus_interface.GetNoteChangeDate(note.uri)\
+                    .AndReturn(note.date)
+
+        excluded_tags = []
+        if not templates and "system:template" not in tags:
+            excluded_tags.append("system:template")
+
+        for tag in tags + excluded_tags:
+            self.dbus_interface.GetAllNotesWithTag(tag)\
+                .AndReturn([n.uri for n in notes if tag in n.tags])
+
+        notes = [
+            n for n in notes
+            if (not tags or set(tags).intersection(n.tags))
+                and not set(excluded_tags).intersection(n.tags)
+        ]
+
+        if not limited:
+            for note in notes:
+                self.dbus_interface.GetNoteChangeDate(note.uri)\
+                    .AndReturn(note.date)
+
+        if cached:
+            return
+
         for note in notes:
             self.dbus_interface.GetNoteTitle(note.uri)\
                 .AndReturn(note.title)
-            self.dbus_interface.GetNoteChangeDate(note.uri)\
-                .AndReturn(note.date)
             self.dbus_interface.GetTagsForNote(note.uri)\
                 .AndReturn(note.tags)
 
@@ -132,6 +209,11 @@ class AcceptanceTests(BasicMocking, CLIMocking):
         for note in notes:
             self.dbus_interface.GetNoteChangeDate(note.uri)\
                 .AndReturn(note.date)
+
+        # Titles are fetched since the names could differ from them in case.
+        for note in notes:
+            self.dbus_interface.GetNoteTitle(note.uri)\
+                .AndReturn(note.title)
             self.dbus_interface.GetTagsForNote(note.uri)\
                 .AndReturn(note.tags)
 
@@ -194,7 +276,7 @@ class AcceptanceTests(BasicMocking, CLIMocking):
         """Acceptance: Action "list -n" prints a list of the last n notes."""
         list_of_notes = test_data.full_list_of_notes(self.m)
 
-        self.mock_out_listing(list_of_notes[:10])
+        self.mock_out_listing(list_of_notes[:10], limited=True)
 
         self.m.ReplayAll()
 
@@ -231,6 +313,362 @@ class AcceptanceTests(BasicMocking, CLIMocking):
             sys.stdout.getvalue()
         )
 
+    def test_list_from_cache(self):
+        """Acceptance: Unchanged notes are listed from the cache."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes[:10], limited=True)
+
+        # Second run: Only the change dates are fetched.
+        self.mock_out_connection("Tomboy")
+        self.mock_out_listing(list_of_notes[:10], cached=True, limited=True)
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "list", "-n", "10"]
+        cli.CommandLine().main()
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            (test_data.expected_list + os.linesep) * 2,
+            sys.stdout.getvalue()
+        )
+
+    def test_shell(self):
+        """Acceptance: The shell runs actions with a single connection."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes[:10], limited=True)
+        # The second listing comes from memory, without connecting again.
+        self.mock_out_listing(list_of_notes[:10], cached=True, limited=True)
+
+        self.m.ReplayAll()
+
+        old_stdin = sys.stdin
+        sys.stdin = StringIO.StringIO("list -n 10\nlist -n 10\n")
+        sys.argv = ["unused_prog_name", "shell"]
+
+        try:
+            tomtom_cli = cli.CommandLine()
+            self.assertRaises(SystemExit, tomtom_cli.main)
+        finally:
+            sys.stdin = old_stdin
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            (test_data.expected_list + os.linesep) * 2,
+            sys.stdout.getvalue()
+        )
+
+    def test_batch(self):
+        """Acceptance: A batch runs all actions with a single connection."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes[:10], limited=True)
+        self.mock_out_listing(list_of_notes[:10], cached=True, limited=True)
+
+        self.m.ReplayAll()
+
+        old_stdin = sys.stdin
+        sys.stdin = StringIO.StringIO(
+            "list -n 10\nunexistant_action\nlist -n 10\n"
+        )
+        sys.argv = ["app_name", "batch", "--json"]
+
+        try:
+            tomtom_cli = cli.CommandLine()
+            self.assertRaises(SystemExit, tomtom_cli.main)
+        finally:
+            sys.stdin = old_stdin
+
+        self.m.VerifyAll()
+
+        records = [
+            json.loads(line) for line in sys.stdout.getvalue().splitlines()
+        ]
+
+        self.assertEqual(
+            [0, cli.ACTION_NOT_FOUND_RETURN_CODE, 0],
+            [record["exit"] for record in records]
+        )
+        self.assertEqual(
+            test_data.expected_list + os.linesep,
+            records[0]["stdout"]
+        )
+        self.assertEqual(records[0]["stdout"], records[2]["stdout"])
+        self.assertEqual(
+            test_data.unknown_action + os.linesep,
+            records[1]["stderr"]
+        )
+
+    def test_list_without_cache(self):
+        """Acceptance: Using "--no-cache" fetches everything via dbus."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        # Notes are listed in any order. Only the 10 latest ones get their
+        # title and tags fetched.
+        listed = list( reversed(list_of_notes) )
+
+        self.dbus_interface.ListAllNotes()\
+            .AndReturn([n.uri for n in listed])
+        for note in listed:
+            self.dbus_interface.GetNoteChangeDate(note.uri)\
+                .AndReturn(note.date)
+        self.dbus_interface.GetAllNotesWithTag("system:template")\
+            .AndReturn([list_of_notes[-1].uri])
+        for note in list_of_notes[:10]:
+            self.dbus_interface.GetNoteTitle(note.uri)\
+                .AndReturn(note.title)
+            self.dbus_interface.GetTagsForNote(note.uri)\
+                .AndReturn(note.tags)
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "list", "-n", "10", "--no-cache"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.expected_list + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+        # Only the table of actions is kept.
+        self.assertEqual(
+            [registry.TABLE_FILE],
+            os.listdir( os.path.join(self.cache_home, "tomtom") )
+        )
+
+    def test_list_with_stats(self):
+        """Acceptance: Using "--stats" reports calls and phases on stderr."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes)
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "list", "--stats"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        # The list itself is not changed.
+        self.assertEquals(
+            os.linesep.join([
+                test_data.expected_list,
+                test_data.list_appendix
+            ]) + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+        report = dict(
+            (line[:20].strip(), line[20:].split())
+            for line in sys.stderr.getvalue().splitlines()
+        )
+
+        for phase in ["plugin loading", "option parsing", "connection",
+                "fetch", "filter", "format", "write"]:
+            self.assertTrue(phase in report)
+
+        self.assertEqual("1", report["ListAllNotes"][0])
+        self.assertEqual(
+            report["GetNoteTitle"][0],
+            report["GetNoteChangeDate"][0]
+        )
+        # Both the URIs and the titles are in the bytes received.
+        self.assertTrue(
+            int(report["ListAllNotes"][1]) > len(list_of_notes)
+        )
+
+    def test_list_with_trace_and_profile(self):
+        """Acceptance: "--trace-file" and "--profile" write their files."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes)
+
+        self.m.ReplayAll()
+
+        trace_path = os.path.join(self.cache_home, "trace.json")
+        profile_path = os.path.join(self.cache_home, "list.prof")
+
+        sys.argv = [
+            "unused_prog_name", "list",
+            "--trace-file=%s" % trace_path,
+            "--profile=%s" % profile_path,
+        ]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        # Nothing else is printed.
+        self.assertEqual("", sys.stderr.getvalue())
+
+        trace_file = open(trace_path)
+        events = json.load(trace_file)["traceEvents"]
+        trace_file.close()
+
+        calls = [e["name"] for e in events if e["cat"] == "dbus"]
+        spans = set(e["name"] for e in events if e["cat"] == "phase")
+
+        self.assertEqual(1, calls.count("ListAllNotes"))
+        self.assertEqual(
+            calls.count("GetNoteTitle"),
+            calls.count("GetNoteChangeDate")
+        )
+        for span in ["plugin loading", "connection", "build_note_list",
+                "filter_notes", "format", "write"]:
+            self.assertTrue(span in spans)
+
+        profile = pstats.Stats(profile_path)
+        self.assertTrue(
+            [f for f in profile.stats if f[2] == "perform_action"]
+        )
+
+    def use_note_files(self):
+        """Write note files where the "files" backend will find them."""
+        # No dbus interaction when reading files
+        self.remove_mocks()
+
+        data_home = os.path.join(self.cache_home, "data")
+        os.makedirs( os.path.join(data_home, "tomboy") )
+        test_data.write_note_files( os.path.join(data_home, "tomboy") )
+
+        self.old_environment.setdefault(
+            "XDG_DATA_HOME",
+            os.environ.get("XDG_DATA_HOME")
+        )
+        os.environ["XDG_DATA_HOME"] = data_home
+
+    def test_list_from_note_files(self):
+        """Acceptance: "--backend=files" lists notes from note files."""
+        self.use_note_files()
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "list", "--backend=files"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.expected_list_from_files + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_limited_list_with_new_template(self):
+        """Acceptance: A new template doesn't take a place in "list -n"."""
+        self.use_note_files()
+
+        directory = os.path.join(self.cache_home, "data", "tomboy")
+        template_file = open(
+            os.path.join(directory, "4e5f6a7b-8c9d-4e0f-9a1b-2c3d4e5f6a7b.note"),
+            "w"
+        )
+        template_file.write(test_data.note_file_template % {
+            "title": "New note template",
+            "date": "2009-11-10T08:00:00.0000000-05:00",
+            "content": "New note template\n\nDescribe your new note here.",
+            "tags": "\n    <tag>system:template</tag>",
+        })
+        template_file.close()
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "list", "-n", "2", "--backend=files"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            os.linesep.join(
+                test_data.expected_list_from_files.splitlines()[:2]
+            ) + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_list_with_auto_backend(self):
+        """Acceptance: "--backend=auto" doesn't start a stopped application."""
+        self.use_note_files()
+
+        session_bus = self.m.CreateMockAnything()
+        dbus.SessionBus(private=True)\
+            .AndReturn(session_bus)
+        session_bus.name_has_owner("org.gnome.Tomboy")\
+            .AndReturn(False)
+        session_bus.close()
+
+        self.m.ReplayAll()
+
+        sys.argv = ["app_name", "list", "--backend=auto"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.expected_list_from_files + os.linesep,
+            sys.stdout.getvalue()
+        )
+        self.assertEquals(
+            "app_name: Note: Tomboy is not running. Notes are read from "
+                "%s as they were last saved.\n" % os.path.join(
+                    self.cache_home, "data", "tomboy"
+                ),
+            sys.stderr.getvalue()
+        )
+
+    def test_display_from_note_files(self):
+        """Acceptance: "--backend=files" displays notes from note files."""
+        self.use_note_files()
+
+        self.m.ReplayAll()
+
+        sys.argv = [
+            "unused_prog_name", "display", "--backend=files", "addressbook"
+        ]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.expected_display_from_files + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_display_deleted_note_file(self):
+        """Acceptance: A cached note whose file was deleted is not found."""
+        self.use_note_files()
+
+        self.m.ReplayAll()
+
+        sys.argv = [
+            "unused_prog_name", "display", "--backend=files", "addressbook"
+        ]
+        cli.CommandLine().main()
+
+        directory = os.path.join(self.cache_home, "data", "tomboy")
+        for path in os.listdir(directory):
+            with open( os.path.join(directory, path) ) as note_file:
+                if "<title>addressbook</title>" in note_file.read():
+                    os.remove( os.path.join(directory, path) )
+
+        self.assertRaises(SystemExit, cli.CommandLine().main)
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.expected_display_from_files + os.linesep,
+            sys.stdout.getvalue()
+        )
+        self.assertEquals(
+            """unused_prog_name: Error: Note named "addressbook" was not """
+                """found.""" + os.linesep,
+            sys.stderr.getvalue()
+        )
+
     def test_notes_displaying(self):
         """Acceptance: Action "display" prints the content given note names."""
         list_of_notes = test_data.full_list_of_notes(self.m)
@@ -271,6 +709,31 @@ class AcceptanceTests(BasicMocking, CLIMocking):
             sys.stdout.getvalue()
         )
 
+    def test_display_without_cache(self):
+        """Acceptance: Action "display" doesn't fetch dates of notes."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        python_work = list_of_notes[4]
+
+        self.dbus_interface.FindNote(python_work.title)\
+            .AndReturn(python_work.uri)
+        self.dbus_interface.GetTagsForNote(python_work.uri)\
+            .AndReturn(python_work.tags)
+        self.dbus_interface.GetNoteContents(python_work.uri)\
+            .AndReturn(test_data.note_contents_from_dbus["python-work"])
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "display", "--no-cache", "python-work"]
+        tomtom_cli = cli.CommandLine()
+        tomtom_cli.main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.note_contents_from_dbus["python-work"] + os.linesep,
+            sys.stdout.getvalue()
+        )
+
     def test_note_does_not_exist(self):
         """Acceptance: Specified note non-existant: display an error."""
         self.dbus_interface.FindNote("unexistant")\
@@ -289,6 +752,98 @@ class AcceptanceTests(BasicMocking, CLIMocking):
 
         self.m.VerifyAll()
 
+    def test_notes_do_not_exist(self):
+        """Acceptance: All names of notes that don't exist are reported."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        todo = list_of_notes[1]
+
+        self.dbus_interface.FindNote("unexistant")\
+            .AndReturn(dbus.String(""))
+        self.dbus_interface.FindNote(todo.title)\
+            .AndReturn(todo.uri)
+        self.dbus_interface.FindNote("other")\
+            .AndReturn(dbus.String(""))
+
+        self.m.ReplayAll()
+
+        sys.argv = ["app_name", "display", "unexistant", todo.title, "other"]
+        tomtom_cli = cli.CommandLine()
+        self.assertRaises(SystemExit, tomtom_cli.main)
+
+        self.assertEquals(
+            test_data.unexistant_notes_error + os.linesep,
+            sys.stderr.getvalue()
+        )
+
+        self.m.VerifyAll()
+
+    def test_display_from_cache(self):
+        """Acceptance: Names of unchanged notes are found in the cache."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        python_work = list_of_notes[4]
+
+        self.mock_out_get_notes_by_names([python_work])
+        self.dbus_interface.GetNoteContents(python_work.uri)\
+            .AndReturn(test_data.note_contents_from_dbus["python-work"])
+
+        # Second run: the date tells that the cached title and content are
+        # still right.
+        self.mock_out_connection("Tomboy")
+        self.dbus_interface.GetNoteChangeDate(python_work.uri)\
+            .AndReturn(python_work.date)
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "display", "python-work"]
+        cli.CommandLine().main()
+        sys.argv = ["unused_prog_name", "display", "PYTHON-work"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            (test_data.note_contents_from_dbus["python-work"] + os.linesep) * 2,
+            sys.stdout.getvalue()
+        )
+
+    def test_list_after_display_by_name(self):
+        """Acceptance: Names given in another case are not cached as titles."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        todo = list_of_notes[1]
+
+        self.dbus_interface.FindNote("todo-LIST")\
+            .AndReturn(todo.uri)
+        self.dbus_interface.GetNoteChangeDate(todo.uri)\
+            .AndReturn(todo.date)
+        self.dbus_interface.GetNoteTitle(todo.uri)\
+            .AndReturn(todo.title)
+        self.dbus_interface.GetTagsForNote(todo.uri)\
+            .AndReturn(todo.tags)
+        self.dbus_interface.GetNoteContents(todo.uri)\
+            .AndReturn(test_data.note_contents_from_dbus["TODO-list"])
+
+        # Second run: the title comes from the cache.
+        self.mock_out_connection("Tomboy")
+        self.mock_out_listing([todo], cached=True)
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "display", "todo-LIST"]
+        cli.CommandLine().main()
+        sys.stdout.truncate(0)
+        sys.argv = ["unused_prog_name", "list"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            [
+                line for line in test_data.expected_list.splitlines()
+                if "TODO-list" in line
+            ],
+            sys.stdout.getvalue().splitlines()
+        )
+
     def test_display_zero_argument(self):
         """Acceptance: Action "display" with no argument prints an error."""
         sys.argv = ["app_name", "display"]
@@ -308,20 +863,211 @@ class AcceptanceTests(BasicMocking, CLIMocking):
             sys.stderr.getvalue()
         )
 
+    def mock_out_note_contents(self, notes):
+        """Create mocks for fetching the contents of a list of notes.
+
+        Contents are returned as unicode strings, like dbus does.
+
+        """
+        for note in notes:
+            content = test_data.note_contents_from_dbus[note.title]
+            self.dbus_interface.GetNoteContents(note.uri)\
+                .AndReturn( content.decode("utf-8") )
+
     def test_search(self):
         """Acceptance: Action "search" searches in all notes, case-indep."""
         list_of_notes = test_data.full_list_of_notes(self.m)
 
+        # All notes get indexed, then only the notes that contain the words are
+        # searched. Their contents come from the content cache.
+        self.mock_out_listing(list_of_notes)
+        self.mock_out_note_contents(list_of_notes[:-1])
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "search", "john doe"]
+        tomtom_cli = cli.CommandLine()
+        tomtom_cli.main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.search_results + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_search_word_split_by_markup(self):
+        """Acceptance: Action "search" finds words split by formatting."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        # If "Chicken" is written "<bold>Chick</bold>en" in the addressbook,
+        # the application's search doesn't find it. It is not asked: the index
+        # is made from the text of notes, without formatting.
         self.mock_out_listing(list_of_notes)
+        self.mock_out_note_contents(list_of_notes[:-1])
 
-        # Forget about the last note (a template)
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "search", "chicken"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            "addressbook : 1 : Momma Chicken - 444-1919" + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_search_without_cache(self):
+        """Acceptance: Without the index, all notes are searched."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        # The application's search is not asked: it could miss some notes.
+        self.dbus_interface.ListAllNotes()\
+            .AndReturn([n.uri for n in list_of_notes])
+        self.dbus_interface.GetAllNotesWithTag("system:template")\
+            .AndReturn([list_of_notes[-1].uri])
         for note in list_of_notes[:-1]:
-            self.dbus_interface.GetNoteContents(note.uri)\
-                .AndReturn(test_data.note_contents_from_dbus[note.title])
+            self.dbus_interface.GetNoteTitle(note.uri)\
+                .AndReturn(note.title)
+            self.dbus_interface.GetTagsForNote(note.uri)\
+                .AndReturn(note.tags)
+        self.mock_out_note_contents(list_of_notes[:-1])
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "search", "--no-cache", "john doe"]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.search_results + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_search_with_application_search(self):
+        """Acceptance: "--application-search" narrows a search without index."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        matching_titles = ["addressbook", "business contacts"]
+
+        # The application finds notes that have the words on different lines
+        # too. Those get searched but have no results.
+        found_notes = [
+            n for n in list_of_notes
+            if n.title in matching_titles + ["python-work"]
+        ]
+
+        self.dbus_interface.ListAllNotes()\
+            .AndReturn([n.uri for n in list_of_notes])
+        self.dbus_interface.GetAllNotesWithTag("system:template")\
+            .AndReturn([list_of_notes[-1].uri])
+        for note in list_of_notes[:-1]:
+            self.dbus_interface.GetNoteTitle(note.uri)\
+                .AndReturn(note.title)
+            self.dbus_interface.GetTagsForNote(note.uri)\
+                .AndReturn(note.tags)
+        self.dbus_interface.SearchNotes("john doe", False)\
+            .AndReturn([n.uri for n in found_notes])
+        self.mock_out_note_contents(found_notes)
+
+        self.m.ReplayAll()
+
+        sys.argv = [
+            "unused_prog_name", "search", "--no-cache", "--application-search",
+            "john doe"
+        ]
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.search_results + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_search_with_jobs(self):
+        """Acceptance: Action "search" with "-j" keeps the order of notes."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes)
+        self.mock_out_note_contents(list_of_notes[:-1])
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "search", "-j", "3", "o[a-z]"]
+        tomtom_cli = cli.CommandLine()
+        tomtom_cli.main()
+
+        self.m.VerifyAll()
+
+        expected = []
+        for note in list_of_notes[:-1]:
+            content = test_data.note_contents_from_dbus[note.title]
+            for index, line in enumerate( content.splitlines()[1:] ):
+                if re.search("(?i)o[a-z]", line):
+                    expected.append("%s : %d : %s" % (note.title, index, line))
+
+        self.assertEquals(
+            os.linesep.join(expected) + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_search_with_index(self):
+        """Acceptance: Action "search" only indexes notes once."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes)
+        self.mock_out_note_contents(list_of_notes[:-1])
+
+        # Contents are found in the content cache.
+        self.mock_out_connection("Tomboy")
+        self.mock_out_listing(list_of_notes, cached=True)
 
         self.m.ReplayAll()
 
         sys.argv = ["unused_prog_name", "search", "john doe"]
+        cli.CommandLine().main()
+        cli.CommandLine().main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            (test_data.search_results + os.linesep) * 2,
+            sys.stdout.getvalue()
+        )
+
+    def test_search_regular_expression(self):
+        """Acceptance: Action "search" uses trigrams of regex literals."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        # Contents fetched to index notes are kept in the content cache.
+        self.mock_out_listing(list_of_notes)
+        self.mock_out_note_contents(list_of_notes[:-1])
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "search", "jo(h)?n.doe"]
+        tomtom_cli = cli.CommandLine()
+        tomtom_cli.main()
+
+        self.m.VerifyAll()
+
+        self.assertEquals(
+            test_data.search_results + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_search_without_literals(self):
+        """Acceptance: Action "search" goes through all notes for a regex."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.mock_out_listing(list_of_notes)
+        self.mock_out_note_contents(list_of_notes[:-1])
+
+        self.m.ReplayAll()
+
+        sys.argv = ["unused_prog_name", "search", "j.hn.d.e"]
         tomtom_cli = cli.CommandLine()
         tomtom_cli.main()
 
@@ -344,9 +1090,9 @@ class AcceptanceTests(BasicMocking, CLIMocking):
 
         self.mock_out_get_notes_by_names(requested_notes)
 
-        for note in requested_notes:
-            self.dbus_interface.GetNoteContents(note.uri)\
-                .AndReturn(test_data.note_contents_from_dbus[note.title])
+        # Notes are indexed, then searched since they all contain the word.
+        # Contents are only fetched once.
+        self.mock_out_note_contents(requested_notes)
 
         self.m.ReplayAll()
 
@@ -404,33 +1150,20 @@ class AcceptanceTests(BasicMocking, CLIMocking):
             "  action3 : No description available.",
         ]
 
+        # Entry points of the fake actions defined in this module.
         fake_plugin_list = [
             self.m.CreateMockAnything(),
             self.m.CreateMockAnything(),
             self.m.CreateMockAnything(),
         ]
-        fake_plugin_list[0].name = "action1"
-        fake_plugin_list[1].name = "action2"
-        fake_plugin_list[2].name = "action3"
-
-        fake_classes = [
-            self.m.CreateMock(plugins.ActionPlugin),
-            self.m.CreateMock(plugins.ActionPlugin),
-            self.m.CreateMock(plugins.ActionPlugin),
-        ]
-        fake_classes[0].short_description = "this action does something"
-        fake_classes[1].short_description = "this one too"
-        for fake_class in fake_classes:
-            fake_class.__bases__ = ( plugins.ActionPlugin, )
+        for index, entry_point in enumerate(fake_plugin_list):
+            entry_point.name = "action%d" % (index + 1)
+            entry_point.module_name = __name__
+            entry_point.attrs = ("FakeAction%d" % (index + 1), )
 
         pkg_resources.iter_entry_points(group="tomtom.actions")\
             .AndReturn( (x for x in fake_plugin_list) )
 
-        for index, entry_point in enumerate(fake_plugin_list):
-            fake_class = fake_classes[index]
-            entry_point.load()\
-                .AndReturn(fake_class)
-
         self.m.ReplayAll()
 
         sys.argv = ["app_name", argument]
@@ -462,7 +1195,7 @@ class AcceptanceTests(BasicMocking, CLIMocking):
         """Acceptance: Using "--with-templates" lists notes and templates."""
         list_of_notes = test_data.full_list_of_notes(self.m)
 
-        self.mock_out_listing(list_of_notes)
+        self.mock_out_listing(list_of_notes, templates=True)
 
         self.m.ReplayAll()
 
@@ -486,7 +1219,43 @@ class AcceptanceTests(BasicMocking, CLIMocking):
         """Acceptance: Using "-t" limits the notes by tags."""
         list_of_notes = test_data.full_list_of_notes(self.m)
 
-        self.mock_out_listing(list_of_notes)
+        self.mock_out_listing(
+            list_of_notes, tags=["system:notebook:pim", "projects"]
+        )
+
+        self.m.ReplayAll()
+
+        sys.argv = [
+            "app_name", "list",
+            "-t", "system:notebook:pim",
+            "-t", "projects"
+        ]
+        tomtom_cli = cli.CommandLine()
+        tomtom_cli.main()
+
+        self.m.VerifyAll()
+
+        self.assertEqual(
+            test_data.tag_limited_list + os.linesep,
+            sys.stdout.getvalue()
+        )
+
+    def test_filter_notes_by_tags_locally(self):
+        """Acceptance: Notes are filtered by "-t" without GetAllNotesWithTag."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        self.dbus_interface.ListAllNotes()\
+            .AndReturn([n.uri for n in list_of_notes])
+        self.dbus_interface.GetAllNotesWithTag("system:notebook:pim")\
+            .AndRaise( dbus.DBusException("UnknownMethod") )
+        for note in list_of_notes:
+            self.dbus_interface.GetNoteChangeDate(note.uri)\
+                .AndReturn(note.date)
+        for note in list_of_notes:
+            self.dbus_interface.GetNoteTitle(note.uri)\
+                .AndReturn(note.title)
+            self.dbus_interface.GetTagsForNote(note.uri)\
+                .AndReturn(note.tags)
 
         self.m.ReplayAll()
 
@@ -509,7 +1278,10 @@ class AcceptanceTests(BasicMocking, CLIMocking):
         """Acceptance: Using "-b" limits the notes by notebooks."""
         list_of_notes = test_data.full_list_of_notes(self.m)
 
-        self.mock_out_listing(list_of_notes)
+        self.mock_out_listing(
+            list_of_notes,
+            tags=["system:notebook:pim", "system:notebook:reminders"]
+        )
 
         self.m.ReplayAll()
 
@@ -649,7 +1421,7 @@ class AcceptanceTests(BasicMocking, CLIMocking):
 
         list_of_notes = test_data.full_list_of_notes(self.m)
 
-        self.mock_out_listing(list_of_notes[:10])
+        self.mock_out_listing(list_of_notes[:10], limited=True)
 
         self.m.ReplayAll()
 
@@ -44,14 +44,27 @@ tests a lot easier.
 """
 import os
 import sys
+import errno
 import datetime
 import time
 import dbus
 import pkg_resources
 import traceback
 import optparse
-
-from tomtom import core, cli, plugins
+import tempfile
+import shutil
+import json
+import threading
+import socket
+import select
+import subprocess
+import StringIO
+import types
+import cProfile
+import mox
+
+from tomtom import core, cli, plugins, cache, daemon, notefiles, index, \
+    registry, stats, matching, listener, shell, batch, contents
 # Import the list action under a different name to avoid overwriting the list()
 # builtin function.
 from tomtom.actions import display, list as _list, search, version
@@ -59,6 +72,61 @@ from tomtom.actions import display, list as _list, search, version
 import test_data
 from test_utils import *
 
+class FakeAsyncInterface(object):
+    """Dbus interface that accepts asynchronous calls.
+
+    Calls to any method are queued with their handlers. The reply to a call is
+    its first argument. Handlers are called only when "reply" is called,
+    unless the interface was created with immediate=True.
+
+    """
+    def __init__(self, immediate=False, fail_on=None):
+        self.immediate = immediate
+        self.fail_on = fail_on
+        self.queue = []
+        self.max_pending_seen = 0
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.queue.append(
+                (args[0], kwargs["reply_handler"], kwargs["error_handler"])
+            )
+            self.max_pending_seen = max(self.max_pending_seen, len(self.queue))
+
+            if self.immediate:
+                self.reply()
+
+        return method
+
+    def reply(self, last=False):
+        """Send the reply to the first (or last) call in the queue."""
+        if last:
+            argument, reply_handler, error_handler = self.queue.pop()
+        else:
+            argument, reply_handler, error_handler = self.queue.pop(0)
+
+        if argument == self.fail_on:
+            error_handler( dbus.DBusException("failed") )
+        else:
+            reply_handler(argument)
+
+class FakeMainLoop(object):
+    """Main loop that dispatches replies from a FakeAsyncInterface."""
+    def __init__(self, comm, reverse=False):
+        self.comm = comm
+        self.reverse = reverse
+        self.started = False
+        self.quitted = False
+
+    def run(self):
+        self.started = True
+
+        while self.comm.queue and not self.quitted:
+            self.comm.reply(last=self.reverse)
+
+    def quit(self):
+        self.quitted = True
+
 class TestMain(BasicMocking, CLIMocking):
     """Tests for functions in the main script.
 
@@ -100,6 +168,10 @@ class TestMain(BasicMocking, CLIMocking):
         arguments = ["arg1", "arg2"]
         sys.argv = ["app_name", "action"] + arguments
 
+        command_line.forward_to_daemon(
+            "action",
+            [unicode(arg) for arg in arguments]
+        ).AndReturn(None)
         command_line.dispatch("action", [unicode(arg) for arg in arguments] )
 
         self.m.ReplayAll()
@@ -108,6 +180,26 @@ class TestMain(BasicMocking, CLIMocking):
 
         self.m.VerifyAll()
 
+    def test_main_forwards_to_daemon(self):
+        """Main: Actions are forwarded to the daemon when it is running."""
+        command_line = self.wrap_subject(cli.CommandLine, "main")
+
+        sys.argv = ["app_name", "action", "arg1"]
+
+        command_line.forward_to_daemon("action", [u"arg1"])\
+            .AndReturn(201)
+
+        self.m.ReplayAll()
+
+        try:
+            command_line.main()
+        except SystemExit, exc:
+            self.assertEqual(201, exc.code)
+        else:
+            self.fail("main() did not exit with the daemon's status")
+
+        self.m.VerifyAll()
+
     def verify_exit_from_main(self,
             arguments, expected_text, output_stream):
 
@@ -178,6 +270,10 @@ class TestMain(BasicMocking, CLIMocking):
 
         processed_arguments = [ sys.argv[0], sys.argv[2], "-h" ]
 
+        command_line.forward_to_daemon(
+            "action",
+            [unicode(arg) for arg in processed_arguments[1:] ]
+        ).AndReturn(None)
         command_line.dispatch(
             "action",
             [unicode(arg) for arg in processed_arguments[1:] ]
@@ -205,53 +301,282 @@ class TestMain(BasicMocking, CLIMocking):
             output_stream=sys.stdout
         )
 
-    def test_list_of_actions(self):
-        """Main: list_of_actions returns classes of action plugins."""
+    def test_find_action(self):
+        """Main: find_action imports only the requested action plugin."""
+        command_line = self.wrap_subject(cli.CommandLine, "find_action")
+        self.m.StubOutWithMock(registry, "load_table")
+        self.m.StubOutWithMock(registry, "load_plugin")
+
+        entry = {"module": "tomtom.actions.action1", "attrs": ["Action1"]}
+
+        class Action1(plugins.ActionPlugin):
+            pass
+
+        registry.load_table()\
+            .AndReturn( {"actions": {"action1": entry}} )
+        registry.load_plugin(entry)\
+            .AndReturn(Action1)
+
+        self.m.ReplayAll()
+
+        self.assertEqual( Action1, command_line.find_action("action1") )
+        self.assertEqual( "action1", Action1.name )
+
+        self.m.VerifyAll()
+
+    def test_find_action_builds_table(self):
+        """Main: The table of actions is built if an action is not in it."""
+        command_line = self.wrap_subject(cli.CommandLine, "find_action")
+        self.m.StubOutWithMock(registry, "load_table")
+        self.m.StubOutWithMock(registry, "build_table")
+        self.m.StubOutWithMock(registry, "save_table")
+        self.m.StubOutWithMock(registry, "load_plugin")
+
+        entry = {"module": "tomtom.actions.action1", "attrs": ["Action1"]}
+        table = {"actions": {"action1": entry}}
+
+        registry.load_table()\
+            .AndReturn( {"actions": {}} )
+        registry.build_table()\
+            .AndReturn(table)
+        registry.save_table(table)
+        registry.load_plugin(entry)\
+            .AndReturn(plugins.ActionPlugin)
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            plugins.ActionPlugin,
+            command_line.find_action("action1")
+        )
+
+        self.m.VerifyAll()
+
+    def test_find_action_not_a_plugin(self):
+        """Main: Entry points that are not action plugins are not actions."""
+        command_line = self.wrap_subject(cli.CommandLine, "find_action")
+        self.m.StubOutWithMock(registry, "load_table")
+        self.m.StubOutWithMock(registry, "build_table")
+        self.m.StubOutWithMock(registry, "save_table")
+        self.m.StubOutWithMock(registry, "load_plugin")
+
+        entry = {"module": "tomtom.core", "attrs": ["Tomtom"]}
+        table = {"actions": {"action1": entry}}
+
+        registry.load_table()\
+            .AndReturn(table)
+        registry.load_plugin(entry)\
+            .AndReturn(core.Tomtom)
+        registry.load_table()\
+            .AndReturn(table)
+        registry.build_table()\
+            .AndReturn(table)
+        registry.save_table(table)
+
+        self.m.ReplayAll()
+
+        self.assertEqual( None, command_line.find_action("action1") )
+        self.assertEqual( None, command_line.find_action("unexistant") )
+
+        self.m.VerifyAll()
+
+    def test_find_action_moved_plugin(self):
+        """Main: The table of actions is built again if a plugin moved."""
+        command_line = self.wrap_subject(cli.CommandLine, "find_action")
+        self.m.StubOutWithMock(registry, "load_table")
+        self.m.StubOutWithMock(registry, "build_table")
+        self.m.StubOutWithMock(registry, "save_table")
+        self.m.StubOutWithMock(registry, "load_plugin")
+
+        old_entry = {"module": "tomtom_old.action1", "attrs": ["Action1"]}
+        new_entry = {"module": "tomtom_new.action1", "attrs": ["Action1"]}
+        old_table = {"actions": {"action1": old_entry}}
+        new_table = {"actions": {"action1": new_entry}}
+
+        registry.load_table()\
+            .AndReturn(old_table)
+        registry.load_plugin(old_entry)\
+            .AndRaise( ImportError("No module named tomtom_old.action1") )
+        registry.build_table()\
+            .AndReturn(new_table)
+        registry.save_table(new_table)
+        registry.load_plugin(new_entry)\
+            .AndReturn(plugins.ActionPlugin)
+
+        # A plugin that can't be imported from a new table is not an action.
+        registry.load_table()\
+            .AndReturn(old_table)
+        registry.load_plugin(old_entry)\
+            .AndRaise( ImportError("No module named tomtom_old.action1") )
+        registry.build_table()\
+            .AndReturn(old_table)
+        registry.save_table(old_table)
+        registry.load_plugin(old_entry)\
+            .AndRaise( ImportError("No module named tomtom_old.action1") )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            plugins.ActionPlugin,
+            command_line.find_action("action1")
+        )
+        self.assertEqual( None, command_line.find_action("action1") )
+
+        self.m.VerifyAll()
+
+    def test_action_descriptions_moved_plugin(self):
+        """Main: Actions are listed from a new table if a plugin moved."""
         command_line = self.wrap_subject(
             cli.CommandLine,
-            "list_of_actions"
+            "action_descriptions"
         )
-        self.m.StubOutWithMock(pkg_resources, "iter_entry_points")
+        self.m.StubOutWithMock(registry, "load_table")
+        self.m.StubOutWithMock(registry, "build_table")
+        self.m.StubOutWithMock(registry, "save_table")
+        self.m.StubOutWithMock(registry, "load_plugin")
+
+        class Action1(plugins.ActionPlugin):
+            short_description = "Do something."
+
+        old_entry = {"module": "tomtom_old.action1", "attrs": ["Action1"]}
+        new_entry = {"module": "tomtom_new.action1", "attrs": ["Action1"]}
+        broken = {"module": "tomtom_broken", "attrs": ["Action2"]}
+        new_table = {"actions": {"action1": new_entry, "action2": broken}}
+
+        registry.load_table()\
+            .AndReturn( {"actions": {"action1": old_entry}} )
+        registry.load_plugin(old_entry)\
+            .AndRaise( ImportError("No module named tomtom_old.action1") )
+        registry.build_table()\
+            .AndReturn(new_table)
+        registry.load_plugin(new_entry)\
+            .AndReturn(Action1)
+        registry.load_plugin(broken)\
+            .AndRaise( ImportError("No module named tomtom_broken") )
+        registry.save_table(new_table)
 
-        # Entry points as returned by pkg_resources
-        entry_points = [
-            self.m.CreateMock(pkg_resources.EntryPoint),
-            self.m.CreateMock(pkg_resources.EntryPoint),
-            self.m.CreateMock(pkg_resources.EntryPoint),
-            self.m.CreateMock(pkg_resources.EntryPoint),
-        ]
+        self.m.ReplayAll()
 
-        # Force the entry point names
-        for (index, entry_point) in enumerate(entry_points):
-            entry_point.name = "action%d" % index
+        self.assertEqual(
+            [("action1", "Do something.")],
+            command_line.action_descriptions()
+        )
 
-        # Plugin classes as returned by EntryPoint.load()
-        plugin_classes = [
-            plugins.ActionPlugin,
-            plugins.ActionPlugin,
-            plugins.ActionPlugin,
-            # The last one on the list is not a subclass of ActionPlugin and
-            # should get discarded
-            core.Tomtom,
-        ]
+        self.m.VerifyAll()
+
+        self.assertEqual( False, broken["plugin"] )
+
+    def test_path_stamp(self):
+        """Main: The current directory is not part of the path stamp."""
+        directory = tempfile.mkdtemp()
+        old_path = sys.path
+
+        try:
+            sys.path = ["", directory]
+
+            self.assertEqual(
+                [ [directory, os.stat(directory).st_mtime] ],
+                registry.path_stamp()
+            )
+        finally:
+            sys.path = old_path
+            shutil.rmtree(directory)
+
+    def test_action_descriptions(self):
+        """Main: Descriptions of actions are kept to avoid imports."""
+        command_line = self.wrap_subject(
+            cli.CommandLine,
+            "action_descriptions"
+        )
+        self.m.StubOutWithMock(registry, "load_table")
+        self.m.StubOutWithMock(registry, "save_table")
+        self.m.StubOutWithMock(registry, "load_plugin")
 
-        pkg_resources.iter_entry_points(group="tomtom.actions")\
-            .AndReturn(entry_points)
+        class Action2(plugins.ActionPlugin):
+            short_description = "Do something else."
+
+        described = {
+            "module": "tomtom.actions.action1", "attrs": ["Action1"],
+            "plugin": True, "description": "Do something.",
+        }
+        undescribed = {"module": "tomtom.actions.action2", "attrs": ["Action2"]}
+        not_an_action = {"module": "tomtom.core", "attrs": ["Tomtom"]}
+        table = {
+            "actions": {
+                "action1": described,
+                "action2": undescribed,
+                "not_an_action": not_an_action,
+            }
+        }
 
-        for (index, entry_point) in enumerate(entry_points):
-            entry_point.load()\
-                .AndReturn( plugin_classes[index] )
+        # Only plugins without a description are imported.
+        registry.load_table()\
+            .AndReturn(table)
+        registry.load_plugin(undescribed)\
+            .AndReturn(Action2)
+        registry.load_plugin(not_an_action)\
+            .AndReturn(core.Tomtom)
+        registry.save_table(table)
 
         self.m.ReplayAll()
 
-        # "name" attributes are irrelevant here as 3 classes are the same
         self.assertEqual(
-            plugin_classes[:-1],
-            command_line.list_of_actions()
+            [("action1", "Do something."), ("action2", "Do something else.")],
+            command_line.action_descriptions()
         )
 
         self.m.VerifyAll()
 
+        self.assertEqual( False, not_an_action["plugin"] )
+
+    def test_fast_start(self):
+        """Main: Help and version don't import dbus or pkg_resources."""
+        cache_home = tempfile.mkdtemp()
+
+        script = "; ".join([
+            "import sys",
+            "sys.argv = ['tomtom'] + sys.argv[1:]",
+            "from tomtom import cli",
+            "cli.exception_wrapped_main()",
+        ])
+        check = "; ".join([
+            "import sys, atexit",
+            "atexit.register(lambda: sys.__stderr__.write('imported:' + "
+                "' '.join(m for m in ['dbus', 'pkg_resources'] "
+                "if m in sys.modules)))",
+            script,
+        ])
+
+        environment = dict(os.environ)
+        environment["XDG_CACHE_HOME"] = cache_home
+        environment["XDG_RUNTIME_DIR"] = cache_home
+        environment["PYTHONPATH"] = os.pathsep.join(
+            [os.path.dirname(os.path.dirname(cli.__file__))] + sys.path
+        )
+
+        def imported_modules(arguments):
+            process = subprocess.Popen(
+                [sys.executable, "-c", check] + arguments,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env=environment
+            )
+            output, errors = process.communicate()
+
+            return errors.splitlines()[-1:]
+
+        try:
+            # The first listing of actions builds the table of actions.
+            imported_modules(["-h"])
+
+            self.assertEqual( ["imported:"], imported_modules(["-v"]) )
+            self.assertEqual( ["imported:"], imported_modules(["-h"]) )
+            self.assertEqual(
+                ["imported:"],
+                imported_modules(["list", "-h"])
+            )
+        finally:
+            shutil.rmtree(cache_home)
+
     def test_load_action(self):
         """Main: Initialize an action plugin instance."""
         command_line = self.wrap_subject(
@@ -259,15 +584,11 @@ class TestMain(BasicMocking, CLIMocking):
             "load_action"
         )
 
-        action1 = self.m.CreateMockAnything()
-        action1.name = "action1"
         action2 = self.m.CreateMockAnything()
-        action2.name = "action2"
-
         mock_class = self.m.CreateMockAnything()
 
-        command_line.list_of_actions()\
-            .AndReturn( [action1, action2] )
+        command_line.find_action("action2")\
+            .AndReturn(action2)
 
         action2()\
             .AndReturn( mock_class )
@@ -292,8 +613,8 @@ class TestMain(BasicMocking, CLIMocking):
 
         sys.argv = ["app_name"]
 
-        command_line.list_of_actions()\
-            .AndReturn( [] )
+        command_line.find_action("unexistant_action")\
+            .AndReturn(None)
 
         os.path.basename("app_name")\
             .AndReturn("app_name")
@@ -319,15 +640,11 @@ class TestMain(BasicMocking, CLIMocking):
             "action_short_summaries"
         )
 
-        action1 = self.m.CreateMockAnything()
-        action1.name = "action1"
-        action1.short_description = test_data.module1_description
-        action2 = self.m.CreateMockAnything()
-        action2.name = "otheraction"
-        action2.short_description = None
-
-        command_line.list_of_actions()\
-            .AndReturn( [action1, action2] )
+        command_line.action_descriptions()\
+            .AndReturn([
+                ("action1", test_data.module1_description),
+                ("otheraction", None),
+            ])
 
         self.m.ReplayAll()
 
@@ -345,8 +662,6 @@ class TestMain(BasicMocking, CLIMocking):
 
         fake_tomtom = self.m.CreateMock(core.Tomtom)
 
-        self.m.StubOutWithMock(core, "Tomtom", use_mock_anything=True)
-
         action_name = "some_action"
         fake_action = self.m.CreateMock(plugins.ActionPlugin)
         arguments = self.m.CreateMock(list)
@@ -355,6 +670,10 @@ class TestMain(BasicMocking, CLIMocking):
         options.gnote = False
         if app_name == "Gnote":
             options.gnote = True
+        options.stats = False
+        options.trace_file = None
+        options.profile = None
+        options.backend = "dbus"
 
         command_line.load_action(action_name)\
             .AndReturn(fake_action)
@@ -363,11 +682,11 @@ class TestMain(BasicMocking, CLIMocking):
             .AndReturn( (options, positional_arguments) )
 
         if exception_class == core.ConnectionError:
-            core.Tomtom(app_name)\
+            command_line.connect(app_name, options)\
                 .AndRaise( exception_class(exception_argument) )
             return (command_line, action_name, fake_action, arguments)
         else:
-            core.Tomtom(app_name)\
+            command_line.connect(app_name, options)\
                 .AndReturn( fake_tomtom )
 
         if exception_class:
@@ -390,6 +709,80 @@ class TestMain(BasicMocking, CLIMocking):
 
         self.m.VerifyAll()
 
+    def test_dispatch_with_stats(self):
+        """Main: With "--stats", dispatch reports calls and phases."""
+        command_line = self.wrap_subject(cli.CommandLine, "dispatch")
+
+        fake_tomtom = self.m.CreateMock(core.Tomtom)
+        fake_action = self.m.CreateMock(plugins.ActionPlugin)
+        fake_stats = self.m.CreateMock(stats.Stats)
+        options = self.m.CreateMock(optparse.Values)
+        options.gnote = False
+        options.stats = True
+        options.trace_file = None
+        options.profile = None
+        options.backend = "dbus"
+
+        self.m.StubOutWithMock(stats, "Stats", use_mock_anything=True)
+
+        command_line.load_action("list")\
+            .AndReturn(fake_action)
+        command_line.parse_options(fake_action, [])\
+            .AndReturn( (options, []) )
+        command_line.connect("Tomboy", options)\
+            .AndReturn(fake_tomtom)
+
+        stats.Stats(trace=False)\
+            .AndReturn(fake_stats)
+        for phase in ["plugin loading", "option parsing", "connection"]:
+            fake_stats.add_phase(phase, mox.IsA(float), mox.IsA(float))
+        fake_stats.instrument(fake_action)
+        fake_stats.enter("format")
+
+        fake_action.perform_action(options, [])
+
+        fake_stats.leave()
+        fake_stats.restore()
+        fake_stats.report(sys.stderr)
+
+        self.m.ReplayAll()
+
+        command_line.dispatch("list", [])
+
+        self.m.VerifyAll()
+
+    def test_dispatch_profile_connection_error(self):
+        """Main: The profiler is stopped if the connection fails."""
+        command_line = self.wrap_subject(cli.CommandLine, "dispatch")
+
+        fake_action = self.m.CreateMock(plugins.ActionPlugin)
+        profiler = self.m.CreateMock(cProfile.Profile)
+        options = self.m.CreateMock(optparse.Values)
+        options.gnote = False
+        options.stats = False
+        options.trace_file = None
+        options.profile = "list.prof"
+        options.backend = "dbus"
+
+        self.m.StubOutWithMock(cProfile, "Profile", use_mock_anything=True)
+
+        command_line.load_action("list")\
+            .AndReturn(fake_action)
+        command_line.parse_options(fake_action, [])\
+            .AndReturn( (options, []) )
+        cProfile.Profile()\
+            .AndReturn(profiler)
+        profiler.enable()
+        command_line.connect("Tomboy", options)\
+            .AndRaise( core.ConnectionError("no bus") )
+        profiler.disable()
+
+        self.m.ReplayAll()
+
+        self.assertRaises(SystemExit, command_line.dispatch, "list", [])
+
+        self.m.VerifyAll()
+
     def test_dispatch_with_gnote(self):
         """Main: Dispatch instantiates Tomtom for Gnote."""
         command_line, action_name, fake_action, arguments = \
@@ -401,6 +794,174 @@ class TestMain(BasicMocking, CLIMocking):
 
         self.m.VerifyAll()
 
+    def test_dispatch_with_auto_backend(self):
+        """Main: The "auto" backend is resolved before connecting."""
+        command_line = self.wrap_subject(cli.CommandLine, "dispatch")
+
+        fake_tomtom = self.m.CreateMock(core.Tomtom)
+        fake_action = self.m.CreateMock(plugins.ActionPlugin)
+        options = self.m.CreateMock(optparse.Values)
+        options.gnote = False
+        options.stats = False
+        options.trace_file = None
+        options.profile = None
+        options.backend = "auto"
+
+        command_line.load_action("list")\
+            .AndReturn(fake_action)
+        command_line.parse_options(fake_action, [])\
+            .AndReturn( (options, []) )
+        command_line.choose_backend("Tomboy", fake_action)\
+            .AndReturn("files")
+        command_line.connect("Tomboy", options)\
+            .AndReturn(fake_tomtom)
+        fake_action.perform_action(options, [])
+
+        self.m.ReplayAll()
+
+        command_line.dispatch("list", [])
+
+        self.m.VerifyAll()
+
+        self.assertEqual("files", options.backend)
+
+    def test_choose_backend(self):
+        """Main: Note files are read when the application is not running."""
+        command_line = self.wrap_subject(cli.CommandLine, "choose_backend")
+        action = plugins.ActionPlugin()
+        action.needs_application = False
+        sys.argv = ["app_name", "list"]
+
+        self.m.StubOutWithMock(core, "application_is_running")
+        self.m.StubOutWithMock(notefiles, "note_directory")
+
+        core.application_is_running("Tomboy")\
+            .AndReturn(True)
+        core.application_is_running("Tomboy")\
+            .AndReturn(False)
+        notefiles.note_directory("Tomboy")\
+            .AndReturn("/home/user/.local/share/tomboy")
+        core.application_is_running("Tomboy")\
+            .AndReturn(False)
+        notefiles.note_directory("Tomboy")\
+            .AndReturn(None)
+
+        self.m.ReplayAll()
+
+        self.assertEqual("dbus", command_line.choose_backend("Tomboy", action))
+        self.assertEqual(
+            "files",
+            command_line.choose_backend("Tomboy", action)
+        )
+        # Without note files, the application is the only source of notes.
+        self.assertEqual("dbus", command_line.choose_backend("Tomboy", action))
+
+        # Other actions need the application, running or not.
+        action.needs_application = True
+        self.assertEqual("dbus", command_line.choose_backend("Tomboy", action))
+
+        self.m.VerifyAll()
+
+        self.assertEqual(
+            "app_name: Note: Tomboy is not running. Notes are read from "
+                "/home/user/.local/share/tomboy as they were last saved.\n",
+            sys.stderr.getvalue()
+        )
+
+    def test_application_is_running(self):
+        """Main: Whether the application runs is asked to the bus."""
+        session_bus = self.m.CreateMockAnything()
+
+        self.m.StubOutWithMock(dbus, "SessionBus", use_mock_anything=True)
+
+        # The shared connection is left alone for the main loop to use.
+        dbus.SessionBus(private=True)\
+            .AndReturn(session_bus)
+        session_bus.name_has_owner("org.gnome.Gnote")\
+            .AndReturn(1)
+        session_bus.close()
+        dbus.SessionBus(private=True)\
+            .AndReturn(session_bus)
+        session_bus.name_has_owner("org.gnome.Gnote")\
+            .AndRaise( dbus.DBusException("disconnected") )
+        session_bus.close()
+        dbus.SessionBus(private=True)\
+            .AndRaise( dbus.DBusException("no session bus") )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(True, core.application_is_running("Gnote"))
+        self.assertEqual(False, core.application_is_running("Gnote"))
+        self.assertEqual(False, core.application_is_running("Gnote"))
+
+        self.m.VerifyAll()
+
+    def test_connect(self):
+        """Main: Connections are opened once and reused."""
+        command_line = self.wrap_subject(cli.CommandLine, "connect")
+        command_line.connections = {}
+
+        fake_tomtom = self.m.CreateMock(core.Tomtom)
+        fake_cache = self.m.CreateMock(cache.MetadataCache)
+        fake_index = self.m.CreateMock(index.WordIndex)
+        fake_contents = self.m.CreateMock(contents.ContentCache)
+        options = self.m.CreateMock(optparse.Values)
+        options.backend = "dbus"
+        options.pipelined = True
+        options.no_cache = False
+
+        self.m.StubOutWithMock(core, "Tomtom", use_mock_anything=True)
+
+        command_line.open_cache("Gnote")\
+            .AndReturn(fake_cache)
+        command_line.open_index("Gnote")\
+            .AndReturn(fake_index)
+        command_line.open_contents("Gnote")\
+            .AndReturn(fake_contents)
+        core.Tomtom(
+            "Gnote",
+            pipelined=True,
+            cache=fake_cache,
+            backend="dbus",
+            index=fake_index,
+            contents=fake_contents
+        ).AndReturn(fake_tomtom)
+
+        self.m.ReplayAll()
+
+        self.assertEqual( fake_tomtom, command_line.connect("Gnote", options) )
+        self.assertEqual( fake_tomtom, command_line.connect("Gnote", options) )
+
+        self.m.VerifyAll()
+
+    def test_connect_without_cache(self):
+        """Main: No cache is opened with --no-cache."""
+        command_line = self.wrap_subject(cli.CommandLine, "connect")
+        command_line.connections = {}
+
+        fake_tomtom = self.m.CreateMock(core.Tomtom)
+        options = self.m.CreateMock(optparse.Values)
+        options.backend = "files"
+        options.pipelined = False
+        options.no_cache = True
+
+        self.m.StubOutWithMock(core, "Tomtom", use_mock_anything=True)
+
+        core.Tomtom(
+            "Tomboy",
+            pipelined=False,
+            cache=None,
+            backend="files",
+            index=None,
+            contents=None
+        ).AndReturn(fake_tomtom)
+
+        self.m.ReplayAll()
+
+        self.assertEqual( fake_tomtom, command_line.connect("Tomboy", options) )
+
+        self.m.VerifyAll()
+
     def verify_dispatch_exception(self, exception_class,
             exception_out=None, exception_argument="",
             expected_text=""):
@@ -482,6 +1043,25 @@ class TestMain(BasicMocking, CLIMocking):
         command_line, action_name, fake_action, arguments = \
             self.mock_out_dispatch(Exception, "something happened")
 
+        command_line.report_malformed_action(action_name)\
+            .AndRaise( SystemExit(cli.MALFORMED_ACTION_RETURN_CODE) )
+
+        self.m.ReplayAll()
+
+        self.assertRaises(
+            SystemExit,
+            command_line.dispatch, action_name, arguments
+        )
+
+        self.m.VerifyAll()
+
+    def test_report_malformed_action(self):
+        """Main: Unknown exceptions from actions are reported."""
+        command_line = self.wrap_subject(
+            cli.CommandLine,
+            "report_malformed_action"
+        )
+
         sys.argv = ["app_name"]
 
         old_print_exc = traceback.print_exc
@@ -494,10 +1074,13 @@ class TestMain(BasicMocking, CLIMocking):
 
         self.m.ReplayAll()
 
-        self.assertRaises(
-            SystemExit,
-            command_line.dispatch, action_name, arguments
-        )
+        try:
+            raise Exception("something happened")
+        except Exception:
+            self.assertRaises(
+                SystemExit,
+                command_line.report_malformed_action, "some_action"
+            )
 
         self.m.VerifyAll()
 
@@ -508,6 +1091,29 @@ class TestMain(BasicMocking, CLIMocking):
 
         traceback.print_exc = old_print_exc
 
+    def test_dispatch_handles_broken_pipe(self):
+        """Main: A closed output pipe ends the action quietly."""
+        command_line, action_name, fake_action, arguments = \
+            self.mock_out_dispatch(
+                lambda message: IOError(errno.EPIPE, message),
+                "Broken pipe"
+            )
+
+        command_line.silence_stdout()
+
+        self.m.ReplayAll()
+
+        try:
+            command_line.dispatch(action_name, arguments)
+        except SystemExit, exc:
+            self.assertEqual(0, exc.code)
+        else:
+            self.fail("dispatch should exit")
+
+        self.m.VerifyAll()
+
+        self.assertEqual( "", sys.stderr.getvalue() )
+
     def test_dispatch_handles_option_type_exceptions(self):
         """Main: dispatch prints an error if an option is of the wrong type."""
         command_line = self.wrap_subject(cli.CommandLine, "dispatch")
@@ -647,15 +1253,67 @@ class TestMain(BasicMocking, CLIMocking):
         self.m.StubOutWithMock(optparse, "Option", use_mock_anything=True)
 
         gnote_option = self.m.CreateMock(optparse.Option)
+        backend_option = self.m.CreateMock(optparse.Option)
+        pipelined_option = self.m.CreateMock(optparse.Option)
+        no_cache_option = self.m.CreateMock(optparse.Option)
+        stats_option = self.m.CreateMock(optparse.Option)
+        profile_option = self.m.CreateMock(optparse.Option)
+        trace_file_option = self.m.CreateMock(optparse.Option)
 
         options = [
             gnote_option,
+            backend_option,
+            pipelined_option,
+            no_cache_option,
+            stats_option,
+            profile_option,
+            trace_file_option,
         ]
 
         optparse.Option(
             "--gnote", dest="gnote", action="store_true",
             help="Make tomtom connect to Gnote via DBus instead of Tomboy."
         ).AndReturn(gnote_option)
+        optparse.Option(
+            "--backend", dest="backend", default="dbus",
+            type="choice", choices=["dbus", "files"],
+            help="""How to read notes: "dbus" talks to the running """
+            """application, "files" reads note files directly, which """
+            """doesn't need the application to be running. Default: """
+            """%default."""
+        ).AndReturn(backend_option)
+        optparse.Option(
+            "--pipelined", dest="pipelined", action="store_true",
+            default=False,
+            help="""Fetch information about notes with asynchronous """
+            """DBus calls. This is much faster with a large number of """
+            """notes."""
+        ).AndReturn(pipelined_option)
+        optparse.Option(
+            "--no-cache", dest="no_cache", action="store_true",
+            default=False,
+            help="""Don't use the cache of note information. All """
+            """information is fetched from the application."""
+        ).AndReturn(no_cache_option)
+        optparse.Option(
+            "--stats", dest="stats", action="store_true",
+            default=False,
+            help="""Print on standard error how many calls were made to """
+            """the application, how much data they returned, how long """
+            """they took, and where time was spent."""
+        ).AndReturn(stats_option)
+        optparse.Option(
+            "--profile", dest="profile", metavar="FILE",
+            help="""Profile the action with cProfile and write the """
+            """statistics to FILE. They can be read with the pstats """
+            """module."""
+        ).AndReturn(profile_option)
+        optparse.Option(
+            "--trace-file", dest="trace_file", metavar="FILE",
+            help="""Write a trace of the calls made to the application """
+            """and of the phases of the action to FILE, in the Chrome """
+            """trace event format."""
+        ).AndReturn(trace_file_option)
 
         self.m.ReplayAll()
 
@@ -705,68 +1363,87 @@ class TestCore(BasicMocking):
         dbus.SessionBus = old_SessionBus
         dbus.Interface = old_Interface
 
-    def mock_out_TomboyNote_and_verify_constructor(self, **kwargs):
-        """Build a TomboyNote mock and make __init__ its test subject."""
-        tn = self.wrap_subject(core.TomboyNote, "__init__")
-
-        self.m.ReplayAll()
-
-        tn.__init__(**kwargs)
-
-        self.m.VerifyAll()
-
-        return tn
-
     def test_TomboyNote_constructor_all_args_int64(self):
         """Core: TomboyNote initializes its instance variables. case 1."""
         uri1 = "note://something-like-this"
         title = "Name"
-        date_int64 = dbus.Int64()
+        date_int64 = dbus.Int64(1257805144L)
         tags = ["tag1", "tag2"]
 
         # case 1: Construct with all data and a dbus.Int64 date
-        tn = self.mock_out_TomboyNote_and_verify_constructor(
-            uri=uri1,
-            title=title,
-            date=date_int64,
-            tags=tags
-        )
+        tn = core.TomboyNote(uri=uri1, title=title, date=date_int64, tags=tags)
 
         self.assertEqual(uri1, tn.uri)
         self.assertEqual(title, tn.title)
-        self.assertEqual(date_int64, tn.date)
-        # Order is not important
-        self.assertEqual( set(tags), set(tn.tags) )
+        self.assertEqual(1257805144, tn.date)
+        self.assertEqual( ("tag1", "tag2"), tn.tags )
 
     def test_TomboyNote_constructor_all_defaults(self):
         """Core: TomboyNote initializes its instance variables. case 2."""
         uri2 = "note://another-false-uri"
 
-        tn = self.mock_out_TomboyNote_and_verify_constructor(uri=uri2)
+        tn = core.TomboyNote(uri=uri2)
 
         # case 2: Construct with only uri, rest is default
         self.assertEqual(tn.uri, uri2)
         self.assertEqual(tn.title, "")
-        self.assertEqual(tn.date, dbus.Int64() )
-        self.assertEqual(tn.tags, [])
+        self.assertEqual(tn.date, 0)
+        self.assertEqual(tn.tags, ())
 
     def test_TomboyNote_constructor_datetetime(self):
-        """Core: TomboyNote initializes its instance variables. case 2."""
+        """Core: TomboyNote initializes its instance variables. case 3."""
         datetime_date = datetime.datetime(2009, 11, 13, 18, 42, 23)
 
         # case 3: the date can be entered with a datetime.datetime
-        tn = self.mock_out_TomboyNote_and_verify_constructor(
-            uri="not important",
-            date=datetime_date
-        )
+        tn = core.TomboyNote(uri="not important", date=datetime_date)
 
         self.assertEqual(
-            dbus.Int64(
-                time.mktime( datetime_date.timetuple() )
-            ),
+            int( time.mktime( datetime_date.timetuple() ) ),
             tn.date
         )
 
+    def test_TomboyNote_native_types(self):
+        """Core: TomboyNote converts dbus types to native ones."""
+        tn = core.TomboyNote(
+            uri=dbus.String(u"note://tomboy/1"),
+            title=dbus.String(u"Name"),
+            date=dbus.Int64(12),
+            tags=dbus.Array([dbus.String(u"native tag")])
+        )
+        other = core.TomboyNote(uri=u"note://tomboy/2", tags=[u"native tag"])
+
+        self.assertEqual( unicode, type(tn.uri) )
+        self.assertEqual( unicode, type(tn.title) )
+        self.assertEqual( int, type(tn.date) )
+        self.assertEqual( unicode, type(tn.tags[0]) )
+
+        # Notes with the same tags share them.
+        self.assertTrue( tn.tags is other.tags )
+
+        self.assertRaises(AttributeError, setattr, tn, "something", 1)
+
+    def test_TomboyNote_lazy_fields(self):
+        """Core: TomboyNote fetches missing fields on first access only."""
+        source = self.m.CreateMockAnything()
+        uri = "note://tomboy/1"
+
+        source.GetNoteChangeDate(uri)\
+            .AndReturn( dbus.Int64(12) )
+
+        self.m.ReplayAll()
+
+        tn = core.TomboyNote(uri=uri, title="Name", tags=[], source=source)
+
+        self.assertEqual( "Name", tn.title )
+        self.assertEqual( (), tn.tags )
+        self.assertEqual( 12, tn.date )
+        self.assertEqual( 12, tn.date )
+
+        # Contents are not kept by notes, get_note_contents fetches them.
+        self.assertFalse( hasattr(tn, "content") )
+
+        self.m.VerifyAll()
+
     def test_get_notes(self):
         """Core: Note fetching entry point builds and filters a list."""
         tt = self.wrap_subject(core.Tomtom, "get_notes")
@@ -827,7 +1504,7 @@ class TestCore(BasicMocking):
 
         self.assertEqual(
             notes,
-            tt.filter_notes(notes, names=names)
+            list( tt.filter_notes(notes, names=names) )
         )
 
         self.m.VerifyAll()
@@ -887,7 +1564,7 @@ class TestCore(BasicMocking):
 
         self.assertEqual(
             expected_result,
-            tt.filter_by_tags(notes, tag_list=tag_list)
+            list( tt.filter_by_tags(notes, tag_list=tag_list) )
         )
 
         self.m.VerifyAll()
@@ -911,186 +1588,2432 @@ class TestCore(BasicMocking):
 
         self.assertEqual(
             expected_result,
-            tt.filter_out_templates(notes)
+            list( tt.filter_out_templates(notes) )
         )
 
         self.m.VerifyAll()
 
-    def verify_note_list(self, tt, notes, note_names=[]):
-        """Verify the outcome of Tomtom.get_notes().
+    def verify_note_list(self, result, notes):
+        """Verify that a list of notes is what we expect it to be.
 
-        This function verifies if notes received from calling
-        Tomtom.get_notes are what we expect them to be. It provokes
-        the unit test to fail in case of discordance.
+        TomboyNotes can't be compared directly so we need to convert them to
+        dictionaries. Order of the notes is important.
 
-        TomboyNotes are unhashable so we need to convert them to dictionaries
-        and check for list membership.
+        Arguments:
+            self   -- The TestCase instance
+            result -- list of TomboyNote objects to verify
+            notes  -- list of expected TomboyNote objects
+
+        """
+        as_dicts = lambda note_list: [{
+            "uri":n.uri,
+            "title":n.title,
+            "date":n.date,
+            "tags":list(n.tags),
+        } for n in note_list]
+
+        self.assertEqual( as_dicts(notes), as_dicts(result) )
+
+    def test_build_note_list_by_names(self):
+        """Core: Tomtom gets a list of given named notes."""
+        tt = self.wrap_subject(core.Tomtom, "build_note_list")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        notes = [list_of_notes[1], list_of_notes[11]]
+        names = [n.title for n in notes]
+        pairs = [(n.uri, n.title) for n in notes]
+
+        tt.get_uris_by_name(names)\
+            .AndReturn( (pairs, {}) )
+        tt.generate_notes(pairs, core.NOTE_FIELDS, {}, None)\
+            .AndReturn( iter(notes) )
+
+        self.m.ReplayAll()
+
+        self.assertEqual( notes, list( tt.build_note_list(names=names) ) )
+
+        self.m.VerifyAll()
+
+    def test_build_note_list(self):
+        """Core: Tomtom gets a full list of notes."""
+        tt = self.wrap_subject(core.Tomtom, "build_note_list")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        pairs = [(n.uri, None) for n in list_of_notes]
+
+        tt.get_uris_for_n_notes(None, ([], ["system:template"]))\
+            .AndReturn( (pairs, {}, ([], ["system:template"])) )
+        tt.generate_notes(
+            pairs, core.NOTE_FIELDS, {}, ([], ["system:template"])
+        ).AndReturn( iter(list_of_notes) )
+
+        self.m.ReplayAll()
+
+        self.assertEqual( list_of_notes, list( tt.build_note_list() ) )
+
+        self.m.VerifyAll()
+
+    def test_build_note_list_selected_by_application(self):
+        """Core: Only notes with the requested tags are built."""
+        tt = self.wrap_subject(core.Tomtom, "build_note_list")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        selected = [list_of_notes[1], list_of_notes[5]]
+
+        tt.get_uris_for_n_notes(5, (["reminders"], ["system:template"]))\
+            .AndReturn( ([(n.uri, None) for n in selected], {}, None) )
+        tt.generate_notes(
+            [(n.uri, None) for n in selected], core.NOTE_FIELDS, {}, None
+        ).AndReturn( iter(selected) )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            selected,
+            list( tt.build_note_list(count_limit=5, tags=["reminders"]) )
+        )
+
+        self.m.VerifyAll()
+
+    def test_build_note_list_limited_after_selection(self):
+        """Core: Notes that are filtered out don't count in the limit."""
+        tt = self.wrap_subject(core.Tomtom, "build_note_list")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        pairs = [(n.uri, None) for n in list_of_notes]
+        selection = ([], ["system:template"])
+        kept = [n for n in list_of_notes if "system:template" not in n.tags]
+
+        tt.get_uris_for_n_notes(2, selection)\
+            .AndReturn( (pairs, {}, selection) )
+        tt.generate_notes(pairs, core.NOTE_FIELDS, {}, selection)\
+            .AndReturn( iter(list_of_notes) )
+        tt.filter_notes(
+            mox.IgnoreArg(), tags=[], exclude_templates=True
+        ).AndReturn( iter(kept) )
+
+        self.m.ReplayAll()
+
+        self.assertEqual( kept[:2], list( tt.build_note_list(count_limit=2) ) )
+
+        self.m.VerifyAll()
+
+    def test_select_uris_by_tags(self):
+        """Core: The application gives the notes that have tags."""
+        tt = self.wrap_subject(core.Tomtom, "select_uris_by_tags")
+        tt.comm = self.m.CreateMockAnything()
+
+        uris = ["note://tomboy/%d" % i for i in range(5)]
+
+        tt.call_many([
+            ("GetAllNotesWithTag", ("a", )),
+            ("GetAllNotesWithTag", ("b", )),
+            ("GetAllNotesWithTag", ("system:template", )),
+        ]).AndReturn([
+            [uris[1], uris[4]],
+            [uris[2], uris[1], "note://tomboy/not-listed"],
+            [uris[4]],
+        ])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            set(uris[1:3]),
+            tt.select_uris_by_tags(uris, ["a", "b"], ["system:template"])
+        )
+
+        self.m.VerifyAll()
+
+    def test_select_uris_by_tags_unknown_method(self):
+        """Core: Notes are filtered locally if the application can't."""
+        tt = self.wrap_subject(core.Tomtom, "select_uris_by_tags")
+        tt.comm = self.m.CreateMockAnything()
+
+        tt.call_many([("GetAllNotesWithTag", ("system:template", ))])\
+            .AndRaise( dbus.DBusException("UnknownMethod") )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            None,
+            tt.select_uris_by_tags(["note://tomboy/1"], [], ["system:template"])
+        )
+
+        self.m.VerifyAll()
+
+        # The files backend has no GetAllNotesWithTag method.
+        tt.comm = object()
+        self.assertEqual(
+            None,
+            tt.select_uris_by_tags(["note://tomboy/1"], [], ["system:template"])
+        )
+
+    def test_generate_notes(self):
+        """Core: Notes are fetched and given out one batch at a time."""
+        tt = self.wrap_subject(core.Tomtom, "generate_notes")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)[:3]
+        pairs = [(n.uri, None) for n in list_of_notes]
+
+        old_batch_size = core.NOTE_BATCH_SIZE
+        core.NOTE_BATCH_SIZE = 2
+
+        tt.fetch_notes(pairs[:2], core.NOTE_FIELDS, None)\
+            .AndReturn(list_of_notes[:2])
+
+        self.m.ReplayAll()
+
+        try:
+            notes = tt.generate_notes(pairs)
+
+            # The second batch is not fetched until it is needed.
+            self.assertEqual( list_of_notes[0], notes.next() )
+            self.assertEqual( list_of_notes[1], notes.next() )
+            self.m.VerifyAll()
+
+            self.m.ResetAll()
+            tt.fetch_notes(pairs[2:], core.NOTE_FIELDS, None)\
+                .AndReturn(list_of_notes[2:])
+            self.m.ReplayAll()
+
+            self.assertEqual( list_of_notes[2:], list(notes) )
+        finally:
+            core.NOTE_BATCH_SIZE = old_batch_size
+
+        self.m.VerifyAll()
+
+    def test_generate_notes_with_cache(self):
+        """Core: Tomtom uses the cache to build the list of notes."""
+        tt = self.wrap_subject(core.Tomtom, "generate_notes")
+
+        tt.cache = self.m.CreateMock(cache.MetadataCache)
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        pairs = [(n.uri, None) for n in list_of_notes]
+
+        tt.fetch_notes_with_cache(pairs, None, None)\
+            .AndReturn(list_of_notes)
+
+        self.m.ReplayAll()
+
+        self.assertEqual( list_of_notes, list( tt.generate_notes(pairs) ) )
+
+        self.m.VerifyAll()
+
+    def test_fetch_notes_by_names(self):
+        """Core: Titles are not fetched for notes that have a name."""
+        tt = self.wrap_subject(core.Tomtom, "fetch_notes")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        todo = list_of_notes[1]
+        recipes = list_of_notes[11]
+        notes = [todo, recipes]
+        names = [n.title for n in notes]
+
+        calls = []
+        replies = []
+        for note in notes:
+            calls.append( ("GetNoteChangeDate", (note.uri, )) )
+            calls.append( ("GetTagsForNote", (note.uri, )) )
+            replies.extend( [note.date, note.tags] )
+
+        tt.call_many(calls)\
+            .AndReturn(replies)
+
+        self.m.ReplayAll()
+
+        self.verify_note_list(
+            tt.fetch_notes( [(n.uri, n.title) for n in notes] ),
+            notes
+        )
+
+        self.m.VerifyAll()
+
+    def test_fetch_notes(self):
+        """Core: Tomtom fetches information about notes."""
+        tt = self.wrap_subject(core.Tomtom, "fetch_notes")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        calls = []
+        replies = []
+        for note in list_of_notes:
+            calls.append( ("GetNoteTitle", (note.uri, )) )
+            calls.append( ("GetNoteChangeDate", (note.uri, )) )
+            calls.append( ("GetTagsForNote", (note.uri, )) )
+            replies.extend( [note.title, note.date, note.tags] )
+
+        tt.call_many(calls)\
+            .AndReturn(replies)
+
+        self.m.ReplayAll()
+
+        self.verify_note_list(
+            tt.fetch_notes( [(n.uri, None) for n in list_of_notes] ),
+            list_of_notes
+        )
+
+        self.m.VerifyAll()
+
+    def test_fetch_notes_some_fields(self):
+        """Core: Only requested fields are fetched, others are left to notes."""
+        tt = self.wrap_subject(core.Tomtom, "fetch_notes")
+        tt.comm = self.m.CreateMockAnything()
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        notes = list_of_notes[:2]
+
+        calls = []
+        replies = []
+        for note in notes:
+            calls.append( ("GetTagsForNote", (note.uri, )) )
+            replies.append(note.tags)
+
+        tt.call_many(calls)\
+            .AndReturn(replies)
+        tt.comm.GetNoteChangeDate(notes[1].uri)\
+            .AndReturn(notes[1].date)
+
+        self.m.ReplayAll()
+
+        result = tt.fetch_notes(
+            [(n.uri, n.title) for n in notes],
+            fields=("tags", )
+        )
+
+        self.assertEqual(
+            [(n.uri, n.title, tuple(n.tags)) for n in notes],
+            [(n.uri, n.title, n.tags) for n in result]
+        )
+        # Only the date of the second note is used.
+        self.assertEqual( notes[1].date, result[1].date )
+
+        self.m.VerifyAll()
+
+    def test_fetch_notes_known_dates(self):
+        """Core: Dates that are already known are not fetched again."""
+        tt = self.wrap_subject(core.Tomtom, "fetch_notes")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        notes = list_of_notes[:2]
+
+        calls = []
+        replies = []
+        for note in notes:
+            calls.append( ("GetNoteTitle", (note.uri, )) )
+            calls.append( ("GetTagsForNote", (note.uri, )) )
+            replies.extend( [note.title, note.tags] )
+
+        tt.call_many(calls)\
+            .AndReturn(replies)
+
+        self.m.ReplayAll()
+
+        self.verify_note_list(
+            tt.fetch_notes(
+                [(n.uri, None) for n in notes],
+                dates=dict([(n.uri, n.date) for n in notes])
+            ),
+            notes
+        )
+
+        self.m.VerifyAll()
+
+    def test_fetch_notes_with_cache(self):
+        """Core: Only notes that changed since they were cached are fetched."""
+        tt = self.wrap_subject(core.Tomtom, "fetch_notes_with_cache")
+
+        tt.cache = self.m.CreateMock(cache.MetadataCache)
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        unchanged, changed, new = list_of_notes[:3]
+        notes = [unchanged, changed, new]
+        uris = [n.uri for n in notes]
+
+        tt.call_many([("GetNoteChangeDate", (uri, )) for uri in uris])\
+            .AndReturn([n.date for n in notes])
+        tt.cache.lookup(uris)\
+            .AndReturn({
+                unchanged.uri: (unchanged.title, unchanged.date, unchanged.tags),
+                changed.uri: ("old title", changed.date - 10, []),
+            })
+        tt.call_many([
+            ("GetNoteTitle", (changed.uri, )),
+            ("GetTagsForNote", (changed.uri, )),
+            ("GetNoteTitle", (new.uri, )),
+            ("GetTagsForNote", (new.uri, )),
+        ]).AndReturn([changed.title, changed.tags, new.title, new.tags])
+        tt.cache.store(mox.IgnoreArg())
+
+        self.m.ReplayAll()
+
+        self.verify_note_list(
+            tt.fetch_notes_with_cache( [(uri, None) for uri in uris] ),
+            notes
+        )
+
+        self.m.VerifyAll()
+
+    def test_fetch_notes_with_cache_selection(self):
+        """Core: Only notes selected by the cache's tag bitmaps are built."""
+        tt = self.wrap_subject(core.Tomtom, "fetch_notes_with_cache")
+
+        tt.cache = self.m.CreateMock(cache.MetadataCache)
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        notes = list_of_notes[:3]
+        uris = [n.uri for n in notes]
+
+        tt.call_many([("GetNoteChangeDate", (uri, )) for uri in uris])\
+            .AndReturn([n.date for n in notes])
+        tt.cache.lookup(uris)\
+            .AndReturn( dict([
+                (n.uri, (n.title, n.date, n.tags)) for n in notes
+            ]) )
+        tt.call_many([])\
+            .AndReturn([])
+        tt.cache.select(uris, ["projects"], ["system:template"])\
+            .AndReturn( set([notes[2].uri]) )
+
+        self.m.ReplayAll()
+
+        self.verify_note_list(
+            tt.fetch_notes_with_cache(
+                [(uri, None) for uri in uris],
+                None,
+                (["projects"], ["system:template"])
+            ),
+            notes[2:]
+        )
+
+        self.m.VerifyAll()
+
+    def test_tag_selection(self):
+        """Core: Filtering options are turned into tags to select by."""
+        self.assertEqual(
+            (["a"], ["system:template"]),
+            core.tag_selection(["a"])
+        )
+        self.assertEqual(
+            (["system:template"], []),
+            core.tag_selection(["system:template"])
+        )
+        self.assertEqual( None, core.tag_selection([], False) )
+
+    def test_get_uris_by_name(self):
+        """Core: Tomtom determines uris by names."""
+        tt = self.wrap_subject(core.Tomtom, "get_uris_by_name")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        r_n_d = list_of_notes[12]
+        webpidgin = list_of_notes[9]
+        names = [r_n_d.title, webpidgin.title]
+
+        tt.call_many([
+            ("FindNote", (r_n_d.title, )),
+            ("FindNote", (webpidgin.title, )),
+        ]).AndReturn([r_n_d.uri, webpidgin.uri])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            (
+                [(r_n_d.uri, r_n_d.title), (webpidgin.uri, webpidgin.title)],
+                {}
+            ),
+            tt.get_uris_by_name(names)
+        )
+
+        self.m.VerifyAll()
+
+    def test_get_uris_by_name_unexistant(self):
+        """Core: Tomtom raises a NoteNotFound exception."""
+        tt = self.wrap_subject(core.Tomtom, "get_uris_by_name")
+
+        tt.call_many([
+            ("FindNote", ("unexistant", )),
+            ("FindNote", ("TODO-list", )),
+            ("FindNote", ("other", )),
+        ]).AndReturn([dbus.String(""), "note://tomboy/1", dbus.String("")])
+
+        self.m.ReplayAll()
+
+        try:
+            tt.get_uris_by_name(["unexistant", "TODO-list", "other"])
+        except core.NoteNotFound, exc:
+            self.assertEqual( ["unexistant", "other"], exc.names )
+        else:
+            self.fail("NoteNotFound was not raised")
+
+        self.m.VerifyAll()
+
+    def test_get_uris_by_name_from_cache(self):
+        """Core: Names of notes that did not change are found in the cache."""
+        tt = self.wrap_subject(core.Tomtom, "get_uris_by_name")
+
+        tt.cache = self.m.CreateMock(cache.MetadataCache)
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        unchanged, changed, new = list_of_notes[:3]
+        names = [n.title for n in [unchanged, changed, new]]
+
+        tt.cache.find_titles(names)\
+            .AndReturn({
+                unchanged.title: (unchanged.uri, unchanged.date),
+                changed.title: (changed.uri, changed.date - 10),
+            })
+        tt.call_many([
+            ("GetNoteChangeDate", (unchanged.uri, )),
+            ("GetNoteChangeDate", (changed.uri, )),
+        ]).AndReturn([unchanged.date, changed.date])
+        tt.call_many([
+            ("FindNote", (changed.title, )),
+            ("FindNote", (new.title, )),
+        ]).AndReturn([changed.uri, new.uri])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            (
+                [(n.uri, n.title) for n in [unchanged, changed, new]],
+                {unchanged.uri: unchanged.date}
+            ),
+            tt.get_uris_by_name(names)
+        )
+
+        self.m.VerifyAll()
+
+    def test_call_many(self):
+        """Core: Calls are made one after the other when not pipelined."""
+        tt = self.wrap_subject(core.Tomtom, "call_many")
+
+        tt.comm = self.m.CreateMockAnything()
+
+        tt.comm.GetNoteTitle("note://tomboy/1")\
+            .AndReturn("title")
+        tt.comm.GetTagsForNote("note://tomboy/1")\
+            .AndReturn(["tag"])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            ["title", ["tag"]],
+            tt.call_many([
+                ("GetNoteTitle", ("note://tomboy/1", )),
+                ("GetTagsForNote", ("note://tomboy/1", )),
+            ])
+        )
+
+        self.m.VerifyAll()
+
+    def test_use_main_loop_without_gobject(self):
+        """Core: Calls stay synchronous without the gobject module."""
+        import dbus.mainloop.glib
+
+        tt = core.Tomtom.__new__(core.Tomtom)
+        self.m.StubOutWithMock(dbus.mainloop.glib, "DBusGMainLoop")
+
+        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+
+        self.m.ReplayAll()
+
+        old_gobject = sys.modules.get("gobject")
+        try:
+            # A None entry makes the import fail.
+            sys.modules["gobject"] = None
+            self.assertEqual( False, tt.use_main_loop() )
+
+            sys.modules["gobject"] = types.ModuleType("gobject")
+            self.assertEqual( True, tt.use_main_loop() )
+        finally:
+            if old_gobject is None:
+                del sys.modules["gobject"]
+            else:
+                sys.modules["gobject"] = old_gobject
+
+        self.m.VerifyAll()
+
+    def test_call_many_pipelined(self):
+        """Core: Calls go through a CallPipeline in pipelined mode."""
+        tt = self.wrap_subject(core.Tomtom, "call_many")
+
+        tt.pipelined = True
+        tt.comm = self.m.CreateMockAnything()
+        main_loop = self.m.CreateMockAnything()
+        fake_pipeline = self.m.CreateMock(core.CallPipeline)
+        calls = [("GetNoteTitle", ("note://tomboy/1", ))]
+
+        self.m.StubOutWithMock(core, "CallPipeline", use_mock_anything=True)
+
+        tt.new_main_loop()\
+            .AndReturn(main_loop)
+        core.CallPipeline(tt.comm, main_loop)\
+            .AndReturn(fake_pipeline)
+        fake_pipeline.run(calls)\
+            .AndReturn(["title"])
+
+        self.m.ReplayAll()
+
+        self.assertEqual( ["title"], tt.call_many(calls) )
+
+        self.m.VerifyAll()
+
+    def test_CallPipeline_keeps_order(self):
+        """Core: Pipelined replies are returned in the order of the calls."""
+        comm = FakeAsyncInterface()
+        # Replies come back in the reverse order of the calls
+        main_loop = FakeMainLoop(comm, reverse=True)
+        pipeline = core.CallPipeline(comm, main_loop, max_pending=2)
+
+        calls = [("GetNoteTitle", ("note://tomboy/%d" % i, )) for i in range(5)]
+
+        self.assertEqual(
+            ["note://tomboy/%d" % i for i in range(5)],
+            pipeline.run(calls)
+        )
+        self.assertEqual(2, comm.max_pending_seen)
+        self.assertTrue(main_loop.quitted)
+
+    def test_CallPipeline_immediate_replies(self):
+        """Core: Pipeline does not wait on its loop if all replies are in."""
+        comm = FakeAsyncInterface(immediate=True)
+        main_loop = FakeMainLoop(comm)
+        pipeline = core.CallPipeline(comm, main_loop, max_pending=2)
+
+        calls = [("GetNoteTitle", ("note://tomboy/%d" % i, )) for i in range(5)]
+
+        self.assertEqual(
+            ["note://tomboy/%d" % i for i in range(5)],
+            pipeline.run(calls)
+        )
+        self.assertFalse(main_loop.started)
+
+    def test_CallPipeline_error(self):
+        """Core: The first error from a pipelined call is raised."""
+        comm = FakeAsyncInterface(fail_on="note://tomboy/1")
+        main_loop = FakeMainLoop(comm)
+        pipeline = core.CallPipeline(comm, main_loop)
+
+        calls = [("GetNoteTitle", ("note://tomboy/%d" % i, )) for i in range(3)]
+
+        self.assertRaises(dbus.DBusException, pipeline.run, calls)
+
+    def test_dbus_Tomboy_communication_problem(self):
+        """Core: Raise an exception if linking dbus with Tomboy failed."""
+        tt = self.wrap_subject(core.Tomtom, "__init__")
+
+        old_SessionBus = dbus.SessionBus
+        old_Interface = dbus.Interface
+
+        dbus.SessionBus = self.m.CreateMockAnything()
+        dbus.Interface = self.m.CreateMockAnything()
+        session_bus = self.m.CreateMockAnything()
+        dbus_object = self.m.CreateMockAnything()
+        dbus_interface = self.m.CreateMockAnything()
+
+        dbus.SessionBus()\
+            .AndReturn(session_bus)
+        session_bus.get_object(
+            "org.gnome.Tomboy",
+            "/org/gnome/Tomboy/RemoteControl"
+        ).AndReturn(dbus_object)
+        dbus.Interface(
+            dbus_object,
+            "org.gnome.Tomboy.RemoteControl"
+        ).AndRaise( dbus.DBusException("cosmos error") )
+
+        self.m.ReplayAll()
+
+        self.assertRaises(core.ConnectionError, tt.__init__, "Tomboy")
+
+        self.m.VerifyAll()
+
+        dbus.SessionBus = old_SessionBus
+        dbus.Interface = old_Interface
+
+class TestCache(BasicMocking, CLIMocking):
+    """Tests for the cache of note information."""
+    def setUp(self):
+        """Create a directory to hold caches."""
+        super(TestCache, self).setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tomboy.sqlite")
+
+    def tearDown(self):
+        """Remove the cache directory."""
+        super(TestCache, self).tearDown()
+
+        shutil.rmtree(self.directory)
+
+    def test_cache_path(self):
+        """Cache: Caches are kept in $XDG_CACHE_HOME/tomtom."""
+        old_cache_home = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = self.directory
+
+        try:
+            self.assertEqual(
+                os.path.join(self.directory, "tomtom", "gnote.sqlite"),
+                cache.cache_path("Gnote")
+            )
+        finally:
+            if old_cache_home is None:
+                del os.environ["XDG_CACHE_HOME"]
+            else:
+                os.environ["XDG_CACHE_HOME"] = old_cache_home
+
+    def test_store_and_lookup(self):
+        """Cache: Stored notes can be looked up by URI."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        notes = list_of_notes[:3]
+
+        note_cache = cache.MetadataCache(self.path)
+        note_cache.store(notes)
+
+        # Reopen the cache to verify that information was saved.
+        note_cache = cache.MetadataCache(self.path)
+
+        self.assertEqual(
+            {
+                notes[1].uri: (notes[1].title, notes[1].date, notes[1].tags),
+                notes[2].uri: (notes[2].title, notes[2].date, notes[2].tags),
+            },
+            note_cache.lookup(
+                [notes[1].uri, notes[2].uri, "note://tomboy/not-cached"]
+            )
+        )
+
+    def test_store_replaces_notes(self):
+        """Cache: Storing a note again replaces its information."""
+        note = core.TomboyNote(
+            uri="note://tomboy/1", title="old", date=1, tags=["a", "b"]
+        )
+        new_note = core.TomboyNote(
+            uri="note://tomboy/1", title="new", date=2, tags=["c"]
+        )
+
+        note_cache = cache.MetadataCache(self.path)
+        note_cache.store([note])
+        note_cache.store([new_note])
+
+        self.assertEqual(
+            {"note://tomboy/1": ("new", 2, ["c"])},
+            note_cache.lookup(["note://tomboy/1"])
+        )
+
+    def test_forget(self):
+        """Cache: Forgotten notes are removed from the cache."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        note_cache = cache.MetadataCache(self.path)
+        note_cache.store(list_of_notes[:2])
+        note_cache.forget([list_of_notes[0].uri])
+
+        self.assertEqual(
+            [list_of_notes[1].uri],
+            note_cache.lookup([n.uri for n in list_of_notes[:2]]).keys()
+        )
+
+    def test_version_mismatch(self):
+        """Cache: A cache from another version is emptied."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
+        note_cache = cache.MetadataCache(self.path)
+        note_cache.store(list_of_notes[:2])
+        note_cache.connection.execute("PRAGMA user_version = 999")
+        note_cache.connection.commit()
+
+        note_cache = cache.MetadataCache(self.path)
+
+        self.assertEqual(
+            {},
+            note_cache.lookup([n.uri for n in list_of_notes[:2]])
+        )
+
+    def test_select_by_tags(self):
+        """Cache: Notes are selected with the tag bitmaps."""
+        notes = [
+            core.TomboyNote(uri="note://tomboy/1", title="1", date=1,
+                tags=["a", "b"]),
+            core.TomboyNote(uri="note://tomboy/2", title="2", date=1,
+                tags=["b", "system:template"]),
+            core.TomboyNote(uri="note://tomboy/3", title="3", date=1,
+                tags=[]),
+        ]
+        uris = [n.uri for n in notes]
+
+        note_cache = cache.MetadataCache(self.path)
+        note_cache.store(notes)
+
+        # Reopen the cache to verify that bitmaps were saved.
+        note_cache = cache.MetadataCache(self.path)
+
+        self.assertEqual(
+            set(uris[:2]),
+            note_cache.select(uris, ["b"])
+        )
+        self.assertEqual(
+            set(uris[:1]),
+            note_cache.select(uris, ["a", "b"], ["system:template"])
+        )
+        self.assertEqual(
+            set([uris[0], uris[2]]),
+            note_cache.select(uris, None, ["system:template"])
+        )
+        self.assertEqual(
+            set(uris[1:2]),
+            note_cache.select(uris[1:], ["a", "b"])
+        )
+
+    def test_select_after_changes(self):
+        """Cache: Tag bitmaps follow notes that change or are forgotten."""
+        note = core.TomboyNote(
+            uri="note://tomboy/1", title="old", date=1, tags=["a"]
+        )
+        other = core.TomboyNote(
+            uri="note://tomboy/2", title="other", date=1, tags=["a"]
+        )
+        new_note = core.TomboyNote(
+            uri="note://tomboy/1", title="new", date=2, tags=["b"]
+        )
+        uris = [note.uri, other.uri]
+
+        note_cache = cache.MetadataCache(self.path)
+        note_cache.store([note, other])
+        note_cache.store([new_note])
+
+        self.assertEqual( set(uris[1:]), note_cache.select(uris, ["a"]) )
+        self.assertEqual( set(uris[:1]), note_cache.select(uris, ["b"]) )
+
+        note_cache.forget(uris[:1])
+
+        self.assertEqual( set(), note_cache.select(uris, ["b"]) )
+        self.assertEqual(
+            [],
+            note_cache.connection.execute(
+                "SELECT tag FROM tag_bitmaps WHERE tag = 'b'"
+            ).fetchall()
+        )
+
+    def test_memory_cache_select(self):
+        """Cache: The memory cache keeps its own tag bitmaps."""
+        memory_cache = cache.MemoryCache()
+        note = core.TomboyNote(
+            uri="note://tomboy/1", title="title", date=1, tags=["a"]
+        )
+        template = core.TomboyNote(
+            uri="note://tomboy/2", title="template", date=1,
+            tags=["a", "system:template"]
+        )
+        uris = [note.uri, template.uri]
+
+        memory_cache.store([note, template])
+
+        self.assertEqual( set(uris), memory_cache.select(uris, ["a"]) )
+        self.assertEqual(
+            set(uris[:1]),
+            memory_cache.select(uris, None, ["system:template"])
+        )
+
+        memory_cache.forget(uris[:1])
+        memory_cache.store([
+            core.TomboyNote(uri="note://tomboy/3", title="3", date=1, tags=[])
+        ])
+
+        self.assertEqual(
+            set(uris[1:]),
+            memory_cache.select(uris + ["note://tomboy/3"], ["a"])
+        )
+
+    def test_find_titles(self):
+        """Cache: Notes are found by title, ignoring case."""
+        list_of_notes = test_data.full_list_of_notes(self.m)
+        notes = list_of_notes[:3]
+
+        note_cache = cache.MetadataCache(self.path)
+        note_cache.store(notes)
+
+        self.assertEqual(
+            {
+                notes[0].title.upper(): (notes[0].uri, notes[0].date),
+                notes[2].title: (notes[2].uri, notes[2].date),
+            },
+            note_cache.find_titles(
+                [notes[0].title.upper(), notes[2].title, "not cached"]
+            )
+        )
+
+        memory_cache = cache.MemoryCache(note_cache)
+        memory_cache.lookup([notes[0].uri])
+
+        self.assertEqual(
+            {
+                notes[0].title: (notes[0].uri, notes[0].date),
+                notes[1].title: (notes[1].uri, notes[1].date),
+            },
+            memory_cache.find_titles([notes[0].title, notes[1].title])
+        )
+
+    def test_memory_cache(self):
+        """Cache: The memory cache loads notes from its backing cache once."""
+        backing = self.m.CreateMock(cache.MetadataCache)
+        note = core.TomboyNote(
+            uri="note://tomboy/1", title="title", date=1, tags=["a"]
+        )
+        new_note = core.TomboyNote(
+            uri="note://tomboy/2", title="new", date=2, tags=[]
+        )
+
+        backing.lookup(["note://tomboy/1", "note://tomboy/2"])\
+            .AndReturn({"note://tomboy/1": ("title", 1, ["a"])})
+        backing.store([new_note])
+
+        self.m.ReplayAll()
+
+        memory_cache = cache.MemoryCache(backing)
+        uris = ["note://tomboy/1", "note://tomboy/2"]
+
+        self.assertEqual(
+            {"note://tomboy/1": ("title", 1, ["a"])},
+            memory_cache.lookup(uris)
+        )
+
+        memory_cache.store([new_note])
+
+        self.assertEqual(
+            {
+                "note://tomboy/1": ("title", 1, ["a"]),
+                "note://tomboy/2": ("new", 2, []),
+            },
+            memory_cache.lookup(uris)
+        )
+
+        self.m.VerifyAll()
+
+    def test_open_cache_failure(self):
+        """Cache: Tomtom continues without a cache if it can't be opened."""
+        command_line = self.wrap_subject(cli.CommandLine, "open_cache")
+
+        self.m.StubOutWithMock(cache, "cache_path")
+        self.m.StubOutWithMock(cache, "MetadataCache", use_mock_anything=True)
+
+        sys.argv = ["app_name"]
+
+        cache.cache_path("Tomboy")\
+            .AndReturn("/cache/tomboy.sqlite")
+        cache.MetadataCache("/cache/tomboy.sqlite")\
+            .AndRaise( OSError("Permission denied") )
+
+        self.m.ReplayAll()
+
+        self.assertEqual( None, command_line.open_cache("Tomboy") )
+
+        self.m.VerifyAll()
+
+        self.assertEqual(
+            test_data.cache_error_message + os.linesep,
+            sys.stderr.getvalue()
+        )
+
+class TestIndex(BasicMocking):
+    """Tests for the word index of note contents."""
+    def setUp(self):
+        """Create a directory to hold the index."""
+        super(TestIndex, self).setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tomboy-index.sqlite")
+
+        self.notes = test_data.full_list_of_notes(self.m)[:-1]
+
+    def tearDown(self):
+        """Remove the index directory."""
+        super(TestIndex, self).tearDown()
+
+        shutil.rmtree(self.directory)
+
+    def fetch_contents(self, notes):
+        """Get note contents from the test data, remembering the calls."""
+        self.fetched.extend(notes)
+
+        return [test_data.note_contents_from_dbus[n.title] for n in notes]
+
+    def test_is_plain(self):
+        """Index: Only patterns made of words can use the index."""
+        self.assertTrue( index.is_plain("john doe") )
+        self.assertFalse( index.is_plain("john.doe") )
+        self.assertFalse( index.is_plain("^john") )
+        self.assertFalse( index.is_plain(" ") )
+
+    def test_candidates(self):
+        """Index: Candidates are lines with all the words of a pattern."""
+        word_index = index.WordIndex(self.path)
+        self.fetched = []
+        word_index.update(self.notes, self.fetch_contents)
+
+        addressbook, business = [
+            n for n in self.notes
+            if n.title in ["addressbook", "business contacts"]
+        ]
+
+        candidates = word_index.candidates("john DOE", self.notes)
+
+        self.assertEqual( [5], candidates[addressbook.uri] )
+        self.assertTrue( 7 in candidates[business.uri] )
+
+        self.assertEqual( {}, word_index.candidates("xyzzy", self.notes) )
+
+    def test_update_only_changed_notes(self):
+        """Index: Only notes that changed since indexed are fetched again."""
+        word_index = index.WordIndex(self.path)
+        self.fetched = []
+        word_index.update(self.notes, self.fetch_contents)
+
+        changed = core.TomboyNote(
+            uri=self.notes[0].uri,
+            title=self.notes[0].title,
+            date=self.notes[0].date + 1
+        )
+
+        # Reopen the index to verify that it was saved.
+        word_index = index.WordIndex(self.path)
+        self.fetched = []
+        word_index.update([changed] + self.notes[1:], self.fetch_contents)
+
+        self.assertEqual( [changed], self.fetched )
+
+    def test_required_literals(self):
+        """Index: Literals are taken from the parts all matches go through."""
+        self.assertEqual(
+            [u"err-", u"abc", u" done"],
+            index.required_literals("ERR-[0-9]{4}(x|y)?(abc)+ ^Done$")
+        )
+        self.assertEqual( [], index.required_literals("a|bcd") )
+        self.assertEqual( None, index.required_literals("(unbalanced") )
+
+    def test_notes_with_trigrams(self):
+        """Index: Candidate notes contain all the trigrams of a regex."""
+        word_index = index.WordIndex(self.path)
+        self.fetched = []
+        word_index.update(self.notes, self.fetch_contents)
+
+        candidates = word_index.notes_with_trigrams(
+            index.required_trigrams("john.*doe"),
+            self.notes
+        )
+
+        self.assertEqual(
+            sorted([
+                n.uri for n in self.notes
+                if n.title in ["addressbook", "business contacts"]
+            ]),
+            sorted( candidates.keys() )
+        )
+        self.assertEqual( [None, None], candidates.values() )
+
+    def test_search_candidates_trigrams(self):
+        """Index: Tomtom looks up trigrams for regular expressions."""
+        tt = self.wrap_subject(core.Tomtom, "search_candidates")
+        tt.index = self.m.CreateMock(index.WordIndex)
+
+        tt.index.update(self.notes, tt.fetch_contents)
+        tt.index.notes_with_trigrams(set([u"err", u"rr-"]), self.notes)\
+            .AndReturn({})
+
+        self.m.ReplayAll()
+
+        self.assertEqual( {}, tt.search_candidates("ERR-[0-9]", self.notes) )
+
+        self.m.VerifyAll()
+
+    def test_search_candidates(self):
+        """Index: Tomtom updates the index before asking for candidates."""
+        tt = self.wrap_subject(core.Tomtom, "search_candidates")
+        tt.index = self.m.CreateMock(index.WordIndex)
+
+        # The application's search is not used: it misses words that are
+        # split by formatting.
+        tt.index.update(self.notes, tt.fetch_contents)
+        tt.index.candidates("john doe", self.notes)\
+            .AndReturn({})
+
+        self.m.ReplayAll()
+
+        self.assertEqual( {}, tt.search_candidates("john doe", self.notes) )
+
+        self.m.VerifyAll()
+
+    def test_search_candidates_without_index(self):
+        """Index: Notes found by the application are candidates."""
+        tt = self.wrap_subject(core.Tomtom, "search_candidates")
+
+        tt.search_notes("john doe")\
+            .AndReturn( set([self.notes[1].uri]) )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            {self.notes[1].uri: None},
+            tt.search_candidates("john doe", self.notes, True)
+        )
+
+        self.m.VerifyAll()
+
+        # Regular expressions are not passed to the application.
+        self.assertEqual(
+            None,
+            tt.search_candidates("jo.n", self.notes, True)
+        )
+
+        # The application's search misses words split by formatting. It is
+        # only used when asked for, otherwise all notes are searched.
+        self.assertEqual( None, tt.search_candidates("john doe", self.notes) )
+
+    def test_search_notes(self):
+        """Index: The application searches notes with SearchNotes."""
+        tt = self.wrap_subject(core.Tomtom, "search_notes")
+        tt.comm = self.m.CreateMockAnything()
+
+        tt.comm.SearchNotes("john doe", False)\
+            .AndReturn( [dbus.String(self.notes[1].uri)] )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            set([self.notes[1].uri]),
+            tt.search_notes("john doe")
+        )
+
+        self.m.VerifyAll()
+
+    def test_search_notes_unknown_method(self):
+        """Index: No notes are searched by applications that can't search."""
+        tt = self.wrap_subject(core.Tomtom, "search_notes")
+        tt.comm = self.m.CreateMockAnything()
+
+        tt.comm.SearchNotes("john doe", False)\
+            .AndRaise( dbus.DBusException("UnknownMethod") )
+
+        self.m.ReplayAll()
+
+        self.assertEqual( None, tt.search_notes("john doe") )
+
+        self.m.VerifyAll()
+
+        # The files backend has no SearchNotes method.
+        tt.comm = object()
+        self.assertEqual( None, tt.search_notes("john doe") )
+
+    def test_search_candidates_regular_expression(self):
+        """Index: Tomtom doesn't use the index for regular expressions."""
+        tt = self.wrap_subject(core.Tomtom, "search_candidates")
+        tt.index = self.m.CreateMock(index.WordIndex)
+
+        self.m.ReplayAll()
+
+        self.assertEqual( None, tt.search_candidates("j.*d[oa]e", self.notes) )
+
+        self.m.VerifyAll()
+
+class TestContents(BasicMocking):
+    """Tests for the cache of note contents."""
+    def setUp(self):
+        """Create a temporary directory for the cache."""
+        super(TestContents, self).setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "tomboy-contents.sqlite")
+
+    def tearDown(self):
+        """Remove the cache directory."""
+        super(TestContents, self).tearDown()
+
+        shutil.rmtree(self.directory)
+
+    def test_lookup(self):
+        """Contents: Contents are found only at the date they were stored."""
+        content_cache = contents.ContentCache(self.path)
+        content_cache.store([
+            ("note://a", 10, u"caf\xe9\nbody"),
+            ("note://b", 20, "caf\xc3\xa9"),
+        ])
+
+        # Contents are kept between runs.
+        content_cache = contents.ContentCache(self.path)
+
+        self.assertEqual(
+            {"note://a": u"caf\xe9\nbody", "note://b": u"caf\xe9"},
+            content_cache.lookup([("note://a", 10), ("note://b", 20)])
+        )
+        self.assertEqual(
+            {},
+            content_cache.lookup([("note://a", 11), ("note://c", 30)])
+        )
+
+        content_cache.store([("note://a", 11, u"new body")])
+        content_cache.forget(["note://b"])
+
+        self.assertEqual(
+            {"note://a": u"new body"},
+            content_cache.lookup([("note://a", 11), ("note://b", 20)])
+        )
+
+    def test_corrupted_contents(self):
+        """Contents: Corrupted contents are dropped."""
+        content_cache = contents.ContentCache(self.path)
+        content_cache.store([
+            ("note://a", 10, u"content a"),
+            ("note://b", 20, u"content b"),
+        ])
+
+        with content_cache.connection:
+            content_cache.connection.execute(
+                "UPDATE contents SET checksum = checksum + 1 "
+                "WHERE uri = 'note://a'"
+            )
+            content_cache.connection.execute(
+                "UPDATE contents SET data = ? WHERE uri = 'note://b'",
+                (buffer("not compressed"), )
+            )
+
+        self.assertEqual(
+            {},
+            content_cache.lookup([("note://a", 10), ("note://b", 20)])
+        )
+        self.assertEqual(
+            0,
+            content_cache.connection.execute(
+                "SELECT COUNT(*) FROM contents"
+            ).fetchone()[0]
+        )
+
+    def test_eviction(self):
+        """Contents: Contents used least recently are evicted first."""
+        size = len( contents.compress(u"a" * 1000)[0] )
+        content_cache = contents.ContentCache(self.path, size_max=3 * size)
+
+        content_cache.store([
+            ("note://a", 1, u"a" * 1000),
+            ("note://b", 2, u"b" * 1000),
+        ])
+        content_cache.store([("note://c", 3, u"c" * 1000)])
+        content_cache.lookup([("note://a", 1)])
+        content_cache.store([("note://d", 4, u"d" * 1000)])
+
+        self.assertEqual(
+            ["note://a", "note://c", "note://d"],
+            sorted( content_cache.lookup([
+                ("note://a", 1), ("note://b", 2),
+                ("note://c", 3), ("note://d", 4),
+            ]) )
+        )
+
+        # Contents that don't fit in the cache at all are not kept.
+        noise = os.urandom(4 * size).encode("hex")
+        content_cache.store([("note://e", 5, noise)])
+
+        self.assertEqual(
+            {},
+            content_cache.lookup([("note://e", 5)])
+        )
+        self.assertEqual(
+            3,
+            len( content_cache.lookup([
+                ("note://a", 1), ("note://c", 3), ("note://d", 4),
+            ]) )
+        )
+
+class TestNoteFiles(BasicMocking, CLIMocking):
+    """Tests for reading notes directly from their files."""
+    def setUp(self):
+        """Write note files in a temporary directory."""
+        super(TestNoteFiles, self).setUp()
+
+        self.directory = tempfile.mkdtemp()
+        test_data.write_note_files(self.directory)
+
+        self.notes = notefiles.NoteDirectory("Tomboy", self.directory)
+
+    def tearDown(self):
+        """Remove the note files."""
+        super(TestNoteFiles, self).tearDown()
+
+        shutil.rmtree(self.directory)
+
+    def test_parse_date(self):
+        """Notefiles: Dates with a timezone are converted to timestamps."""
+        self.assertEqual(
+            1257786603,
+            notefiles.parse_date("2009-11-09T12:10:03.1234560-05:00")
+        )
+        self.assertEqual(
+            1257160503,
+            notefiles.parse_date("2009-11-02T12:15:03.1234560+01:00")
+        )
+
+    def test_note_directory(self):
+        """Notefiles: Notes are found in the XDG data directory."""
+        old_data_home = os.environ.get("XDG_DATA_HOME")
+        os.environ["XDG_DATA_HOME"] = self.directory
+        os.mkdir( os.path.join(self.directory, "gnote") )
+
+        try:
+            self.assertEqual(
+                os.path.join(self.directory, "gnote"),
+                notefiles.note_directory("Gnote")
+            )
+        finally:
+            if old_data_home is None:
+                del os.environ["XDG_DATA_HOME"]
+            else:
+                os.environ["XDG_DATA_HOME"] = old_data_home
+
+    def test_list_all_notes(self):
+        """Notefiles: All notes are listed, most recently changed first."""
+        self.assertEqual(
+            [
+                u"note://tomboy/1c1a7a30-0a43-4d39-a91e-6d5e6e4d7a11",
+                u"note://tomboy/2b6e0a8e-55c4-4c49-bb1d-2a1b8c7d5e22",
+                u"note://tomboy/3d0f4c51-7e21-4f0b-8a9c-3c2d9e8f6a33",
+            ],
+            self.notes.ListAllNotes()
+        )
+
+    def test_note_information(self):
+        """Notefiles: Title, date and tags are read from the note file."""
+        uri = u"note://tomboy/2b6e0a8e-55c4-4c49-bb1d-2a1b8c7d5e22"
+
+        self.assertEqual(u"TODO-list", self.notes.GetNoteTitle(uri))
+        self.assertEqual(1257160503, self.notes.GetNoteChangeDate(uri))
+        self.assertEqual(
+            [u"system:notebook:reminders", u"system:notebook:pim"],
+            self.notes.GetTagsForNote(uri)
+        )
+
+    def test_note_contents(self):
+        """Notefiles: Contents are returned without formatting."""
+        uri = u"note://tomboy/1c1a7a30-0a43-4d39-a91e-6d5e6e4d7a11"
+
+        self.assertEqual(
+            u"addressbook\n\nMomma Chicken - 444-1919\n"
+            u"John Doe (cell) - 555-5512",
+            self.notes.GetNoteContents(uri)
+        )
+
+    def test_missing_note(self):
+        """Notefiles: Notes without a file get empty values, like Tomboy."""
+        uri = u"note://tomboy/00000000-0000-0000-0000-000000000000"
+
+        self.assertEqual(u"", self.notes.GetNoteTitle(uri))
+        self.assertEqual(-1, self.notes.GetNoteChangeDate(uri))
+        self.assertEqual([], self.notes.GetTagsForNote(uri))
+        self.assertEqual(u"", self.notes.GetNoteContents(uri))
+
+    def test_corrupt_note(self):
+        """Notefiles: Notes that can't be parsed are skipped with a warning."""
+        guid = "44444444-4444-4444-4444-444444444444"
+        uri = u"note://tomboy/" + guid
+        path = os.path.join(self.directory, guid + ".note")
+
+        note_file = open(path, "w")
+        note_file.write("<?xml version=\"1.0\"?>\n<note><title>Trunc")
+        note_file.close()
+
+        sys.argv = ["app_name"]
+
+        self.assertEqual(3, len( self.notes.ListAllNotes() ))
+        self.assertEqual(u"", self.notes.GetNoteTitle(uri))
+        self.assertEqual(-1, self.notes.GetNoteChangeDate(uri))
+        self.assertEqual([], self.notes.GetTagsForNote(uri))
+        self.assertEqual(u"", self.notes.GetNoteContents(uri))
+        self.assertEqual( u"", self.notes.FindNote(u"Trunc") )
+
+        self.assertEqual(
+            "app_name: Warning: Skipping note file %s: "
+                "no element found: line 2, column 18\n" % path,
+            sys.stderr.getvalue()
+        )
+
+    def test_find_note(self):
+        """Notefiles: Notes are found by title, regardless of case."""
+        self.assertEqual(
+            u"note://tomboy/3d0f4c51-7e21-4f0b-8a9c-3c2d9e8f6a33",
+            self.notes.FindNote(u"Python-Work")
+        )
+        self.assertEqual( u"", self.notes.FindNote(u"unexistant") )
+
+    def test_Tomtom_files_backend(self):
+        """Notefiles: Tomtom reads note files with the "files" backend."""
+        tt = self.wrap_subject(core.Tomtom, "__init__")
+
+        tt.open_note_files("Tomboy")\
+            .AndReturn(self.notes)
+
+        self.m.ReplayAll()
+
+        tt.__init__("Tomboy", backend="files")
+
+        self.m.VerifyAll()
+
+        self.assertEqual( self.notes, tt.comm )
+
+    def test_Tomtom_no_note_files(self):
+        """Notefiles: ConnectionError is raised if there are no note files."""
+        tt = self.wrap_subject(core.Tomtom, "open_note_files")
+
+        self.m.StubOutWithMock(notefiles, "note_directory")
+
+        notefiles.note_directory("Gnote")\
+            .AndReturn(None)
+
+        self.m.ReplayAll()
+
+        self.assertRaises(core.ConnectionError, tt.open_note_files, "Gnote")
+
+        self.m.VerifyAll()
+
+class FakeCommandLine(object):
+    """CommandLine that prints its arguments instead of dispatching."""
+    def __init__(self):
+        self.connections = {}
+        self.closed = False
+
+    def close_connections(self):
+        self.closed = True
+
+    def dispatch(self, action_name, arguments):
+        print "%s: %s" % (action_name, " ".join(arguments))
+        print >> sys.stderr, "done"
+
+        if arguments:
+            sys.exit( int(arguments[0]) )
+
+class NestingCommandLine(FakeCommandLine):
+    """CommandLine whose actions run a nested main loop, like pipelined calls.
+
+    The beginning and end of each action are recorded in "events".
+
+    """
+    def __init__(self, gobject_module):
+        super(NestingCommandLine, self).__init__()
+        self.gobject = gobject_module
+        self.events = []
+
+    def dispatch(self, action_name, arguments):
+        self.events.append("start %s" % arguments[0])
+        self.gobject.iteration(0.2)
+        print "%s: %s" % (action_name, " ".join(arguments))
+        self.events.append("end %s" % arguments[0])
+
+class FakeGobject(object):
+    """Stand-in for the gobject module that runs watches on file descriptors.
+
+    It is put in sys.modules, so the daemon imports it instead of gobject.
+
+    """
+    IO_IN = 1
+
+    def __init__(self):
+        self.watches = {}
+        self.last_id = 0
+
+    def io_add_watch(self, fd, condition, callback):
+        self.last_id += 1
+        self.watches[self.last_id] = (fd, callback)
+        return self.last_id
+
+    def source_remove(self, source_id):
+        del self.watches[source_id]
+
+    def timeout_add(self, interval, callback):
+        return 0
+
+    def iteration(self, timeout):
+        """Call the watches whose file descriptor is readable."""
+        for source_id, (fd, callback) in self.watches.items():
+            if source_id not in self.watches:
+                continue
+
+            if select.select([fd], [], [], timeout)[0]:
+                if not callback(fd, self.IO_IN):
+                    self.watches.pop(source_id, None)
+
+class FakeGlibLoop(object):
+    """Main loop that runs until a number of actions are done."""
+    def __init__(self, gobject_module, command_line, count):
+        self.gobject = gobject_module
+        self.command_line = command_line
+        self.count = count
+
+    def run(self):
+        for attempt in range(20):
+            if len(self.command_line.events) >= 2 * self.count:
+                return
+
+            self.gobject.iteration(0.5)
+
+class FakeSignalMatch(object):
+    """Subscription to a signal of a FakeSignalInterface."""
+    def __init__(self, interface, name):
+        self.interface = interface
+        self.name = name
+
+    def remove(self):
+        del self.interface.handlers[self.name]
+
+class FakeSignalInterface(object):
+    """Dbus interface that keeps signal handlers and can emit signals."""
+    def __init__(self):
+        self.handlers = {}
+
+    def connect_to_signal(self, name, handler):
+        self.handlers[name] = handler
+        return FakeSignalMatch(self, name)
+
+    def emit(self, name, *args):
+        self.handlers[name](*args)
+
+class TestListener(BasicMocking):
+    """Tests for following changes to notes with signals."""
+    def test_subscribe(self):
+        """Listener: Signals are followed until the listener is stopped."""
+        comm = FakeSignalInterface()
+        note_listener = listener.NoteListener(comm)
+
+        self.assertEqual(
+            ["NoteAdded", "NoteDeleted", "NoteSaved"],
+            sorted(comm.handlers)
+        )
+
+        note_listener.stop()
+
+        self.assertEqual({}, comm.handlers)
+
+    def test_note_saved(self):
+        """Listener: Dates of saved notes are not known anymore."""
+        comm = FakeSignalInterface()
+        note_listener = listener.NoteListener(comm)
+
+        self.assertEqual({}, note_listener.known_dates(["a"]) )
+
+        note_listener.start_listing()
+        note_listener.remember(["a", "b", "c"], [1, 2, 3])
+
+        comm.emit("NoteSaved", "b")
+
+        self.assertEqual(
+            {"a": 1, "c": 3},
+            note_listener.known_dates(["a", "b", "c"])
+        )
+        self.assertEqual(["b"], note_listener.take_changed() )
+
+        note_listener.update_dates(["b"], [4])
+
+        self.assertEqual(
+            {"a": 1, "b": 4, "c": 3},
+            note_listener.known_dates(["a", "b", "c"])
+        )
+        self.assertEqual([], note_listener.take_changed() )
+
+    def test_note_saved_while_listing(self):
+        """Listener: Notes saved while all notes are listed have changed."""
+        comm = FakeSignalInterface()
+        note_listener = listener.NoteListener(comm)
+
+        comm.emit("NoteSaved", "a")
+        note_listener.start_listing()
+        comm.emit("NoteSaved", "b")
+        note_listener.remember(["a", "b"], [1, 2])
+
+        self.assertEqual(["b"], note_listener.take_changed() )
+
+    def test_note_added(self):
+        """Listener: All notes are listed again after a note is added."""
+        comm = FakeSignalInterface()
+        note_listener = listener.NoteListener(comm)
+        note_listener.remember(["a"], [1])
+
+        comm.emit("NoteAdded", "b")
+
+        self.assertEqual(None, note_listener.uris)
+        self.assertEqual({}, note_listener.known_dates(["a"]) )
+
+    def test_note_deleted(self):
+        """Listener: Deleted notes are forgotten by the caches and index."""
+        comm = FakeSignalInterface()
+        note_cache = self.m.CreateMock(cache.MetadataCache)
+        word_index = self.m.CreateMock(index.WordIndex)
+        content_cache = self.m.CreateMock(contents.ContentCache)
+        note_listener = listener.NoteListener(
+            comm,
+            note_cache,
+            word_index,
+            content_cache
+        )
+        note_listener.remember(["a", "b"], [1, 2])
+
+        note_cache.forget(["b"])
+        word_index.forget(["b"])
+        content_cache.forget(["b"])
+
+        self.m.ReplayAll()
+
+        comm.emit("NoteDeleted", "b", "Title of b")
+
+        self.m.VerifyAll()
+
+        self.assertEqual(["a"], note_listener.uris)
+        self.assertEqual({"a": 1}, note_listener.dates)
+
+    def test_note_deleted_contents(self):
+        """Listener: Contents of deleted notes are removed from the cache."""
+        directory = tempfile.mkdtemp()
+
+        try:
+            comm = FakeSignalInterface()
+            content_cache = contents.ContentCache(
+                os.path.join(directory, "tomboy-contents.sqlite")
+            )
+            listener.NoteListener(comm, contents=content_cache)
+
+            content_cache.store([
+                ("note://a", 1, u"a body"),
+                ("note://b", 2, u"b body"),
+            ])
+
+            comm.emit("NoteDeleted", "note://b", "Title of b")
+
+            self.assertEqual(
+                {"note://a": u"a body"},
+                content_cache.lookup([("note://a", 1), ("note://b", 2)])
+            )
+        finally:
+            shutil.rmtree(directory)
+
+    def test_listen(self):
+        """Listener: Tomtom listens only once, and not to note files."""
+        tt = core.Tomtom.__new__(core.Tomtom)
+        tt.comm = FakeSignalInterface()
+        tt.contents = self.m.CreateMock(contents.ContentCache)
+
+        self.assertTrue( tt.listen() )
+        note_listener = tt.listener
+        self.assertTrue( tt.listen() )
+        self.assertTrue(note_listener is tt.listener)
+        self.assertTrue(note_listener.contents is tt.contents)
+
+        files_tt = core.Tomtom.__new__(core.Tomtom)
+        files_tt.comm = notefiles.NoteDirectory("Tomboy", "/nonexistent")
+
+        self.assertFalse( files_tt.listen() )
+        self.assertEqual(None, files_tt.listener)
+
+    def test_get_dates_from_listener(self):
+        """Listener: All dates are fetched once, then only changed ones."""
+        tt = self.wrap_subject(core.Tomtom, "get_dates_from_listener")
+        tt.comm = self.m.CreateMockAnything()
+        tt.listener = listener.NoteListener( FakeSignalInterface() )
+
+        tt.comm.ListAllNotes()\
+            .AndReturn(["a", "b"])
+        tt.call_many([
+            ("GetNoteChangeDate", ("a", )),
+            ("GetNoteChangeDate", ("b", )),
+        ]).AndReturn([1, 2])
+        # Nothing changed.
+        tt.call_many([])\
+            .AndReturn([])
+        tt.call_many([("GetNoteChangeDate", ("b", ))])\
+            .AndReturn([3])
+
+        self.m.ReplayAll()
+
+        self.assertEqual( (["a", "b"], [1, 2]), tt.get_dates_from_listener() )
+        self.assertEqual( (["a", "b"], [1, 2]), tt.get_dates_from_listener() )
+        tt.listener.note_saved("b")
+        self.assertEqual( (["a", "b"], [1, 3]), tt.get_dates_from_listener() )
+
+        self.m.VerifyAll()
+
+    def test_get_uris_for_n_notes_with_listener(self):
+        """Listener: Notes are listed with the dates from the listener."""
+        tt = self.wrap_subject(core.Tomtom, "get_uris_for_n_notes")
+        tt.listener = listener.NoteListener( FakeSignalInterface() )
+
+        tt.get_dates_from_listener()\
+            .AndReturn( (["a", "b", "c"], [1, 3, 2]) )
+        tt.get_dates_from_listener()\
+            .AndReturn( (["a", "b", "c"], [1, 3, 2]) )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            (
+                [("a", None), ("b", None), ("c", None)],
+                {"a": 1, "b": 3, "c": 2},
+                None
+            ),
+            tt.get_uris_for_n_notes(None)
+        )
+        self.assertEqual(
+            ( [("b", None), ("c", None)], {"b": 3, "c": 2}, None ),
+            tt.get_uris_for_n_notes(2)
+        )
+
+        self.m.VerifyAll()
+
+    def test_get_uris_by_name_with_listener(self):
+        """Listener: Dates known by the listener are not fetched by name."""
+        tt = self.wrap_subject(core.Tomtom, "get_uris_by_name")
+        tt.cache = self.m.CreateMock(cache.MetadataCache)
+        tt.listener = listener.NoteListener( FakeSignalInterface() )
+        tt.listener.remember(["a", "b"], [1, 2])
+        tt.listener.note_saved("b")
+
+        tt.cache.find_titles(["A", "B"])\
+            .AndReturn({"A": ("a", 1), "B": ("b", 2)})
+        tt.call_many([("GetNoteChangeDate", ("b", ))])\
+            .AndReturn([2])
+        tt.call_many([])\
+            .AndReturn([])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            ( [("a", "A"), ("b", "B")], {"a": 1, "b": 2} ),
+            tt.get_uris_by_name(["A", "B"])
+        )
+
+        self.m.VerifyAll()
+
+class TestDaemon(BasicMocking, CLIMocking):
+    """Tests for the tomtomd daemon and forwarding actions to it."""
+    def setUp(self):
+        """Create a directory to hold the socket."""
+        super(TestDaemon, self).setUp()
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "daemon.socket")
+
+    def tearDown(self):
+        """Remove the socket directory."""
+        super(TestDaemon, self).tearDown()
+
+        shutil.rmtree(self.directory)
+
+    def test_socket_path(self):
+        """Daemon: The socket is in $XDG_RUNTIME_DIR/tomtom."""
+        old_runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+        os.environ["XDG_RUNTIME_DIR"] = self.directory
+
+        try:
+            self.assertEqual(
+                os.path.join(self.directory, "tomtom", "daemon.socket"),
+                daemon.socket_path()
+            )
+        finally:
+            if old_runtime_dir is None:
+                del os.environ["XDG_RUNTIME_DIR"]
+            else:
+                os.environ["XDG_RUNTIME_DIR"] = old_runtime_dir
+
+    def test_is_private_directory(self):
+        """Daemon: Only directories that only the user can use are private."""
+        self.assertTrue( daemon.is_private_directory(self.directory) )
+
+        link = os.path.join(self.directory, "link")
+        os.symlink(self.directory, link)
+        self.assertFalse( daemon.is_private_directory(link) )
+
+        self.assertFalse(
+            daemon.is_private_directory( os.path.join(self.directory, "none") )
+        )
+
+        os.chmod(self.directory, 0755)
+        self.assertFalse( daemon.is_private_directory(self.directory) )
+
+    def test_forward_to_shared_directory(self):
+        """Daemon: Actions are not forwarded through a shared directory."""
+        server = daemon.TomtomDaemon(self.path, FakeCommandLine())
+        os.chmod(self.directory, 0777)
+        sys.argv = ["app_name"]
+
+        try:
+            status = daemon.forward("display", [u"0"], path=self.path)
+        finally:
+            server.server_close()
+
+        self.assertEqual(None, status)
+        self.assertEqual("", sys.stdout.getvalue())
+        self.assertEqual(
+            "app_name: Warning: Not using the daemon: %s is not private.\n" %
+                self.directory,
+            sys.stderr.getvalue()
+        )
+
+    def test_forward_without_daemon(self):
+        """Daemon: Actions are not forwarded if the daemon is not running."""
+        self.assertEqual(
+            None,
+            daemon.forward("list", [], path=self.path)
+        )
+
+    def test_run_request(self):
+        """Daemon: Output of an action is sent to the client."""
+        server = daemon.TomtomDaemon(self.path, FakeCommandLine())
+        connection = StringIO.StringIO()
+
+        try:
+            status = server.run_request(
+                {
+                    "action": "list",
+                    "arguments": [u"201"],
+                    "program": "app_name",
+                    "cwd": os.getcwd(),
+                },
+                connection
+            )
+        finally:
+            server.server_close()
+
+        self.assertEqual(201, status)
+        self.assertEqual(
+            [
+                {"stream": "stdout", "data": "list: 201"},
+                {"stream": "stdout", "data": "\n"},
+                {"stream": "stderr", "data": "done"},
+                {"stream": "stderr", "data": "\n"},
+            ],
+            [json.loads(line) for line in connection.getvalue().splitlines()]
+        )
+
+    def test_run_request_closes_connections(self):
+        """Daemon: Connections are closed when the application went away."""
+        command_line = FakeCommandLine()
+        server = daemon.TomtomDaemon(self.path, command_line)
+
+        try:
+            status = server.run_request(
+                {
+                    "action": "list",
+                    "arguments": [u"102"],
+                    "program": "app_name",
+                    "cwd": os.getcwd(),
+                },
+                StringIO.StringIO()
+            )
+        finally:
+            server.server_close()
+
+        self.assertEqual(102, status)
+        self.assertTrue(command_line.closed)
+
+    def test_connect_listens(self):
+        """Daemon: Connections follow changes to notes when listening."""
+        command_line = self.wrap_subject(daemon.DaemonCommandLine, "connect")
+        command_line.listen = True
+        command_line.connections = {}
+
+        options = optparse.Values({
+            "backend": "dbus",
+            "pipelined": False,
+            "no_cache": True,
+        })
+        fake_tomtom = self.m.CreateMock(core.Tomtom)
+
+        self.m.StubOutWithMock(core, "Tomtom", use_mock_anything=True)
+        core.Tomtom(
+            "Tomboy", pipelined=False, cache=None, backend="dbus", index=None,
+            contents=None
+        ).AndReturn(fake_tomtom)
+        fake_tomtom.listen()\
+            .AndReturn(True)
+        # The connection is kept, but listening is done only once.
+        fake_tomtom.listen()\
+            .AndReturn(True)
+
+        self.m.ReplayAll()
+
+        self.assertTrue(
+            fake_tomtom is command_line.connect("Tomboy", options)
+        )
+        self.assertTrue(
+            fake_tomtom is command_line.connect("Tomboy", options)
+        )
+
+        self.m.VerifyAll()
+
+    def test_close_connections(self):
+        """Daemon: Closing connections stops their listeners."""
+        command_line = daemon.DaemonCommandLine()
+
+        comm = FakeSignalInterface()
+        tt = core.Tomtom.__new__(core.Tomtom)
+        tt.comm = comm
+        tt.listen()
+
+        command_line.connections[("Tomboy", "dbus", False, True)] = tt
+
+        command_line.close_connections()
+
+        self.assertEqual({}, command_line.connections)
+        self.assertEqual({}, comm.handlers)
+
+    def test_forward(self):
+        """Daemon: Forwarded actions print the daemon's output."""
+        server = daemon.TomtomDaemon(self.path, FakeCommandLine())
+        serving = threading.Thread(target=server.handle_request)
+        serving.start()
+
+        sys.argv = ["app_name"]
+
+        try:
+            status = daemon.forward("display", [u"0"], path=self.path)
+        finally:
+            serving.join()
+            server.server_close()
+
+        self.assertEqual(0, status)
+        self.assertEqual("display: 0\n", sys.stdout.getvalue())
+        self.assertEqual("done\n", sys.stderr.getvalue())
+
+    def test_serve_one_request_at_a_time(self):
+        """Daemon: A nested main loop doesn't start another request."""
+        fake_gobject = FakeGobject()
+        command_line = NestingCommandLine(fake_gobject)
+        server = daemon.TomtomDaemon(self.path, command_line)
+
+        # Two clients send their request at the same time.
+        clients = []
+        for name in ["a", "b"]:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(self.path)
+            connection = client.makefile("rwb")
+            daemon.send_message(connection, {
+                "action": "display",
+                "arguments": [name],
+                "program": "app_name",
+                "cwd": os.getcwd(),
+            })
+            clients.append( (client, connection) )
+
+        old_gobject = sys.modules.get("gobject")
+        sys.modules["gobject"] = fake_gobject
+
+        try:
+            daemon.serve_from_main_loop(
+                server,
+                FakeGlibLoop(fake_gobject, command_line, 2)
+            )
+        finally:
+            if old_gobject is None:
+                del sys.modules["gobject"]
+            else:
+                sys.modules["gobject"] = old_gobject
+
+            server.server_close()
+
+        self.assertEqual(
+            ["start a", "end a", "start b", "end b"],
+            command_line.events
+        )
+
+        for (client, connection), name in zip(clients, ["a", "b"]):
+            self.assertEqual(
+                [
+                    {"stream": "stdout", "data": "display: %s" % name},
+                    {"stream": "stdout", "data": "\n"},
+                    {"exit": 0},
+                ],
+                [json.loads(line) for line in connection]
+            )
+            client.close()
+
+class TestShell(BasicMocking, CLIMocking):
+    """Tests for the interactive shell."""
+    def test_partial_argument(self):
+        """Shell: The argument typed at the end of a line is found."""
+        self.assertEqual( (None, ""), shell.partial_argument("display ") )
+        self.assertEqual(
+            (None, "Meeting no"),
+            shell.partial_argument("display a Meeting\\ no")
+        )
+        self.assertEqual(
+            ('"', "Meeting no"),
+            shell.partial_argument('display "Meeting no')
+        )
+        self.assertEqual(
+            ('"', "it's"),
+            shell.partial_argument("""display "it's""")
+        )
+
+    def test_escape_argument(self):
+        """Shell: Characters that split arguments are escaped."""
+        self.assertEqual(
+            """Meeting\\ \\"notes\\"\\\\""",
+            shell.escape_argument('Meeting "notes"\\')
+        )
+
+    def test_run_actions(self):
+        """Shell: Actions are dispatched until the end of the input."""
+        command_line = self.m.CreateMock(daemon.DaemonCommandLine)
+        tomtom_shell = shell.TomtomShell(
+            command_line,
+            stdin=StringIO.StringIO(
+                'display "Note A" caf\xc3\xa9\n\nlist -n 3\nlist\n'
+            )
+        )
+        tomtom_shell.use_rawinput = False
+        tomtom_shell.prompt = ""
+
+        command_line.dispatch(u"display", [u"Note A", u"caf\xe9"])
+        # The application went away: connect again for the next action.
+        command_line.dispatch(u"list", [u"-n", u"3"])\
+            .AndRaise( SystemExit(cli.DBUS_CONNECTION_ERROR_RETURN_CODE) )
+        command_line.close_connections()
+        command_line.dispatch(u"list", [])\
+            .AndRaise( KeyboardInterrupt() )
+
+        self.m.ReplayAll()
+
+        tomtom_shell.run()
+
+        self.m.VerifyAll()
+
+        self.assertEqual("", sys.stdout.getvalue())
+        self.assertEqual("\n", sys.stderr.getvalue())
+
+    def test_unbalanced_quotes(self):
+        """Shell: Lines that can't be split are reported."""
+        command_line = self.m.CreateMock(daemon.DaemonCommandLine)
+        tomtom_shell = shell.TomtomShell(command_line)
+        sys.argv = ["app_name", "shell"]
+
+        self.m.ReplayAll()
+
+        tomtom_shell.onecmd('display "Note A')
+
+        self.m.VerifyAll()
+
+        self.assertEqual(
+            "app_name: Error: No closing quotation\n",
+            sys.stderr.getvalue()
+        )
+
+    def test_help(self):
+        """Shell: Help lists actions, or shows the help of an action."""
+        command_line = self.m.CreateMock(daemon.DaemonCommandLine)
+        tomtom_shell = shell.TomtomShell(command_line)
+
+        command_line.action_short_summaries()\
+            .AndReturn(["  list : list notes"])
+        command_line.dispatch(u"list", [u"-h"])\
+            .AndRaise( SystemExit(0) )
+
+        self.m.ReplayAll()
+
+        tomtom_shell.onecmd("help")
+        tomtom_shell.onecmd("help list")
+
+        self.m.VerifyAll()
+
+        self.assertEqual(
+            os.linesep.join([
+                "Here is a list of all the available actions:",
+                "  list : list notes",
+                "",
+                'Use "help <action>" for details on an action\'s options, '
+                    'and "quit" to leave.',
+                "",
+            ]),
+            sys.stdout.getvalue()
+        )
+
+    def test_complete_names(self):
+        """Shell: Names of actions and commands are completed."""
+        command_line = self.m.CreateMock(daemon.DaemonCommandLine)
+        tomtom_shell = shell.TomtomShell(command_line)
+
+        command_line.action_descriptions()\
+            .MultipleTimes()\
+            .AndReturn([("display", None), ("list", "list notes")])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            ["display", "exit", "help", "list", "quit"],
+            tomtom_shell.completenames("")
+        )
+        self.assertEqual(["list"], tomtom_shell.completenames("l"))
+        self.assertEqual(
+            ["display"],
+            tomtom_shell.complete_help("d", "help d", 5, 6)
+        )
+
+        self.m.VerifyAll()
+
+    def test_complete_titles(self):
+        """Shell: Titles of notes in memory are completed."""
+        command_line = daemon.DaemonCommandLine()
+        memory_cache = cache.MemoryCache()
+        memory_cache.remember("note://a", (u"Meeting notes", 1, []))
+        memory_cache.remember("note://b", (u"Memo", 2, []))
+        memory_cache.remember("note://c", (u"Caf\xe9", 3, []))
+        command_line.caches["Tomboy"] = memory_cache
+
+        tomtom_shell = shell.TomtomShell(command_line)
+
+        self.assertEqual(
+            ["Meeting\\ notes", "Memo"],
+            tomtom_shell.completedefault("Me", "display Me", 8, 10)
+        )
+        self.assertEqual(
+            ["notes"],
+            tomtom_shell.completedefault("n", 'display "meeting n', 17, 18)
+        )
+        self.assertEqual(
+            ["notes"],
+            tomtom_shell.completedefault("n", "display Meeting\\ n", 17, 18)
+        )
+        self.assertEqual(
+            ["Caf\xc3\xa9"],
+            tomtom_shell.completedefault("caf", "display caf", 8, 11)
+        )
+        self.assertEqual(
+            [],
+            tomtom_shell.completedefault("-n", "list -n", 5, 7)
+        )
+
+class TestBatch(BasicMocking, CLIMocking):
+    """Tests for running actions read from the standard input."""
+    def test_read_commands(self):
+        """Batch: Lines are split in arguments, blank lines are skipped."""
+        lines = StringIO.StringIO(
+            'list -n 3\n\n  # comment\ndisplay "Note A" caf\xc3\xa9\n'
+            'display "Note B\n'
+        )
+
+        self.assertEqual(
+            [
+                ([u"list", u"-n", u"3"], None),
+                ([u"display", u"Note A", u"caf\xe9"], None),
+                (None, 'No closing quotation: display "Note B'),
+            ],
+            list( batch.read_commands(lines) )
+        )
+
+    def test_run_batch(self):
+        """Batch: Actions are followed by a delimiter, failures don't stop."""
+        command_line = FakeCommandLine()
+        sys.argv = ["app_name", "batch"]
+
+        status = batch.run_batch(
+            command_line,
+            [
+                ([u"list", u"0"], None),
+                ([u"display", u"102"], None),
+                (None, "No closing quotation: display \"A"),
+                ([u"search", u"201"], None),
+            ],
+            sys.stdout,
+            delimiter=u"%%"
+        )
+
+        self.assertEqual(102, status)
+        self.assertTrue(command_line.closed)
+        self.assertEqual(
+            "list: 0\n%%\ndisplay: 102\n%%\n%%\nsearch: 201\n%%\n",
+            sys.stdout.getvalue()
+        )
+        self.assertEqual(
+            "done\ndone\n"
+                'app_name: Error: No closing quotation: display "A\n'
+                "done\n",
+            sys.stderr.getvalue()
+        )
 
-        Arguments:
-            self       -- The TestCase instance
-            tt         -- Tomtom mock object instance
-            notes      -- list of TomboyNote objects
-            note_names -- list of note names to pass to get_notes
+    def test_run_batch_json(self):
+        """Batch: Output and errors of each action are sent as JSON."""
+        command_line = FakeCommandLine()
+        sys.argv = ["app_name", "batch"]
+        old_streams = (sys.stdout, sys.stderr)
+
+        status = batch.run_batch(
+            command_line,
+            [
+                ([u"list", u"0"], None),
+                (None, "No closing quotation: display \"A"),
+            ],
+            sys.stdout,
+            use_json=True
+        )
 
-        """
-        expectation = [{
-            "uri":n.uri,
-            "title":n.title,
-            "date":n.date,
-            "tags":n.tags,
-        } for n in notes]
-
-        # Order is not important
-        for note in tt.build_note_list(names=note_names):
-            note_as_dict = {
-                "uri":note.uri,
-                "title":note.title,
-                "date":note.date,
-                "tags":note.tags
-            }
+        self.assertEqual(1, status)
+        self.assertTrue(sys.stdout is old_streams[0])
+        self.assertTrue(sys.stderr is old_streams[1])
+        self.assertEqual(
+            [
+                {
+                    "arguments": [u"list", u"0"],
+                    "stdout": u"list: 0\n",
+                    "stderr": u"done\n",
+                    "exit": 0,
+                },
+                {
+                    "arguments": None,
+                    "stdout": u"",
+                    "stderr": u"app_name: Error: No closing quotation: "
+                        u'display "A\n',
+                    "exit": 1,
+                },
+            ],
+            [json.loads(line) for line in sys.stdout.getvalue().splitlines()]
+        )
+        self.assertEqual("", sys.stderr.getvalue())
 
-            if note_as_dict not in expectation:
-                self.fail(
-                    """Note named %s dated %s """ % (note.title, note.date) + \
-                    """with uri %s and """ % (note.uri, ) + \
-                    """tags [%s] not found in """ % (",".join(note.tags), ) + \
-                    """expectation: [%s]""" % (",".join(expectation), )
-                )
+    def test_captured_stream(self):
+        """Batch: Captured output is decoded from UTF-8."""
+        stream = batch.CapturedStream()
 
-    def test_build_note_list_by_names(self):
-        """Core: Tomtom gets a list of given named notes."""
-        tt = self.wrap_subject(core.Tomtom, "build_note_list")
+        print >> stream, u"caf\xe9".encode("utf-8")
+        stream.write(u"th\xe9")
 
-        tt.comm = self.m.CreateMockAnything()
+        self.assertEqual(u"caf\xe9\nth\xe9", stream.getvalue())
 
-        list_of_notes = test_data.full_list_of_notes(self.m)
+class FakeComm(object):
+    """Interface whose methods reply with their first argument."""
+    def GetNoteTitle(self, uri):
+        return uri
 
-        todo = list_of_notes[1]
-        recipes = list_of_notes[11]
-        notes = [todo, recipes]
-        names = [n.title for n in notes]
+    def FindNote(self, name):
+        raise dbus.DBusException("not found")
 
-        tt.get_uris_by_name(names)\
-            .AndReturn( [(n.uri, n.title) for n in notes] )
+class TestStats(BasicMocking, CLIMocking):
+    """Tests for the accounting of calls and phases."""
+    def test_reply_size(self):
+        """Stats: Size of replies is counted from their values."""
+        self.assertEqual(3, stats.reply_size("abc") )
+        self.assertEqual(2, stats.reply_size(u"\xe9") )
+        self.assertEqual(8, stats.reply_size(1234) )
+        self.assertEqual(0, stats.reply_size(None) )
+        self.assertEqual(
+            12,
+            stats.reply_size([u"a", dbus.String(u"bcd"), dbus.Int64(5)])
+        )
 
-        for note in notes:
-            tt.comm.GetNoteChangeDate(note.uri)\
-                .AndReturn(note.date)
-            tt.comm.GetTagsForNote(note.uri)\
-                .AndReturn(note.tags)
+    def test_percentile(self):
+        """Stats: Percentiles are taken by nearest rank."""
+        values = range(100, 0, -1)
+
+        self.assertEqual(50, stats.percentile(values, 0.5) )
+        self.assertEqual(90, stats.percentile(values, 0.9) )
+        self.assertEqual(99, stats.percentile(values, 0.99) )
+        self.assertEqual(1, stats.percentile(values, 0) )
+        self.assertEqual(7, stats.percentile([7], 0.99) )
+
+    def test_phases(self):
+        """Stats: Time in nested phases is counted only once."""
+        action_stats = stats.Stats()
+
+        self.m.StubOutWithMock(time, "time")
+        for now in [10.0, 11.0, 14.0, 15.0]:
+            time.time().AndReturn(now)
 
         self.m.ReplayAll()
 
-        self.verify_note_list(tt, notes, note_names=names)
+        action_stats.enter("format")
+        action_stats.enter("fetch")
+        action_stats.leave()
+        action_stats.leave()
 
         self.m.VerifyAll()
 
-    def test_build_note_list(self):
-        """Core: Tomtom gets a full list of notes."""
-        tt = self.wrap_subject(core.Tomtom, "build_note_list")
+        self.assertEqual(2.0, action_stats.phases["format"])
+        self.assertEqual(3.0, action_stats.phases["fetch"])
+        self.assertEqual([], action_stats.stack)
 
-        tt.comm = self.m.CreateMockAnything()
+    def test_timed_function(self):
+        """Stats: Generators from timed functions are timed as they run."""
+        action_stats = stats.Stats()
 
-        list_of_notes = test_data.full_list_of_notes(self.m)
+        def generate(count):
+            self.assertEqual(["filter"], action_stats.stack)
+            for number in xrange(count):
+                self.assertEqual(["filter"], action_stats.stack)
+                yield number
 
-        list_of_uris = dbus.Array(
-            [note.uri for note in list_of_notes]
-        )
+        timed = action_stats.timed_function("filter", generate)
 
-        tt.get_uris_for_n_notes(None)\
-            .AndReturn( [(u, None) for u in list_of_uris] )
+        self.assertEqual([0, 1, 2], list( timed(3) ) )
+        self.assertEqual([], action_stats.stack)
 
-        for note in list_of_notes:
-            tt.comm.GetNoteTitle(note.uri)\
-                .AndReturn(note.title)
-            tt.comm.GetNoteChangeDate(note.uri)\
-                .AndReturn(note.date)
-            tt.comm.GetTagsForNote(note.uri)\
-                .AndReturn(note.tags)
+    def test_instrumented_comm(self):
+        """Stats: Calls made through the instrumented interface are counted."""
+        action_stats = stats.Stats()
+        comm = stats.InstrumentedComm(FakeComm(), action_stats)
 
-        self.m.ReplayAll()
+        self.assertEqual("abc", comm.GetNoteTitle("abc") )
+        self.assertEqual("de", comm.GetNoteTitle("de") )
+        self.assertRaises(dbus.DBusException, comm.FindNote, "abc")
+        self.assertEqual( None, getattr(comm, "SearchNotes", None) )
 
-        self.verify_note_list(tt, list_of_notes)
+        self.assertEqual(2, len( action_stats.latencies["GetNoteTitle"] ) )
+        self.assertEqual(5, action_stats.received["GetNoteTitle"])
+        self.assertEqual(1, len( action_stats.latencies["FindNote"] ) )
+        self.assertEqual(1, action_stats.errors)
+        self.assertEqual([], action_stats.stack)
 
-        self.m.VerifyAll()
+    def test_instrumented_comm_asynchronous(self):
+        """Stats: Asynchronous calls are counted when their reply comes."""
+        action_stats = stats.Stats()
+        fake_comm = FakeAsyncInterface(fail_on="fail")
+        comm = stats.InstrumentedComm(fake_comm, action_stats)
 
-    def test_get_uris_by_name(self):
-        """Core: Tomtom determines uris by names."""
-        tt = self.wrap_subject(core.Tomtom, "get_uris_by_name")
+        tt = core.Tomtom.__new__(core.Tomtom)
+        tt.comm = comm
+        tt.pipelined = True
+        tt.new_main_loop = lambda: FakeMainLoop(fake_comm)
 
-        tt.comm = self.m.CreateMockAnything()
+        self.assertEqual(
+            ["abc", "de"],
+            tt.call_many([
+                ("GetNoteTitle", ("abc", )),
+                ("GetNoteTitle", ("de", )),
+            ])
+        )
+        self.assertRaises(
+            dbus.DBusException,
+            tt.call_many, [("FindNote", ("fail", ))]
+        )
 
-        list_of_notes = test_data.full_list_of_notes(self.m)
+        self.assertEqual(2, len( action_stats.latencies["GetNoteTitle"] ) )
+        self.assertEqual(5, action_stats.received["GetNoteTitle"])
+        self.assertEqual(1, action_stats.errors)
 
-        r_n_d = list_of_notes[12]
-        webpidgin = list_of_notes[9]
-        names = [r_n_d.title, webpidgin.title]
+    def test_instrument(self):
+        """Stats: Instrumenting an action is undone by restore."""
+        action_stats = stats.Stats()
 
-        tt.comm.FindNote(r_n_d.title)\
-            .AndReturn(r_n_d.uri)
-        tt.comm.FindNote(webpidgin.title)\
-            .AndReturn(webpidgin.uri)
+        action = plugins.ActionPlugin()
+        action.tomboy_interface = core.Tomtom.__new__(core.Tomtom)
+        comm = FakeComm()
+        action.tomboy_interface.comm = comm
 
-        self.m.ReplayAll()
+        action_stats.instrument(action)
 
-        self.assertEqual(
-            [(r_n_d.uri, r_n_d.title), (webpidgin.uri, webpidgin.title)],
-            tt.get_uris_by_name(names)
+        self.assertTrue(
+            isinstance(action.tomboy_interface.comm, stats.InstrumentedComm)
         )
 
-        self.m.VerifyAll()
+        action.write_lines([u"one", u"two"])
+        action.tomboy_interface.comm.GetNoteTitle("abc")
 
-    def test_get_uris_by_name_unexistant(self):
-        """Core: Tomtom raises a NoteNotFound exception."""
-        tt = self.wrap_subject(core.Tomtom, "get_uris_by_name")
+        action_stats.restore()
 
-        tt.comm = self.m.CreateMockAnything()
+        self.assertEqual("one\ntwo\n", sys.stdout.getvalue())
+        self.assertEqual(1, len( action_stats.latencies["GetNoteTitle"] ) )
+        self.assertTrue(action.tomboy_interface.comm is comm)
+        self.assertEqual(
+            core.Tomtom.build_note_list.im_func,
+            action.tomboy_interface.build_note_list.im_func
+        )
+        self.assertEqual(
+            plugins.ActionPlugin.write_lines.im_func,
+            action.write_lines.im_func
+        )
+
+    def test_trace(self):
+        """Stats: Phases and calls are written as trace events."""
+        action_stats = stats.Stats(trace=True)
 
-        tt.comm.FindNote("unexistant")\
-            .AndReturn(dbus.String(""))
+        self.m.StubOutWithMock(time, "time")
+        for now in [10.0, 10.5, 11.0, 11.125, 11.25, 12.0]:
+            time.time().AndReturn(now)
 
         self.m.ReplayAll()
 
-        self.assertRaises(
-            core.NoteNotFound,
-            tt.get_uris_by_name,
-            ["unexistant"]
+        action_stats.add_phase("connection", 9.0, 10.0)
+        action_stats.enter("format")
+        action_stats.enter("fetch", "build_note_list")
+        action_stats.enter("fetch", traced=False)
+        action_stats.leave()
+        action_stats.leave()
+        action_stats.record_call("GetNoteTitle", 11.0, 11.5, "abc")
+        action_stats.record_call(
+            "GetNoteTitle", 11.0, 12.0, error=True, pipelined=True
         )
+        action_stats.leave()
 
         self.m.VerifyAll()
 
-    def test_dbus_Tomboy_communication_problem(self):
-        """Core: Raise an exception if linking dbus with Tomboy failed."""
-        tt = self.wrap_subject(core.Tomtom, "__init__")
+        pid = os.getpid()
+        self.assertEqual(
+            [
+                {"name": "connection", "cat": "phase", "ph": "X",
+                    "ts": 9000000, "dur": 1000000, "pid": pid, "tid": 0},
+                {"name": "build_note_list", "cat": "phase", "ph": "X",
+                    "ts": 10500000, "dur": 750000, "pid": pid, "tid": 0,
+                    "args": {"phase": "fetch"}},
+                {"name": "GetNoteTitle", "cat": "dbus", "ph": "X",
+                    "ts": 11000000, "dur": 500000, "pid": pid, "tid": 0,
+                    "args": {"bytes": 3, "error": False}},
+                {"name": "GetNoteTitle", "cat": "dbus", "ph": "X",
+                    "ts": 11000000, "dur": 1000000, "pid": pid, "tid": 4,
+                    "args": {"bytes": 0, "error": True}},
+                {"name": "format", "cat": "phase", "ph": "X",
+                    "ts": 10000000, "dur": 2000000, "pid": pid, "tid": 0,
+                    "args": {"phase": "format"}},
+            ],
+            action_stats.events
+        )
 
-        old_SessionBus = dbus.SessionBus
-        old_Interface = dbus.Interface
+    def test_no_trace(self):
+        """Stats: Without tracing, no events are kept."""
+        action_stats = stats.Stats()
 
-        dbus.SessionBus = self.m.CreateMockAnything()
-        dbus.Interface = self.m.CreateMockAnything()
-        session_bus = self.m.CreateMockAnything()
-        dbus_object = self.m.CreateMockAnything()
-        dbus_interface = self.m.CreateMockAnything()
+        action_stats.add_phase("connection", 9.0, 10.0)
+        action_stats.enter("format")
+        action_stats.leave()
+        action_stats.record_call("GetNoteTitle", 11.0, 11.5, "abc")
 
-        dbus.SessionBus()\
-            .AndReturn(session_bus)
-        session_bus.get_object(
-            "org.gnome.Tomboy",
-            "/org/gnome/Tomboy/RemoteControl"
-        ).AndReturn(dbus_object)
-        dbus.Interface(
-            dbus_object,
-            "org.gnome.Tomboy.RemoteControl"
-        ).AndRaise( dbus.DBusException("cosmos error") )
+        self.assertEqual(None, action_stats.events)
+        self.assertEqual([], action_stats.spans)
 
-        self.m.ReplayAll()
+    def test_report(self):
+        """Stats: The report lists phases and calls by method."""
+        action_stats = stats.Stats()
+        action_stats.add_phase("fetch", 1.0, 1.75)
+        action_stats.add_phase("write", 2.0, 2.25)
+        action_stats.record_call("ListAllNotes", 1.0, 1.5, ["a", "b"])
+        action_stats.record_call("GetNoteTitle", 1.5, 1.501, "abc")
+        action_stats.record_call("GetNoteTitle", 1.6, 1.603, "de")
 
-        self.assertRaises(core.ConnectionError, tt.__init__, "Tomboy")
+        output = StringIO.StringIO()
+        action_stats.report(output)
 
-        self.m.VerifyAll()
+        lines = output.getvalue().splitlines()
 
-        dbus.SessionBus = old_SessionBus
-        dbus.Interface = old_Interface
+        self.assertEqual("fetch                 750.0   75.0%", lines[4])
+        self.assertEqual("write                 250.0   25.0%", lines[7])
+        self.assertEqual("total                1000.0", lines[8])
+        self.assertEqual(
+            "GetNoteTitle              2          5     1.00     3.00     "
+            "3.00     3.00",
+            lines[11]
+        )
+        self.assertEqual(
+            "ListAllNotes              1          2   500.00   500.00   "
+            "500.00   500.00",
+            lines[12]
+        )
+        self.assertEqual(
+            "total                     3          7     3.00   500.00   "
+            "500.00   500.00",
+            lines[13]
+        )
 
 class TestList(BasicMocking, CLIMocking):
     """Tests for code that handles the notes and lists them."""
@@ -1112,7 +4035,7 @@ class TestList(BasicMocking, CLIMocking):
         self.m.ReplayAll()
 
         self.assertEqual(
-            [(uri, None) for uri in list_of_uris],
+            ([(uri, None) for uri in list_of_uris], {}, None),
             tt.get_uris_for_n_notes(None)
         )
 
@@ -1126,22 +4049,89 @@ class TestList(BasicMocking, CLIMocking):
 
         list_of_notes = test_data.full_list_of_notes(self.m)
 
-        list_of_uris = dbus.Array(
-            [note.uri for note in list_of_notes]
-        )
+        # The application doesn't list notes in any particular order.
+        shuffled = list_of_notes[5:] + list_of_notes[:5]
+        list_of_uris = dbus.Array( [note.uri for note in shuffled] )
 
         tt.comm.ListAllNotes()\
             .AndReturn( list_of_uris )
+        tt.call_many([("GetNoteChangeDate", (uri, )) for uri in list_of_uris])\
+            .AndReturn([note.date for note in shuffled])
 
         self.m.ReplayAll()
 
+        latest = sorted(list_of_notes, key=lambda n: n.date, reverse=True)[:6]
+
         self.assertEqual(
-            [(uri, None) for uri in list_of_uris[:6] ],
+            (
+                [(note.uri, None) for note in latest],
+                dict([(note.uri, note.date) for note in latest]),
+                None
+            ),
             tt.get_uris_for_n_notes(6)
         )
 
         self.m.VerifyAll()
 
+    def test_get_uris_for_n_notes_selected(self):
+        """List: The latest notes are taken among the selected ones."""
+        tt = self.wrap_subject(core.Tomtom, "get_uris_for_n_notes")
+
+        tt.comm = self.m.CreateMockAnything()
+
+        uris = ["note://tomboy/%d" % i for i in range(4)]
+        selection = ([], ["system:template"])
+
+        tt.comm.ListAllNotes()\
+            .AndReturn(uris)
+        tt.call_many([("GetNoteChangeDate", (uri, )) for uri in uris])\
+            .AndReturn([4, 1, 3, 2])
+        # The newest note is a template.
+        tt.select_uris_by_tags(uris, *selection)\
+            .AndReturn( set(uris[1:]) )
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            (
+                [(uris[2], None), (uris[3], None)],
+                {uris[2]: 3, uris[3]: 2},
+                None
+            ),
+            tt.get_uris_for_n_notes(2, selection)
+        )
+
+        self.m.VerifyAll()
+
+    def test_get_uris_for_n_notes_unknown_selection(self):
+        """List: All notes are given if the application can't select them."""
+        tt = self.wrap_subject(core.Tomtom, "get_uris_for_n_notes")
+
+        tt.comm = self.m.CreateMockAnything()
+
+        uris = ["note://tomboy/%d" % i for i in range(3)]
+        selection = ([], ["system:template"])
+
+        tt.comm.ListAllNotes()\
+            .AndReturn(uris)
+        tt.call_many([("GetNoteChangeDate", (uri, )) for uri in uris])\
+            .AndReturn([1, 3, 2])
+        tt.select_uris_by_tags(uris, *selection)\
+            .AndReturn(None)
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            (
+                [(uris[1], None), (uris[2], None), (uris[0], None)],
+                {uris[0]: 1, uris[1]: 3, uris[2]: 2},
+                selection
+            ),
+            tt.get_uris_for_n_notes(1, selection)
+        )
+
+        self.m.VerifyAll()
+
     def test_listing(self):
         """List: Format information of a list of notes."""
         lst_ap = self.wrap_subject(_list.ListAction, "listing")
@@ -1169,7 +4159,7 @@ class TestList(BasicMocking, CLIMocking):
 
         self.assertEqual(
             test_data.expected_list + os.linesep + test_data.list_appendix,
-            lst_ap.listing(list_of_notes)
+            os.linesep.join( lst_ap.listing(list_of_notes) )
         )
 
         self.m.VerifyAll()
@@ -1280,8 +4270,11 @@ class TestList(BasicMocking, CLIMocking):
             exclude_templates=not with_templates
         ).AndReturn(list_of_notes)
 
+        listing = test_data.expected_list.splitlines()
+
         lst_ap.listing(list_of_notes)\
-            .AndReturn(test_data.expected_list)
+            .AndReturn(listing)
+        lst_ap.write_lines(listing)
 
         self.m.ReplayAll()
 
@@ -1289,11 +4282,6 @@ class TestList(BasicMocking, CLIMocking):
 
         self.m.VerifyAll()
 
-        self.assertEqual(
-            test_data.expected_list + os.linesep,
-            sys.stdout.getvalue()
-        )
-
     def test_perform_action(self):
         """List: perform_action called without arguments."""
         self.verify_perform_action(with_templates=False)
@@ -1330,12 +4318,12 @@ class TestDisplay(BasicMocking, CLIMocking):
         self.m.ReplayAll()
 
         self.assertEqual(
-            os.linesep.join([
+            [
                 note1_content,
                 test_data.display_separator,
                 note2_content,
-            ]),
-            dsp_ap.format_display_for_notes(notes)
+            ],
+            list( dsp_ap.format_display_for_notes(notes) )
         )
 
         self.m.VerifyAll()
@@ -1348,6 +4336,100 @@ class TestDisplay(BasicMocking, CLIMocking):
 
         list_of_notes = test_data.full_list_of_notes(self.m)
 
+        note = list_of_notes[12]
+        raw_content = test_data.note_contents_from_dbus[note.title]
+
+        tt.comm.GetNoteContents(note.uri)\
+            .AndReturn( raw_content )
+        tt.format_content(note, raw_content)\
+            .AndReturn("formatted")
+
+        self.m.ReplayAll()
+
+        self.assertEqual( "formatted", tt.get_note_content(note) )
+
+        self.m.VerifyAll()
+
+    def test_Tomtom_get_note_content_with_cache(self):
+        """Display: One note's content goes through the content cache."""
+        tt = self.wrap_subject(core.Tomtom, "get_note_content")
+        tt.contents = self.m.CreateMock(contents.ContentCache)
+
+        note = test_data.full_list_of_notes(self.m)[12]
+
+        tt.fetch_contents([note])\
+            .AndReturn(["raw content"])
+        tt.format_content(note, "raw content")\
+            .AndReturn("formatted")
+
+        self.m.ReplayAll()
+
+        self.assertEqual( "formatted", tt.get_note_content(note) )
+
+        self.m.VerifyAll()
+
+    def test_Tomtom_fetch_contents_with_cache(self):
+        """Display: Only contents missing from the cache are fetched."""
+        tt = self.wrap_subject(core.Tomtom, "fetch_contents")
+        tt.contents = self.m.CreateMock(contents.ContentCache)
+
+        cached = core.TomboyNote("note://a", date=10)
+        changed = core.TomboyNote("note://b", date=20)
+        undated = core.TomboyNote("note://c")
+
+        tt.call_many([("GetNoteChangeDate", ("note://c", ))])\
+            .AndReturn([30])
+        tt.contents.lookup([
+            ("note://a", 10), ("note://b", 20), ("note://c", 30)
+        ]).AndReturn({"note://a": u"content a"})
+        tt.call_many([
+            ("GetNoteContents", ("note://b", )),
+            ("GetNoteContents", ("note://c", )),
+        ]).AndReturn([u"content b", u"content c"])
+        tt.contents.store([
+            ("note://b", 20, u"content b"),
+            ("note://c", 30, u"content c"),
+        ])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            [u"content a", u"content b", u"content c"],
+            tt.fetch_contents([cached, changed, undated])
+        )
+
+        self.m.VerifyAll()
+
+        self.assertEqual(30, undated.date)
+
+    def test_Tomtom_get_note_contents(self):
+        """Display: Contents of many notes are fetched together."""
+        tt = self.wrap_subject(core.Tomtom, "get_note_contents")
+
+        notes = test_data.full_list_of_notes(self.m)[:2]
+
+        tt.fetch_contents(notes)\
+            .AndReturn(["content 1", "content 2"])
+        tt.format_content(notes[0], "content 1")\
+            .AndReturn("formatted 1")
+        tt.format_content(notes[1], "content 2")\
+            .AndReturn("formatted 2")
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            ["formatted 1", "formatted 2"],
+            tt.get_note_contents(notes)
+        )
+
+        self.m.VerifyAll()
+
+    def test_Tomtom_format_content(self):
+        """Display: Tags are added after the note's name."""
+        tt = self.wrap_subject(core.Tomtom, "format_content")
+
+        list_of_notes = test_data.full_list_of_notes(self.m)
+
         note = list_of_notes[12]
         raw_content = test_data.note_contents_from_dbus[note.title]
         lines = raw_content.splitlines()
@@ -1357,12 +4439,12 @@ class TestDisplay(BasicMocking, CLIMocking):
         )
         expected_result = os.linesep.join(lines)
 
-        tt.comm.GetNoteContents(note.uri)\
-            .AndReturn( raw_content )
-
         self.m.ReplayAll()
 
-        self.assertEqual( expected_result, tt.get_note_content(note) )
+        self.assertEqual(
+            expected_result,
+            tt.format_content(note, raw_content)
+        )
 
         self.m.VerifyAll()
 
@@ -1374,13 +4456,18 @@ class TestDisplay(BasicMocking, CLIMocking):
         fake_options = self.m.CreateMock(optparse.Values)
         notes = [ self.m.CreateMock(core.TomboyNote) ]
 
-        dsp_ap.tomboy_interface.get_notes(names=["addressbook"])\
-            .AndReturn(notes)
+        dsp_ap.tomboy_interface.get_notes(
+            names=["addressbook"],
+            fields=("tags", )
+        ).AndReturn(notes)
+
+        contents = [
+            test_data.note_contents_from_dbus["addressbook"].decode("utf-8")
+        ]
 
         dsp_ap.format_display_for_notes(notes)\
-            .AndReturn(
-                test_data.note_contents_from_dbus["addressbook"].decode("utf-8")
-            )
+            .AndReturn(contents)
+        dsp_ap.write_lines(contents)
 
         self.m.ReplayAll()
 
@@ -1388,11 +4475,6 @@ class TestDisplay(BasicMocking, CLIMocking):
 
         self.m.VerifyAll()
 
-        self.assertEqual(
-            test_data.note_contents_from_dbus["addressbook"] + os.linesep,
-            sys.stdout.getvalue()
-        )
-
     def test_perform_action_too_few_arguments(self):
         """Display: perform_action without any argument displays an error."""
         dsp_ap = self.wrap_subject(display.DisplayAction, "perform_action")
@@ -1436,19 +4518,132 @@ class TestSearch(BasicMocking, CLIMocking):
 
         expected_result = test_data.search_structure
 
-        for note in list_of_notes:
-            srch_ap.tomboy_interface.get_note_content(note)\
-                .AndReturn(note_contents[note.title])
+        srch_ap.tomboy_interface.search_candidates(
+            "john doe", list_of_notes, False
+        ).AndReturn(None)
+
+        srch_ap.tomboy_interface.get_note_contents(list_of_notes)\
+            .AndReturn([note_contents[n.title] for n in list_of_notes])
 
         self.m.ReplayAll()
 
         self.assertEqual(
             expected_result,
-            srch_ap.search_for_text("john doe", list_of_notes)
+            list( srch_ap.search_for_text("john doe", list_of_notes) )
+        )
+
+        self.m.VerifyAll()
+
+    def test_search_for_text_with_candidates(self):
+        """Search: Only candidate lines from the index are searched."""
+        srch_ap = self.wrap_subject(search.SearchAction, "search_for_text")
+        srch_ap.tomboy_interface = self.m.CreateMock(core.Tomtom)
+
+        list_of_notes = test_data.full_list_of_notes(self.m)[:-1]
+        addressbook = [n for n in list_of_notes if n.title == "addressbook"][0]
+        content = test_data.note_contents_from_dbus["addressbook"]
+
+        # Line 2 is a false positive from the index. It must get verified.
+        srch_ap.tomboy_interface.search_candidates(
+            "john doe", list_of_notes, False
+        ).AndReturn({addressbook.uri: [2, 5]})
+
+        srch_ap.tomboy_interface.get_note_contents([addressbook])\
+            .AndReturn([content])
+
+        self.m.ReplayAll()
+
+        self.assertEqual(
+            test_data.search_structure[:1],
+            list( srch_ap.search_for_text("john doe", list_of_notes) )
         )
 
         self.m.VerifyAll()
 
+    def test_search_for_text_with_jobs(self):
+        """Search: Worker processes give results in the order of notes."""
+        srch_ap = self.wrap_subject(search.SearchAction, "search_for_text")
+        srch_ap.tomboy_interface = self.m.CreateMock(core.Tomtom)
+
+        old_batch_size = search.CONTENT_BATCH_SIZE
+        search.CONTENT_BATCH_SIZE = 2
+
+        list_of_notes = test_data.full_list_of_notes(self.m)[:-1]
+        notes = [core.TomboyNote(n.uri, n.title) for n in list_of_notes]
+
+        srch_ap.tomboy_interface.search_candidates("john doe", notes, False)\
+            .AndReturn(None)
+
+        for batch in cache.chunks(notes, 2):
+            srch_ap.tomboy_interface.get_note_contents(batch)\
+                .AndReturn([
+                    test_data.note_contents_from_dbus[n.title] for n in batch
+                ])
+
+        self.m.ReplayAll()
+
+        try:
+            results = list( srch_ap.search_for_text("john doe", notes, 2) )
+        finally:
+            search.CONTENT_BATCH_SIZE = old_batch_size
+
+        self.assertEqual( test_data.search_structure, results )
+
+        self.m.VerifyAll()
+
+    def test_is_literal(self):
+        """Search: Patterns without special characters are literals."""
+        self.assertTrue( matching.is_literal(u"john doe") )
+        self.assertTrue( matching.is_literal(u"e-mail: #1") )
+        self.assertFalse( matching.is_literal(u"john.doe") )
+        self.assertFalse( matching.is_literal(u"(john)") )
+        self.assertFalse( matching.is_literal(u"john\n") )
+        self.assertFalse( matching.is_literal(u"") )
+
+    def test_line_bounds(self):
+        """Search: Lines are found at the same offsets as splitlines."""
+        for text in [u"", u"a", u"a\n", u"a\r\n\nb", u"a\u2028b\n\n",
+                "a\rb", "a\x0cb"]:
+            starts, ends = matching.line_bounds(text)
+
+            self.assertEqual(
+                text.splitlines(),
+                [text[s:e] for (s, e) in zip(starts, ends)]
+            )
+
+    def test_matcher_literal(self):
+        """Search: Literal patterns are found regardless of case."""
+        matcher = matching.Matcher(u"john doe")
+        content = u"John Doe\nCall JOHN DOE\n\nno\njohn doe and john doe"
+
+        self.assertEqual(u"john doe", matcher.literal)
+        self.assertEqual(
+            [(0, u"Call JOHN DOE"), (3, u"john doe and john doe")],
+            matcher.matching_lines(content)
+        )
+        self.assertEqual(
+            [(3, u"john doe and john doe")],
+            matcher.matching_lines(content, [1, 3, 9])
+        )
+
+    def test_matcher_folds_ascii_case_only(self):
+        """Search: Literals match the same characters as regexes."""
+        # The Kelvin sign is "k" in lower case, but regexes don't fold it.
+        matcher = matching.Matcher(u"k")
+        content = u"title\n\u212a\nK"
+
+        self.assertEqual( [(1, u"K")], matcher.matching_lines(content) )
+        self.assertEqual( [(1, u"K")], matcher.matching_lines(content, [0, 1]) )
+
+    def test_matcher_regular_expression(self):
+        """Search: Regular expressions are searched line by line."""
+        matcher = matching.Matcher(u"^j.hn\\sdoe$")
+        content = u"title\nJohn Doe\nCall John Doe\njohn\ndoe"
+
+        self.assertEqual(None, matcher.literal)
+        self.assertEqual( [(0, u"John Doe")], matcher.matching_lines(content) )
+        self.assertEqual( [], matcher.matching_lines(content, [1, 2]) )
+
     def test_init_options(self):
         """Search: Search options are initialized correctly."""
         fake_filtering_group = self.m.CreateMock(plugins.FilteringGroup)
@@ -1460,6 +4655,20 @@ class TestSearch(BasicMocking, CLIMocking):
             use_mock_anything=True
         )
 
+        srch_ap.add_option(
+            "-j", "--jobs", type="int",
+            dest="jobs", default=1,
+            help="Number of processes matching notes at the same time."
+        )
+        srch_ap.add_option(
+            "--application-search", action="store_true",
+            dest="application_search", default=False,
+            help="Without the search index (--no-cache), ask the " \
+                "application which notes contain plain words instead of " \
+                "going through all notes. Its search misses words split by " \
+                "formatting."
+        )
+
         plugins.FilteringGroup("Search")\
             .AndReturn(fake_filtering_group)
 
@@ -1491,15 +4700,23 @@ class TestSearch(BasicMocking, CLIMocking):
         fake_options = self.m.CreateMock(optparse.Values)
         fake_options.tags = list(tags)
         fake_options.templates = with_templates
+        fake_options.jobs = 1
+        fake_options.application_search = False
 
         srch_ap.tomboy_interface.get_notes(
             names=["note1", "note2"],
             tags=["something"],
-            exclude_templates=not with_templates
+            exclude_templates=not with_templates,
+            fields=("title", "tags")
         ).AndReturn(list_of_notes)
 
-        srch_ap.search_for_text("findme", list_of_notes)\
+        lines = test_data.search_results.splitlines()
+
+        srch_ap.search_for_text("findme", list_of_notes, 1, False)\
             .AndReturn(test_data.search_structure)
+        srch_ap.listing(test_data.search_structure)\
+            .AndReturn(lines)
+        srch_ap.write_lines(lines)
 
         self.m.ReplayAll()
 
@@ -1507,11 +4724,19 @@ class TestSearch(BasicMocking, CLIMocking):
 
         self.m.VerifyAll()
 
+    def test_listing(self):
+        """Search: Results are formatted one per line."""
+        srch_ap = self.wrap_subject(search.SearchAction, "listing")
+
+        self.m.ReplayAll()
+
         self.assertEqual(
-            test_data.search_results + os.linesep,
-            sys.stdout.getvalue()
+            test_data.search_results,
+            os.linesep.join( srch_ap.listing(test_data.search_structure) )
         )
 
+        self.m.VerifyAll()
+
     def test_perform_action(self):
         """Search: perform_action without filters."""
         self.verify_perform_action(with_templates=False)
@@ -1585,6 +4810,28 @@ class TestPlugins(BasicMocking):
             action.option_groups
         )
 
+    def test_write_lines(self):
+        """Plugins: Lines are printed one at a time and flushed once."""
+        ap = self.wrap_subject(plugins.ActionPlugin, "write_lines")
+
+        old_stdout = sys.stdout
+        sys.stdout = self.m.CreateMock(file)
+
+        sys.stdout.write("first")
+        sys.stdout.write("\n")
+        sys.stdout.write("s\xc3\xa9cond")
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+        self.m.ReplayAll()
+
+        try:
+            ap.write_lines([u"first", u"s\xe9cond"])
+        finally:
+            sys.stdout = old_stdout
+
+        self.m.VerifyAll()
+
     def test_add_option(self):
         """Plugins: ActionPlugin.add_option inserts an option in a group."""
         ap = self.wrap_subject(plugins.ActionPlugin, "add_option")
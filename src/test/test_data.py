@@ -79,6 +79,63 @@ book_limited_list = \
 normally_hidden_template = \
 """2009-09-19 | New note template  (system:template, system:notebook:pim)"""
 
+# Note files read by the "files" backend. Values are title, change date, tags
+# and the XML content of the note.
+note_files = {
+    "1c1a7a30-0a43-4d39-a91e-6d5e6e4d7a11": (
+        "addressbook",
+        "2009-11-09T12:10:03.1234560-05:00",
+        ["system:notebook:pim"],
+        """addressbook\n\nMomma Chicken - 444-1919\n"""
+        """<bold>John Doe</bold> (cell) - 555-5512""",
+    ),
+    "2b6e0a8e-55c4-4c49-bb1d-2a1b8c7d5e22": (
+        "TODO-list",
+        "2009-11-02T12:15:03.1234560+01:00",
+        ["system:notebook:reminders", "system:notebook:pim"],
+        """TODO-list\n\n<list><list-item dir="ltr">Build unit tests """
+        """for tomtom</list-item></list>""",
+    ),
+    "3d0f4c51-7e21-4f0b-8a9c-3c2d9e8f6a33": (
+        "python-work",
+        "2009-10-22T12:00:00.0000000-04:00",
+        [],
+        """python-work\n\nI need to ask Shintarou to prepare things""",
+    ),
+}
+
+note_file_template = """<?xml version="1.0" encoding="utf-8"?>
+<note version="0.3" xmlns:link="http://beatniksoftware.com/tomboy/link" """ \
+"""xmlns:size="http://beatniksoftware.com/tomboy/size" """ \
+"""xmlns="http://beatniksoftware.com/tomboy">
+  <title>%(title)s</title>
+  <text xml:space="preserve"><note-content version="0.1">%(content)s""" \
+"""</note-content></text>
+  <last-change-date>%(date)s</last-change-date>
+  <last-metadata-change-date>%(date)s</last-metadata-change-date>
+  <create-date>2009-01-01T10:00:00.0000000-05:00</create-date>
+  <cursor-position>0</cursor-position>
+  <width>450</width>
+  <height>360</height>
+  <x>0</x>
+  <y>0</y>
+  <tags>%(tags)s
+  </tags>
+  <open-on-startup>False</open-on-startup>
+</note>
+"""
+
+expected_list_from_files = \
+"""2009-11-09 | addressbook  (system:notebook:pim)
+2009-11-02 | TODO-list  (system:notebook:reminders, system:notebook:pim)
+2009-10-22 | python-work"""
+
+expected_display_from_files = \
+"""addressbook  (system:notebook:pim)
+
+Momma Chicken - 444-1919
+John Doe (cell) - 555-5512"""
+
 # Output values that are expected for the "search" feature.
 search_results = \
 """addressbook : 5 : John Doe (cell) - 555-5512
@@ -232,6 +289,20 @@ def note_mock(m, uri, title, date, tags):
 # >>> l = tomboy.ListAllNotes()
 # >>> [(datetime.fromtimestamp(tomboy.GetNoteChangeDate(url)),
 # >>>     tomboy.GetNoteChangeDate(url)) for url in l]
+def write_note_files(directory):
+    """Write the test note files in a directory."""
+    for guid, (title, date, tags, content) in note_files.items():
+        note_file = open( os.path.join(directory, guid + ".note"), "w" )
+        note_file.write(note_file_template % {
+            "title": title,
+            "date": date,
+            "content": content,
+            "tags": "".join(
+                ["\n    <tag>%s</tag>" % tag for tag in tags]
+            ),
+        })
+        note_file.close()
+
 def full_list_of_notes(mock_factory):
     return [
         note_mock(
@@ -354,6 +425,10 @@ Options depend on what action you are taking. To obtain details on options for
 a particular action, combine one of "-h" or "--help" with the action name or
 use "help" before the action name.
 
+Use "app_name shell" to run actions one after the other in a single process,
+with completion of note titles, or "app_name batch" to run the actions read
+from the standard input, one per line.
+
 Here is a list of all the available actions:
 """
 
@@ -363,6 +438,25 @@ help_details_list = \
 Options:
   -h, --help          show this help message and exit
   --gnote             Make tomtom connect to Gnote via DBus instead of Tomboy.
+  --backend=BACKEND   How to read notes: "dbus" talks to the running
+                      application, "files" reads note files directly, which
+                      doesn't need the application to be running, and "auto"
+                      reads note files only when the application is not
+                      running, instead of starting it. Default: dbus.
+  --pipelined         Fetch information about notes with asynchronous DBus
+                      calls. This is much faster with a large number of notes.
+  --no-cache          Don't use the caches of note information and contents or
+                      the search index. All information is fetched from the
+                      application.
+  --stats             Print on standard error how many calls were made to the
+                      application, how much data they returned, how long they
+                      took, and where time was spent.
+  --profile=FILE      Profile the action with cProfile and write the
+                      statistics to FILE. They can be read with the pstats
+                      module.
+  --trace-file=FILE   Write a trace of the calls made to the application and
+                      of the phases of the action to FILE, in the Chrome trace
+                      event format.
   -n MAX_NOTES        Limit the number of notes listed.
 
   Filtering:
@@ -385,40 +479,102 @@ Options:
 help_details_display = """Usage: app_name display [-h] [note_name ...]
 
 Options:
-  -h, --help  show this help message and exit
-  --gnote     Make tomtom connect to Gnote via DBus instead of Tomboy."""
+  -h, --help         show this help message and exit
+  --gnote            Make tomtom connect to Gnote via DBus instead of Tomboy.
+  --backend=BACKEND  How to read notes: "dbus" talks to the running
+                     application, "files" reads note files directly, which
+                     doesn't need the application to be running, and "auto"
+                     reads note files only when the application is not
+                     running, instead of starting it. Default: dbus.
+  --pipelined        Fetch information about notes with asynchronous DBus
+                     calls. This is much faster with a large number of notes.
+  --no-cache         Don't use the caches of note information and contents or
+                     the search index. All information is fetched from the
+                     application.
+  --stats            Print on standard error how many calls were made to the
+                     application, how much data they returned, how long they
+                     took, and where time was spent.
+  --profile=FILE     Profile the action with cProfile and write the statistics
+                     to FILE. They can be read with the pstats module.
+  --trace-file=FILE  Write a trace of the calls made to the application and of
+                     the phases of the action to FILE, in the Chrome trace
+                     event format."""
 
 help_details_search = \
 """Usage: app_name search -h
        app_name search [-b <book name>[,...]|-t <tag>[,...]|--with-templates] <search_pattern> [note_name ...]
 
 Options:
-  -h, --help          show this help message and exit
-  --gnote             Make tomtom connect to Gnote via DBus instead of Tomboy.
+  -h, --help            show this help message and exit
+  --gnote               Make tomtom connect to Gnote via DBus instead of
+                        Tomboy.
+  --backend=BACKEND     How to read notes: "dbus" talks to the running
+                        application, "files" reads note files directly, which
+                        doesn't need the application to be running, and "auto"
+                        reads note files only when the application is not
+                        running, instead of starting it. Default: dbus.
+  --pipelined           Fetch information about notes with asynchronous DBus
+                        calls. This is much faster with a large number of
+                        notes.
+  --no-cache            Don't use the caches of note information and contents
+                        or the search index. All information is fetched from
+                        the application.
+  --stats               Print on standard error how many calls were made to
+                        the application, how much data they returned, how long
+                        they took, and where time was spent.
+  --profile=FILE        Profile the action with cProfile and write the
+                        statistics to FILE. They can be read with the pstats
+                        module.
+  --trace-file=FILE     Write a trace of the calls made to the application and
+                        of the phases of the action to FILE, in the Chrome
+                        trace event format.
+  -j JOBS, --jobs=JOBS  Number of processes matching notes at the same time.
+  --application-search  Without the search index (--no-cache), ask the
+                        application which notes contain plain words instead of
+                        going through all notes. Its search misses words split
+                        by formatting.
 
   Filtering:
     Filter notes by different criteria.
 
-    -b BOOKS          Search only notes belonging to specified notebooks. It
-                      is a shortcut to option "-t" to specify notebooks more
-                      easily. For example, use "-b HGTTG" instead of "-t
-                      system:notebook:HGTTG". Use this option once for each
-                      desired book.
-    --with-templates  Include template notes. This option is different from
-                      using "-t system:template" in that the latter used alone
-                      will only include the templates, while "using "--with-
-                      templates" without specifying tags for selection will
-                      include all notes and templates.
-    -t TAGS           Search only notes with specified tags. Use this option
-                      once for each desired tag. This option selects raw tags
-                      and could be useful for user-assigned tags."""
+    -b BOOKS            Search only notes belonging to specified notebooks. It
+                        is a shortcut to option "-t" to specify notebooks more
+                        easily. For example, use "-b HGTTG" instead of "-t
+                        system:notebook:HGTTG". Use this option once for each
+                        desired book.
+    --with-templates    Include template notes. This option is different from
+                        using "-t system:template" in that the latter used
+                        alone will only include the templates, while "using
+                        "--with-templates" without specifying tags for
+                        selection will include all notes and templates.
+    -t TAGS             Search only notes with specified tags. Use this option
+                        once for each desired tag. This option selects raw
+                        tags and could be useful for user-assigned tags."""
 
 help_details_version = \
 """Usage: app_name version [-h]
 
 Options:
-  -h, --help  show this help message and exit
-  --gnote     Make tomtom connect to Gnote via DBus instead of Tomboy."""
+  -h, --help         show this help message and exit
+  --gnote            Make tomtom connect to Gnote via DBus instead of Tomboy.
+  --backend=BACKEND  How to read notes: "dbus" talks to the running
+                     application, "files" reads note files directly, which
+                     doesn't need the application to be running, and "auto"
+                     reads note files only when the application is not
+                     running, instead of starting it. Default: dbus.
+  --pipelined        Fetch information about notes with asynchronous DBus
+                     calls. This is much faster with a large number of notes.
+  --no-cache         Don't use the caches of note information and contents or
+                     the search index. All information is fetched from the
+                     application.
+  --stats            Print on standard error how many calls were made to the
+                     application, how much data they returned, how long they
+                     took, and where time was spent.
+  --profile=FILE     Profile the action with cProfile and write the statistics
+                     to FILE. They can be read with the pstats module.
+  --trace-file=FILE  Write a trace of the calls made to the application and of
+                     the phases of the action to FILE, in the Chrome trace
+                     event format."""
 
 too_few_arguments_error = \
 (os.linesep * 2).join([
@@ -431,6 +587,15 @@ help_more_details
 unexistant_note_error = \
     """app_name: Error: Note named "unexistant" was not found."""
 
+unexistant_notes_error = os.linesep.join([
+    """app_name: Error: Note named "unexistant" was not found.""",
+    """app_name: Error: Note named "other" was not found.""",
+])
+
+cache_error_message = \
+    """app_name: Warning: Could not open cache /cache/tomboy.sqlite: """ + \
+    """Permission denied"""
+
 unknown_action = """app_name: unexistant_action is not a valid action. """ + \
                  """Use option -h for a list of available actions."""
 
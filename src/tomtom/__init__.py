@@ -4,4 +4,9 @@ All code for Tomtom resides under this package. Main application entry point,
 called by the script invoked by users is defined in module "cli". Entry points
 for actions are defined in code residing under the "actions" package.
 
+The version number is kept here so that it can be known without importing the
+modules that talk to Tomboy or Gnote.
+
 """
+# This must be modified with all version bumps!
+TOMTOM_VERSION = "0.2"
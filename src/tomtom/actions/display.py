@@ -71,6 +71,7 @@ class DisplayAction(ActionPlugin):
     """Plugin object for displaying notes' contents"""
     short_description = DESC
     usage = "%prog display [-h] [note_name ...]"
+    needs_application = False
     note_separator = "=========================="
 
     def perform_action(self, options, positional):
@@ -88,22 +89,28 @@ class DisplayAction(ActionPlugin):
                 "Error: You need to specify a note name to display it"
             sys.exit(TOO_FEW_ARGUMENTS_ERROR_RETURN_CODE)
 
-        notes = self.tomboy_interface.get_notes(names=positional)
+        # Titles are known and dates are not displayed. Tags are shown next to
+        # the title.
+        notes = self.tomboy_interface.get_notes(
+            names=positional,
+            fields=("tags", )
+        )
 
-        print self.format_display_for_notes(notes).encode('utf-8')
+        self.write_lines( self.format_display_for_notes(notes) )
 
     def format_display_for_notes(self, notes):
-        """Get contents of a list of notes.
+        """Get contents of notes.
 
-        Given a list of note names, this method retrieves the notes' contents
-        and returns them. It applies a separator between each notes displayed.
+        Given an iterable of notes, this method retrieves the notes' contents
+        one at a time and generates them, with a separator between each notes
+        displayed. Only one note's content is held at a time.
 
         Arguments:
-            notes -- list of notes to display
+            notes -- iterable of notes to display
 
         """
-        separator = os.linesep + self.note_separator + os.linesep
+        for position, note in enumerate(notes):
+            if position:
+                yield self.note_separator
 
-        return separator.join(
-            [self.tomboy_interface.get_note_content(note) for note in notes]
-        )
+            yield self.tomboy_interface.get_note_content(note)
@@ -68,6 +68,7 @@ class ListAction(plugins.ActionPlugin):
     """Plugin object for listing notes"""
     short_description = DESC
     usage = "%prog list [-h|-n <num>|-t <tag>[,...]|-b <book>[,...]]"
+    needs_application = False
 
     def init_options(self):
         """Set the action's options."""
@@ -101,16 +102,17 @@ class ListAction(plugins.ActionPlugin):
             exclude_templates=not options.templates
         )
 
-        print self.listing(list_of_notes).encode('utf-8')
+        self.write_lines( self.listing(list_of_notes) )
 
     def listing(self, notes):
-        """Format listing for a list of note objects.
+        """Format listing for note objects.
 
-        Given a list of notes, this method collects listing information for
-        those notes and returns a global listing.
+        Given an iterable of notes, this method generates the listing line of
+        each note as the note comes.
 
         Arguments:
-            notes -- a list of TomboyNote objects
+            notes -- an iterable of TomboyNote objects
 
         """
-        return os.linesep.join( [note.listing() for note in notes] )
+        for note in notes:
+            yield note.listing()
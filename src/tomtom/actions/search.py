@@ -61,22 +61,88 @@ the content of the line on which the text is appearing.
 """
 import sys
 import os
-import re
+import collections
 
-from tomtom import plugins
-from tomtom.cli import TOO_FEW_ARGUMENTS_ERROR_RETURN_CODE
+from tomtom import plugins, matching
+from tomtom.cache import chunks
+from tomtom.cli import TOO_FEW_ARGUMENTS_ERROR_RETURN_CODE, \
+    ACTION_OPTION_TYPE_ERROR_RETURN_CODE
 
 DESC = __doc__.splitlines()[0]
 
+# Number of notes whose contents are requested at once. In pipelined mode, the
+# requests for all of those notes are waiting for a reply at the same time.
+CONTENT_BATCH_SIZE = 64
+
+# With more than one job, each worker process can have this many notes waiting
+# to be matched or holding results that were not printed yet. This bounds the
+# number of results kept in memory while waiting for earlier notes.
+PENDING_NOTES_PER_JOB = 4
+
+# Matcher used by a worker process. It is set by start_worker.
+worker_matcher = None
+
+def match_note(matcher, title, content, line_numbers=None):
+    """Search for a pattern in the lines of a note.
+
+    It returns a list of search results for the lines that match.
+
+    Arguments:
+        matcher -- A tomtom.matching.Matcher object
+        title -- String, title of the note
+        content -- String, content of the note, starting with its title
+        line_numbers -- List of the numbers of the lines to search
+            (default: None, search all lines)
+
+    """
+    return [
+        {
+            "title": title,
+            "line": number,
+            "text": line,
+        }
+        for (number, line) in matcher.matching_lines(content, line_numbers)
+    ]
+
+def start_worker(search_pattern):
+    """Compile the search pattern once in a worker process."""
+    global worker_matcher
+
+    worker_matcher = matching.Matcher(search_pattern)
+
+def match_note_in_worker(title, content, line_numbers):
+    """Search for a pattern in the lines of a note, in a worker process.
+
+    This is a function instead of a method so that worker processes can run
+    it. See match_note.
+
+    """
+    return match_note(worker_matcher, title, content, line_numbers)
+
 class SearchAction(plugins.ActionPlugin):
     """Plugin object for searching text in notes"""
     short_description = DESC
     usage = """%prog search -h""" + os.linesep + \
         """       %prog search [-b <book name>[,...]|-t <tag>[,...]|""" + \
         """--with-templates] <search_pattern> [note_name ...]"""
+    needs_application = False
 
     def init_options(self):
         """Set action's options."""
+        self.add_option(
+            "-j", "--jobs", type="int",
+            dest="jobs", default=1,
+            help="Number of processes matching notes at the same time."
+        )
+        self.add_option(
+            "--application-search", action="store_true",
+            dest="application_search", default=False,
+            help="Without the search index (--no-cache), ask the " \
+                "application which notes contain plain words instead of " \
+                "going through all notes. Its search misses words split by " \
+                "formatting."
+        )
+
         self.add_option_library( plugins.FilteringGroup("Search") )
 
     def perform_action(self, options, positional):
@@ -95,45 +161,118 @@ class SearchAction(plugins.ActionPlugin):
                 "Error: You must specify a pattern to perform a search"
             sys.exit(TOO_FEW_ARGUMENTS_ERROR_RETURN_CODE)
 
+        if options.jobs < 1:
+            print >> sys.stderr, \
+                "Error: The number of jobs must be at least 1"
+            sys.exit(ACTION_OPTION_TYPE_ERROR_RETURN_CODE)
+
         search_pattern = positional[0]
         note_names = positional[1:]
 
+        # Dates of notes are not shown in results.
         notes = self.tomboy_interface.get_notes(
             names=note_names,
             tags=options.tags,
-            exclude_templates=not options.templates
+            exclude_templates=not options.templates,
+            fields=("title", "tags")
+        )
+
+        results = self.search_for_text(
+            search_pattern,
+            notes,
+            options.jobs,
+            options.application_search
         )
 
-        results = self.search_for_text(search_pattern, notes)
+        self.write_lines( self.listing(results) )
 
+    def listing(self, results):
+        """Format search results, one line per result, as they come.
+
+        Arguments:
+            results -- an iterable of search results
+
+        """
         for result in results:
             result_map = ( result["title"], result["line"], result["text"] )
 
-            print ("%s : %s : %s" % result_map).encode('utf-8')
+            yield "%s : %s : %s" % result_map
 
-    def search_for_text(self, search_pattern, notes):
+    def search_for_text(self, search_pattern, notes, jobs=1,
+            application_search=False):
         """Get specified notes and search for a pattern in them.
 
         This function performs a case-independant text search on the contents
-        of a list of notes.
+        of a list of notes. When the index can tell which notes, or which lines
+        of notes, may contain the pattern, only those notes are fetched and
+        only those lines are searched. The pattern is compiled once, before
+        anything is fetched.
+
+        This is a generator. Contents are fetched in batches and results are
+        given in the same order as the notes, as soon as the search of each
+        note is done. With more than one job, notes are matched by a pool of
+        worker processes while the next contents are fetched.
 
         Arguments:
             search_pattern -- String, pattern to seach for
-            notes -- List of notes to search on
+            notes -- Iterable of notes to search on
+            jobs -- Number of worker processes (default: 1, no workers)
+            application_search -- Boolean, without an index, ask the
+                application which notes contain plain words (default: False)
 
         """
-        search_results = []
-
-        for note in notes:
-            content = self.tomboy_interface.get_note_content(note)
-            lines = content.splitlines()[1:]
-            for index, line in enumerate(lines):
-                # Perform case-independant search of each word on each line
-                if re.search("(?i)%s" % (search_pattern, ), line):
-                    search_results.append({
-                        "title": note.title,
-                        "line": index,
-                        "text": line,
-                    })
-
-        return search_results
+        matcher = matching.Matcher(search_pattern)
+
+        # The index goes through the notes more than once. Only information
+        # about notes is kept, contents are still fetched in batches.
+        notes = list(notes)
+
+        candidates = self.tomboy_interface.search_candidates(
+            search_pattern,
+            notes,
+            application_search
+        )
+        if candidates is not None:
+            notes = [n for n in notes if n.uri in candidates]
+
+        pool = None
+        if jobs > 1:
+            # Imported only when needed, it takes time to import.
+            import multiprocessing
+
+            pool = multiprocessing.Pool(jobs, start_worker, (search_pattern, ))
+
+        pending = collections.deque()
+
+        try:
+            for batch in chunks(notes, CONTENT_BATCH_SIZE):
+                contents = self.tomboy_interface.get_note_contents(batch)
+
+                for note, content in zip(batch, contents):
+                    line_numbers = None
+                    if candidates is not None:
+                        line_numbers = candidates[note.uri]
+
+                    task = (note.title, content, line_numbers)
+
+                    if pool is None:
+                        for result in match_note(matcher, *task):
+                            yield result
+                        continue
+
+                    # Wait for the oldest note before going over the bound.
+                    if len(pending) >= jobs * PENDING_NOTES_PER_JOB:
+                        for result in pending.popleft().get():
+                            yield result
+
+                    pending.append(
+                        pool.apply_async(match_note_in_worker, task)
+                    )
+
+            while pending:
+                for result in pending.popleft().get():
+                    yield result
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Running many actions read from the standard input.
+
+"tomtom batch" reads one action and its arguments per line, split like a
+shell would, and runs them one after the other in the same process. Like in
+the shell, the connection to the application, the action plugins and the
+notes in memory are shared by all actions. Empty lines and lines that start
+with "#" are skipped.
+
+An action that fails doesn't stop the batch. The output of each action is
+either followed by a delimiter line, or sent as a JSON record on a single
+line with the action's arguments, its output, its errors and its exit
+status:
+
+    {"arguments": [...], "stdout": ..., "stderr": ..., "exit": <status>}
+
+Functions:
+    read_commands -- Get the arguments of the actions read from a file.
+    run_batch     -- Run actions and write their framed output.
+    main          -- Run a batch for "tomtom batch".
+
+Classes:
+    CapturedStream -- File-like object that keeps what is written to it.
+
+"""
+import sys
+import os
+import json
+import optparse
+
+from tomtom.daemon import DaemonCommandLine
+from tomtom.shell import split_arguments, run_action
+
+USAGE = "%prog batch [-h] [--json] [-d DELIMITER] < commands"
+
+# Exit status of lines that can't be split in arguments.
+MALFORMED_LINE_STATUS = 1
+
+class CapturedStream(object):
+    """File-like object that keeps what is written to it as unicode."""
+    def __init__(self):
+        super(CapturedStream, self).__init__()
+        self.parts = []
+        self.softspace = 0
+
+    def write(self, data):
+        """Keep data, decoding it from UTF-8."""
+        if not isinstance(data, unicode):
+            data = data.decode("utf-8", "replace")
+
+        self.parts.append(data)
+
+    def flush(self):
+        """Nothing to do, data is kept as soon as it is written."""
+        pass
+
+    def getvalue(self):
+        """Get everything that was written."""
+        return u"".join(self.parts)
+
+def read_commands(stream):
+    """Get the arguments of the actions read from a file, one per line.
+
+    Yields (arguments, error) pairs. Arguments is a list of unicode strings,
+    or None if the line can't be split, in which case error is the reason.
+
+    Arguments:
+        stream -- File to read lines from
+
+    """
+    for line in stream:
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+
+        try:
+            yield (split_arguments(line), None)
+        except ValueError, exc:
+            yield (None, "%s: %s" % (exc, line.strip()))
+
+def run_batch(command_line, commands, output, use_json=False, delimiter="--"):
+    """Run actions and write their framed output.
+
+    Without JSON, actions write directly to the standard streams, and the
+    delimiter is written on a line of its own after each action. With JSON,
+    their output and errors are kept during the action and written in a
+    record. Returns the exit status of the first action that failed, or 0.
+
+    Arguments:
+        command_line -- CommandLine used to dispatch actions
+        commands -- Iterable of (arguments, error) pairs, from read_commands
+        output -- File to write framed output to
+        use_json -- Boolean, write JSON records (default: False)
+        delimiter -- String written after the output of each action, without
+            JSON (default: "--")
+
+    """
+    app_name = os.path.basename(sys.argv[0])
+    first_failure = 0
+
+    for arguments, error in commands:
+        old_streams = (sys.stdout, sys.stderr)
+        if use_json:
+            sys.stdout = CapturedStream()
+            sys.stderr = CapturedStream()
+
+        try:
+            if arguments is None:
+                print >> sys.stderr, "%s: Error: %s" % (app_name, error)
+                status = MALFORMED_LINE_STATUS
+            else:
+                status = run_action(command_line, arguments)
+        finally:
+            streams = (sys.stdout, sys.stderr)
+            sys.stdout, sys.stderr = old_streams
+
+        if use_json:
+            output.write(json.dumps({
+                "arguments": arguments,
+                "stdout": streams[0].getvalue(),
+                "stderr": streams[1].getvalue(),
+                "exit": status,
+            }) + "\n")
+        else:
+            output.write(delimiter.encode("utf-8") + "\n")
+
+        output.flush()
+
+        if status and not first_failure:
+            first_failure = status
+
+    return first_failure
+
+def main(arguments):
+    """Run the actions read from the standard input for "tomtom batch".
+
+    Returns the exit status of the first action that failed, or 0.
+
+    Arguments:
+        arguments -- A list of the arguments that follow "batch"
+
+    """
+    parser = optparse.OptionParser(usage=USAGE)
+    parser.add_option(
+        "--json", dest="json", action="store_true", default=False,
+        help="""Write the arguments, output, errors and exit status of each """
+        """action as a JSON object on a single line."""
+    )
+    parser.add_option(
+        "-d", "--delimiter", dest="delimiter", default=u"--",
+        help="""Line written after the output of each action, without """
+        """"--json". Default: %default"""
+    )
+
+    options, positional = parser.parse_args(arguments)
+    if positional:
+        parser.error("Commands are read from the standard input.")
+
+    return run_batch(
+        DaemonCommandLine(),
+        read_commands(sys.stdin),
+        sys.stdout,
+        use_json=options.json,
+        delimiter=options.delimiter
+    )
@@ -0,0 +1,609 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Persistent cache of information about notes.
+
+Information about notes is kept between runs so that only notes that changed
+since the last run need to be fetched again from Tomboy or Gnote. Notes are
+identified by their URI and their change date tells if they are still fresh.
+
+The caches also keep an index of tags: each note gets a number, and each tag
+a bitmap (a long integer) where the bits of the notes that have the tag are
+set. Selecting notes by tags is then done with a few operations on integers.
+
+Functions:
+    chunks           -- Split a sequence in slices of limited size.
+    text             -- Get a unicode string from a byte or unicode string.
+    select_positions -- Select note positions with tag bitmaps.
+    cache_directory  -- Path to the directory where caches are kept.
+    cache_path       -- Path to the cache file of an application.
+
+Classes:
+    SqliteStore   -- sqlite database rebuilt when its structure changes.
+    MetadataCache -- sqlite cache of the titles, dates and tags of notes.
+    MemoryCache   -- In-memory cache of the same information.
+
+"""
+import os
+import sqlite3
+
+# Version of the structure of the cache (see SqliteStore).
+CACHE_VERSION = 3
+
+# sqlite refuses queries with more than 999 variables.
+SQL_VARIABLES_MAX = 500
+
+def chunks(sequence, size):
+    """Split a sequence in a list of slices of at most `size` elements."""
+    return [sequence[i:i + size] for i in range(0, len(sequence), size)]
+
+def text(value):
+    """Get a unicode string. Byte strings are decoded from UTF-8."""
+    if isinstance(value, str):
+        return value.decode("utf-8")
+
+    return unicode(value)
+
+def select_positions(positions, included=None, excluded=0):
+    """Find which notes are selected by tag bitmaps.
+
+    Returns the set of keys of `positions` whose bit is set in `included` and
+    not set in `excluded`.
+
+    Arguments:
+        positions -- dictionary that maps keys to bit positions
+        included -- long, bitmap of selected notes. None selects all notes.
+        excluded -- long, bitmap of notes to leave out (default: 0)
+
+    """
+    # Strings of bits, least significant first, are quicker to look into than
+    # shifting long integers for each note.
+    included_bits = None
+    if included is not None:
+        included_bits = bin(included)[:1:-1]
+    excluded_bits = bin(excluded)[:1:-1]
+
+    def is_set(bits, position):
+        return position < len(bits) and bits[position] == "1"
+
+    return set(
+        key for (key, position) in positions.iteritems()
+        if (included_bits is None or is_set(included_bits, position))
+            and not is_set(excluded_bits, position)
+    )
+
+def cache_directory():
+    """Get the path to the directory where tomtom keeps its caches.
+
+    This follows the XDG base directory specification.
+
+    """
+    base_directory = os.environ.get("XDG_CACHE_HOME")
+    if not base_directory:
+        base_directory = os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base_directory, "tomtom")
+
+def cache_path(application):
+    """Get the path to the cache file for notes of an application.
+
+    Arguments:
+        application -- string name of either Tomboy or Gnote.
+
+    """
+    return os.path.join(cache_directory(), "%s.sqlite" % application.lower())
+
+class SqliteStore(object):
+    """An sqlite database, emptied and rebuilt when its structure changes.
+
+    Subclasses give the version of their structure, which must be bumped
+    whenever the structure changes, and the script that drops and creates
+    their tables. The version is kept in the user_version of the database:
+    since caches and indexes only hold information that can be fetched again,
+    a database with another version is simply emptied and rebuilt.
+
+    """
+    version = None
+    schema = None
+
+    def __init__(self, path):
+        """Open the database, creating it if it doesn't exist.
+
+        Arguments:
+            path -- Path to the sqlite database file
+
+        """
+        super(SqliteStore, self).__init__()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=10)
+
+        self.check_version()
+
+    def check_version(self):
+        """Rebuild the tables if they were created by another version."""
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+        if version == self.version:
+            return
+
+        with self.connection:
+            self.connection.executescript(self.schema)
+            self.connection.execute(
+                "PRAGMA user_version = %d" % self.version
+            )
+
+class MetadataCache(SqliteStore):
+    """Cache of the titles, dates and tags of notes, keyed by URI.
+
+    The cache is an sqlite database. Every modification is done inside a
+    transaction so that a run that is interrupted never leaves the cache in an
+    inconsistent state.
+
+    Each note has a number, the id of its row. The tag_bitmaps table holds a
+    bitmap of note numbers for each tag, and is updated with the notes.
+
+    """
+    version = CACHE_VERSION
+    schema = """
+        DROP TABLE IF EXISTS notes;
+        DROP TABLE IF EXISTS tags;
+        DROP TABLE IF EXISTS tag_bitmaps;
+        CREATE TABLE notes (
+            id INTEGER PRIMARY KEY,
+            uri TEXT UNIQUE NOT NULL,
+            title TEXT NOT NULL,
+            date INTEGER NOT NULL
+        );
+        CREATE TABLE tags (
+            uri TEXT NOT NULL,
+            tag TEXT NOT NULL
+        );
+        CREATE INDEX notes_by_title ON notes (title COLLATE NOCASE);
+        CREATE INDEX tags_by_uri ON tags (uri);
+        CREATE TABLE tag_bitmaps (
+            id INTEGER PRIMARY KEY,
+            tag TEXT UNIQUE NOT NULL,
+            bitmap TEXT NOT NULL
+        );
+    """
+
+    def lookup(self, uris):
+        """Get cached information for a list of notes.
+
+        Returns a dictionary that maps URIs to (title, date, tags) tuples.
+        Notes that are not in the cache are absent from the dictionary.
+
+        Arguments:
+            uris -- list of note URIs
+
+        """
+        entries = {}
+
+        for chunk in chunks(uris, SQL_VARIABLES_MAX):
+            placeholders = ", ".join("?" * len(chunk))
+            arguments = [unicode(uri) for uri in chunk]
+
+            for uri, title, date in self.connection.execute(
+                    "SELECT uri, title, date FROM notes "
+                    "WHERE uri IN (%s)" % placeholders, arguments):
+                entries[uri] = (title, date, [])
+
+            for uri, tag in self.connection.execute(
+                    "SELECT uri, tag FROM tags "
+                    "WHERE uri IN (%s) ORDER BY rowid" % placeholders,
+                    arguments):
+                if uri in entries:
+                    entries[uri][2].append(tag)
+
+        return entries
+
+    def find_titles(self, titles):
+        """Find cached notes by their titles, ignoring case.
+
+        Returns a dictionary that maps titles to (uri, date) pairs. Titles of
+        notes that are not in the cache are absent from the dictionary. Cached
+        titles can be out of date: the date tells if a note is still fresh.
+
+        Arguments:
+            titles -- list of note titles
+
+        """
+        wanted = {}
+        for title in titles:
+            wanted.setdefault( text(title).lower(), [] ).append(title)
+
+        found = {}
+
+        for chunk in chunks(list(titles), SQL_VARIABLES_MAX):
+            for uri, title, date in self.connection.execute(
+                    "SELECT uri, title, date FROM notes "
+                    "WHERE title COLLATE NOCASE IN (%s)" %
+                    ", ".join("?" * len(chunk)),
+                    [text(title) for title in chunk]):
+                for requested in wanted.get(title.lower(), []):
+                    found[requested] = (uri, date)
+
+        return found
+
+    def store(self, notes):
+        """Save information about a list of notes in one transaction.
+
+        Arguments:
+            notes -- list of TomboyNote objects
+
+        """
+        bitmaps = {}
+
+        with self.connection:
+            for note in notes:
+                uri = unicode(note.uri)
+                position = self.remove_tags(uri, bitmaps)
+
+                if position is None:
+                    position = self.connection.execute(
+                        "INSERT INTO notes (uri, title, date) "
+                        "VALUES (?, ?, ?)",
+                        (uri, unicode(note.title), int(note.date))
+                    ).lastrowid
+                else:
+                    self.connection.execute(
+                        "UPDATE notes SET title = ?, date = ? WHERE id = ?",
+                        (unicode(note.title), int(note.date), position)
+                    )
+
+                tags = [unicode(tag) for tag in note.tags]
+                self.connection.executemany(
+                    "INSERT INTO tags (uri, tag) VALUES (?, ?)",
+                    [(uri, tag) for tag in tags]
+                )
+
+                for tag in tags:
+                    bitmap = self.load_bitmap(tag, bitmaps)
+                    bitmaps[tag] = bitmap | (1L << position)
+
+            self.save_bitmaps(bitmaps)
+
+    def forget(self, uris):
+        """Remove notes from the cache.
+
+        Arguments:
+            uris -- list of note URIs
+
+        """
+        bitmaps = {}
+
+        with self.connection:
+            for uri in uris:
+                if self.remove_tags(unicode(uri), bitmaps) is not None:
+                    self.connection.execute(
+                        "DELETE FROM notes WHERE uri = ?", (unicode(uri), )
+                    )
+
+            self.save_bitmaps(bitmaps)
+
+    def remove_tags(self, uri, bitmaps):
+        """Remove the tags of a note from the cache.
+
+        The bit of the note is cleared in the bitmaps of its tags. Returns the
+        position of the note, or None if the note is not in the cache.
+
+        Arguments:
+            uri -- unicode string, URI of the note
+            bitmaps -- dictionary of modified bitmaps, by tag
+
+        """
+        row = self.connection.execute(
+            "SELECT id FROM notes WHERE uri = ?", (uri, )
+        ).fetchone()
+        if row is None:
+            return None
+
+        position = row[0]
+
+        for (tag, ) in self.connection.execute(
+                "SELECT tag FROM tags WHERE uri = ?", (uri, )).fetchall():
+            bitmap = self.load_bitmap(tag, bitmaps)
+            bitmaps[tag] = bitmap & ~(1L << position)
+
+        self.connection.execute("DELETE FROM tags WHERE uri = ?", (uri, ))
+
+        return position
+
+    def load_bitmap(self, tag, bitmaps):
+        """Get the bitmap of a tag, from `bitmaps` if it was modified.
+
+        Arguments:
+            tag -- unicode string
+            bitmaps -- dictionary of modified bitmaps, by tag
+
+        """
+        if tag in bitmaps:
+            return bitmaps[tag]
+
+        row = self.connection.execute(
+            "SELECT bitmap FROM tag_bitmaps WHERE tag = ?", (tag, )
+        ).fetchone()
+        if row is None:
+            return 0L
+
+        return long(row[0], 16)
+
+    def save_bitmaps(self, bitmaps):
+        """Write modified bitmaps. Tags that no note has anymore are removed.
+
+        Arguments:
+            bitmaps -- dictionary of modified bitmaps, by tag
+
+        """
+        for tag, bitmap in bitmaps.iteritems():
+            if bitmap:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO tag_bitmaps (tag, bitmap) "
+                    "VALUES (?, ?)",
+                    (tag, "%x" % bitmap)
+                )
+            else:
+                self.connection.execute(
+                    "DELETE FROM tag_bitmaps WHERE tag = ?", (tag, )
+                )
+
+    def tags_bitmap(self, tags):
+        """Get the bitmap of the notes that have at least one of the tags.
+
+        Arguments:
+            tags -- list of tag strings
+
+        """
+        bitmap = 0L
+
+        for chunk in chunks(list(tags), SQL_VARIABLES_MAX):
+            for (hexadecimal, ) in self.connection.execute(
+                    "SELECT bitmap FROM tag_bitmaps WHERE tag IN (%s)" %
+                    ", ".join("?" * len(chunk)),
+                    [unicode(tag) for tag in chunk]):
+                bitmap |= long(hexadecimal, 16)
+
+        return bitmap
+
+    def select(self, uris, tags=None, excluded_tags=()):
+        """Select cached notes by their tags.
+
+        Returns the set of URIs of notes that have at least one of `tags` and
+        none of `excluded_tags`. Notes that are not in the cache are never
+        selected.
+
+        Arguments:
+            uris -- list of note URIs to select from
+            tags -- list of tag strings. None or empty selects all notes.
+            excluded_tags -- list of tag strings (default: ())
+
+        """
+        positions = {}
+
+        for chunk in chunks(uris, SQL_VARIABLES_MAX):
+            for uri, position in self.connection.execute(
+                    "SELECT uri, id FROM notes WHERE uri IN (%s)" %
+                    ", ".join("?" * len(chunk)),
+                    [unicode(uri) for uri in chunk]):
+                positions[uri] = position
+
+        included = None
+        if tags:
+            included = self.tags_bitmap(tags)
+
+        return select_positions(
+            positions, included, self.tags_bitmap(excluded_tags)
+        )
+
+class MemoryCache(object):
+    """In-memory cache of the titles, dates and tags of notes.
+
+    This has the same interface as MetadataCache. It is meant for long-running
+    processes, where keeping notes in memory avoids reading them from disk on
+    every action. It can sit in front of a persistent cache, in which case
+    lookups that miss are passed to it and modifications are written to it.
+
+    """
+    def __init__(self, backing=None):
+        """Constructor.
+
+        Arguments:
+            backing -- A MetadataCache object (default: None)
+
+        """
+        super(MemoryCache, self).__init__()
+
+        self.backing = backing
+        self.entries = {}
+
+        # Positions of notes in the tag bitmaps. Positions of forgotten notes
+        # are not reused; their bits are cleared.
+        self.positions = {}
+        self.next_position = 0
+        self.bitmaps = {}
+
+    def lookup(self, uris):
+        """Get cached information for a list of notes.
+
+        Returns a dictionary that maps URIs to (title, date, tags) tuples.
+
+        Arguments:
+            uris -- list of note URIs
+
+        """
+        missing = [uri for uri in uris if uri not in self.entries]
+        if missing and self.backing is not None:
+            for uri, entry in self.backing.lookup(missing).iteritems():
+                self.remember(uri, entry)
+
+        return dict(
+            (uri, self.entries[uri]) for uri in uris if uri in self.entries
+        )
+
+    def find_titles(self, titles):
+        """Find notes by their titles, ignoring case.
+
+        Returns a dictionary that maps titles to (uri, date) pairs. Titles not
+        found in memory are looked up in the backing cache.
+
+        Arguments:
+            titles -- list of note titles
+
+        """
+        wanted = {}
+        for title in titles:
+            wanted.setdefault( text(title).lower(), [] ).append(title)
+
+        found = {}
+        for uri, (title, date, tags) in self.entries.iteritems():
+            for requested in wanted.get(title.lower(), []):
+                found[requested] = (uri, date)
+
+        missing = [title for title in titles if title not in found]
+        if missing and self.backing is not None:
+            found.update( self.backing.find_titles(missing) )
+
+        return found
+
+    def store(self, notes):
+        """Save information about a list of notes.
+
+        Arguments:
+            notes -- list of TomboyNote objects
+
+        """
+        for note in notes:
+            self.remember( note.uri, (note.title, note.date, list(note.tags)) )
+
+        if self.backing is not None:
+            self.backing.store(notes)
+
+    def forget(self, uris):
+        """Remove notes from the cache.
+
+        Arguments:
+            uris -- list of note URIs
+
+        """
+        for uri in uris:
+            self.clear_tags(uri)
+            self.entries.pop(uri, None)
+            self.positions.pop(uri, None)
+
+        if self.backing is not None:
+            self.backing.forget(uris)
+
+    def titles(self):
+        """Get the titles of the notes that are in memory."""
+        return [title for (title, date, tags) in self.entries.itervalues()]
+
+    def remember(self, uri, entry):
+        """Keep information about a note and set its bit in its tags' bitmaps.
+
+        Arguments:
+            uri -- string, URI of the note
+            entry -- (title, date, tags) tuple
+
+        """
+        self.clear_tags(uri)
+
+        if uri not in self.positions:
+            self.positions[uri] = self.next_position
+            self.next_position += 1
+
+        position = self.positions[uri]
+
+        for tag in entry[2]:
+            self.bitmaps[tag] = self.bitmaps.get(tag, 0L) | (1L << position)
+
+        self.entries[uri] = entry
+
+    def clear_tags(self, uri):
+        """Clear the bit of a note in the bitmaps of its tags.
+
+        Arguments:
+            uri -- string, URI of the note
+
+        """
+        if uri not in self.entries:
+            return
+
+        position = self.positions[uri]
+        for tag in self.entries[uri][2]:
+            bitmap = self.bitmaps[tag] & ~(1L << position)
+            if bitmap:
+                self.bitmaps[tag] = bitmap
+            else:
+                del self.bitmaps[tag]
+
+    def tags_bitmap(self, tags):
+        """Get the bitmap of the notes that have at least one of the tags.
+
+        Arguments:
+            tags -- list of tag strings
+
+        """
+        bitmap = 0L
+        for tag in tags:
+            bitmap |= self.bitmaps.get(tag, 0L)
+
+        return bitmap
+
+    def select(self, uris, tags=None, excluded_tags=()):
+        """Select cached notes by their tags.
+
+        Returns the set of URIs of notes that have at least one of `tags` and
+        none of `excluded_tags`. Notes that are not in memory are never
+        selected.
+
+        Arguments:
+            uris -- list of note URIs to select from
+            tags -- list of tag strings. None or empty selects all notes.
+            excluded_tags -- list of tag strings (default: ())
+
+        """
+        positions = dict(
+            (uri, self.positions[uri]) for uri in uris if uri in self.entries
+        )
+
+        included = None
+        if tags:
+            included = self.tags_bitmap(tags)
+
+        return select_positions(
+            positions, included, self.tags_bitmap(excluded_tags)
+        )
@@ -41,18 +41,26 @@ Options depend on what action you are taking. To obtain details on options for
 a particular action, combine one of "-h" or "--help" with the action name or
 use "help" before the action name.
 
+Use "%(tomtom)s shell" to run actions one after the other in a single process,
+with completion of note titles, or "%(tomtom)s batch" to run the actions read
+from the standard input, one per line.
+
 Here is a list of all the available actions:
 
 """
 import sys
 import os
-import pkg_resources
+import errno
+import time
 import optparse
 
-from tomtom import core
-from tomtom.core import TOMTOM_VERSION, NoteNotFound, ConnectionError
+from tomtom import registry, TOMTOM_VERSION
 from tomtom.plugins import ActionPlugin
 
+# Modules that talk to Tomboy or Gnote (and import dbus), and caches, are only
+# imported once an action is about to run, so that printing help, the version
+# or errors about arguments stays quick.
+
 # Return codes sent on errors.
 # Codes between 100 and 199 are fatal errors
 # Codes between 200 and 254 are minor errors
@@ -60,11 +68,17 @@ ACTION_NOT_FOUND_RETURN_CODE = 100
 MALFORMED_ACTION_RETURN_CODE = 101
 DBUS_CONNECTION_ERROR_RETURN_CODE = 102
 ACTION_OPTION_TYPE_ERROR_RETURN_CODE = 103
+DAEMON_CONNECTION_LOST_RETURN_CODE = 104
 TOO_FEW_ARGUMENTS_ERROR_RETURN_CODE = 200
 NOTE_NOT_FOUND_RETURN_CODE   = 201
 
 class CommandLine(object):
     """Main entry point for Tomtom."""
+    def __init__(self):
+        """Initialize the list of open connections."""
+        super(CommandLine, self).__init__()
+
+        self.connections = {}
 
     def load_action(self, action_name):
         """Load the action named <action_name>.
@@ -76,12 +90,9 @@ class CommandLine(object):
             action_name -- String representing the name of the action.
 
         """
-        action_class = [
-            ac for ac in self.list_of_actions()
-            if ac.name == action_name
-        ]
+        action_class = self.find_action(action_name)
 
-        if not action_class:
+        if action_class is None:
             app_name = os.path.basename( sys.argv[0] )
 
             print >> sys.stderr, \
@@ -90,7 +101,7 @@ class CommandLine(object):
 
             sys.exit(ACTION_NOT_FOUND_RETURN_CODE)
 
-        return action_class[0]()
+        return action_class()
 
     def retrieve_options(self, parser, action):
         """Get a list of options from an action and prepend default options.
@@ -134,7 +145,49 @@ class CommandLine(object):
             optparse.Option(
                 "--gnote", dest="gnote", action="store_true",
                 help="Make tomtom connect to Gnote via DBus instead of Tomboy."
-            )
+            ),
+            optparse.Option(
+                "--backend", dest="backend", default="dbus",
+                type="choice", choices=["dbus", "files", "auto"],
+                help="""How to read notes: "dbus" talks to the running """
+                """application, "files" reads note files directly, which """
+                """doesn't need the application to be running, and "auto" """
+                """reads note files only when the application is not """
+                """running, instead of starting it. Default: %default."""
+            ),
+            optparse.Option(
+                "--pipelined", dest="pipelined", action="store_true",
+                default=False,
+                help="""Fetch information about notes with asynchronous """
+                """DBus calls. This is much faster with a large number of """
+                """notes."""
+            ),
+            optparse.Option(
+                "--no-cache", dest="no_cache", action="store_true",
+                default=False,
+                help="""Don't use the caches of note information and """
+                """contents or the search index. All information is fetched """
+                """from the application."""
+            ),
+            optparse.Option(
+                "--stats", dest="stats", action="store_true",
+                default=False,
+                help="""Print on standard error how many calls were made to """
+                """the application, how much data they returned, how long """
+                """they took, and where time was spent."""
+            ),
+            optparse.Option(
+                "--profile", dest="profile", metavar="FILE",
+                help="""Profile the action with cProfile and write the """
+                """statistics to FILE. They can be read with the pstats """
+                """module."""
+            ),
+            optparse.Option(
+                "--trace-file", dest="trace_file", metavar="FILE",
+                help="""Write a trace of the calls made to the application """
+                """and of the phases of the action to FILE, in the Chrome """
+                """trace event format."""
+            ),
         ]
 
     def parse_options(self, action, arguments):
@@ -169,12 +222,23 @@ class CommandLine(object):
         "perform_action" is not present in the imported module, it prints an
         error message on the standard error stream and exits.
 
+        With the "--stats" option, a report of the calls made to the
+        application and of the time spent in each phase is printed on the
+        standard error stream once the action is done. The "--trace-file"
+        option writes the same calls and phases as a trace, and "--profile"
+        writes statistics from cProfile. Nothing is measured without those
+        options.
+
         Arguments:
             action_name -- A string representing the requested action
             arguments   -- A list of all the other arguments from the cli
 
         """
+        # Phases are timed in any case since "--stats" and "--trace-file" are
+        # only known once options are parsed.
+        start = time.time()
         action = self.load_action(action_name)
+        loaded = time.time()
 
         try:
             options, positional_arguments = self.parse_options(
@@ -185,20 +249,49 @@ class CommandLine(object):
             print >> sys.stderr, exc
             exit(ACTION_OPTION_TYPE_ERROR_RETURN_CODE)
 
+        parsed = time.time()
+
+        profiler = None
+        if options.profile:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        from tomtom.core import NoteNotFound, ConnectionError
+
         # By default, connect to Tomboy, if --gnote is used, connect to Gnote.
         application = "Tomboy"
         if options.gnote:
             application = "Gnote"
 
+        if options.backend == "auto":
+            options.backend = self.choose_backend(application, action)
+
         try:
-            action.tomboy_interface = core.Tomtom(application)
+            action.tomboy_interface = self.connect(application, options)
         except ConnectionError, exc:
+            # The profiler is only stopped once the action is done, otherwise.
+            if profiler is not None:
+                profiler.disable()
+
             print >> sys.stderr, "%s: Error: %s" % (
                 os.path.basename(sys.argv[0]),
                 exc
             )
             sys.exit(DBUS_CONNECTION_ERROR_RETURN_CODE)
 
+        action_stats = None
+        if options.stats or options.trace_file:
+            from tomtom import stats
+
+            action_stats = stats.Stats(trace=bool(options.trace_file))
+            action_stats.add_phase("plugin loading", start, loaded)
+            action_stats.add_phase("option parsing", loaded, parsed)
+            action_stats.add_phase("connection", parsed, time.time())
+            action_stats.instrument(action)
+            action_stats.enter("format")
+
         try:
             action.perform_action(options, positional_arguments)
         except (SystemExit, KeyboardInterrupt):
@@ -208,68 +301,340 @@ class CommandLine(object):
             raise
         except NoteNotFound, exc:
             msg = """%s: Error: Note named "%s" was not found."""
-            error_map = ( os.path.basename( sys.argv[0] ), exc )
-            print >> sys.stderr, msg % error_map
+            for name in exc.names:
+                error_map = ( os.path.basename( sys.argv[0] ), name )
+                print >> sys.stderr, msg % error_map
             sys.exit(NOTE_NOT_FOUND_RETURN_CODE)
+        except IOError, exc:
+            if exc.errno != errno.EPIPE:
+                self.report_malformed_action(action_name)
+
+            # Whatever reads the output went away (e.g. "tomtom list | head").
+            # This is not an error, there is simply nobody left to write to.
+            self.silence_stdout()
+            sys.exit(0)
         except:
-            import traceback
+            self.report_malformed_action(action_name)
+        finally:
+            outputs = []
+
+            if profiler is not None:
+                profiler.disable()
+                outputs.append( (profiler.dump_stats, options.profile) )
+
+            if action_stats is not None:
+                action_stats.leave()
+                action_stats.restore()
+
+                if options.stats:
+                    action_stats.report(sys.stderr)
+                if options.trace_file:
+                    outputs.append(
+                        (action_stats.write_trace, options.trace_file)
+                    )
+
+            for (write, path) in outputs:
+                try:
+                    write(path)
+                except IOError, exc:
+                    print >> sys.stderr, "%s: Error: %s" % (
+                        os.path.basename(sys.argv[0]),
+                        exc
+                    )
+
+    def report_malformed_action(self, action_name):
+        """Report an uncaught exception from an action and exit.
+
+        This must be called while handling the exception.
 
-            app_name = os.path.basename( sys.argv[0] )
+        Arguments:
+            action_name -- A string representing the requested action
 
-            print >> sys.stderr, \
-                """%s: the "%s" action is """ % (app_name, action_name) + \
-                """malformed: An uncaught exception was raised while """ \
-                """executing its "perform_action" function:""" + os.linesep
-            traceback.print_exc()
+        """
+        import traceback
+
+        app_name = os.path.basename( sys.argv[0] )
 
-            # This is pretty annoying when running acceptance tests. Comment it
-            # out if you have a failing test that shows this as being the
-            # error.
-            sys.exit(MALFORMED_ACTION_RETURN_CODE)
+        print >> sys.stderr, \
+            """%s: the "%s" action is """ % (app_name, action_name) + \
+            """malformed: An uncaught exception was raised while """ \
+            """executing its "perform_action" function:""" + os.linesep
+        traceback.print_exc()
 
-    def list_of_actions(self):
-        """Retrieve a list of all registered actions.
+        # This is pretty annoying when running acceptance tests. Comment it
+        # out if you have a failing test that shows this as being the
+        # error.
+        sys.exit(MALFORMED_ACTION_RETURN_CODE)
 
-        Return a list of classes corresponding to all the plugins.
+    def silence_stdout(self):
+        """Send what is left to write on stdout to /dev/null.
+
+        Without this, flushing stdout when the interpreter exits would fail
+        again on a closed pipe and print an error.
 
         """
-        group = "tomtom.actions"
-        action_list = []
+        try:
+            descriptor = sys.stdout.fileno()
+        except (AttributeError, ValueError):
+            return
+
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, descriptor)
+        os.close(devnull)
+
+    def choose_backend(self, application, action):
+        """Choose how to read notes for the "auto" backend.
+
+        Notes are read from the application if it is running. If it isn't,
+        they are read from its note files instead of starting it, and a notice
+        tells that they are as they were last saved. The application is only
+        started for actions that need it, or if there are no note files.
+
+        Arguments:
+            application -- string name of either Tomboy or Gnote.
+            action -- The tomtom.plugins.ActionPlugin about to be performed
+
+        """
+        from tomtom import core, notefiles
+
+        if action.needs_application:
+            return "dbus"
+
+        if core.application_is_running(application):
+            return "dbus"
+
+        directory = notefiles.note_directory(application)
+        if directory is None:
+            return "dbus"
+
+        notice_map = (os.path.basename(sys.argv[0]), application, directory)
+        print >> sys.stderr, \
+            """%s: Note: %s is not running. Notes are read from %s """ \
+            """as they were last saved.""" % notice_map
+
+        return "files"
+
+    def connect(self, application, options):
+        """Get a Tomtom object connected to the application.
+
+        Connections are kept and reused by later calls with the same
+        application and connection options. This matters only when more than
+        one action is dispatched in the same process.
+
+        Arguments:
+            application -- string name of either Tomboy or Gnote.
+            options -- optparse.Values object containing the parsed options
+
+        """
+        from tomtom import core
+
+        key = (
+            application,
+            options.backend,
+            options.pipelined,
+            options.no_cache
+        )
+
+        if key not in self.connections:
+            note_cache = None
+            word_index = None
+            note_contents = None
+            if not options.no_cache:
+                note_cache = self.open_cache(application)
+                word_index = self.open_index(application)
+
+                # Note files are read directly. Caching their contents would
+                # only take space.
+                if options.backend == "dbus":
+                    note_contents = self.open_contents(application)
+
+            self.connections[key] = core.Tomtom(
+                application,
+                pipelined=options.pipelined,
+                cache=note_cache,
+                backend=options.backend,
+                index=word_index,
+                contents=note_contents
+            )
+
+        return self.connections[key]
+
+    def open_cache(self, application):
+        """Open the cache of note information for an application.
+
+        If the cache can't be opened, a warning is printed and None is
+        returned so that tomtom can continue without a cache.
+
+        Arguments:
+            application -- string name of either Tomboy or Gnote.
+
+        """
+        from tomtom import cache
+
+        path = cache.cache_path(application)
+
+        return open_store(cache.MetadataCache, path, "cache")
 
-        for entrypoint in pkg_resources.iter_entry_points(group=group):
-            plugin_class = entrypoint.load()
-            plugin_class.name = entrypoint.name
-            if issubclass(plugin_class, ActionPlugin):
-                action_list.append(plugin_class)
+    def open_index(self, application):
+        """Open the word index of note contents for an application.
 
-        return action_list
+        If the index can't be opened, a warning is printed and None is
+        returned so that searches go through all notes instead.
+
+        Arguments:
+            application -- string name of either Tomboy or Gnote.
+
+        """
+        from tomtom import index
+
+        path = index.index_path(application)
+
+        return open_store(index.WordIndex, path, "index")
+
+    def open_contents(self, application):
+        """Open the cache of note contents for an application.
+
+        If the cache can't be opened, a warning is printed and None is
+        returned so that contents are always fetched instead.
+
+        Arguments:
+            application -- string name of either Tomboy or Gnote.
+
+        """
+        from tomtom import contents
+
+        path = contents.contents_path(application)
+
+        return open_store(contents.ContentCache, path, "cache")
+
+    def find_action(self, action_name):
+        """Get the plugin class of the action named <action_name>.
+
+        The action is looked up in the table of actions, and only its module
+        is imported. The table is built again if it is out of date, if the
+        action is not in it or if its module can't be imported anymore.
+        Returns None if there is no action plugin with this name.
+
+        Arguments:
+            action_name -- String representing the name of the action.
+
+        """
+        table = registry.load_table()
+        fresh = False
+
+        if table is None or action_name not in table["actions"]:
+            table = registry.build_table()
+            registry.save_table(table)
+            fresh = True
+
+        while True:
+            entry = table["actions"].get(action_name)
+            if entry is None:
+                return None
+
+            try:
+                plugin_class = registry.load_plugin(entry)
+                break
+            except (ImportError, AttributeError):
+                # The plugin moved or was removed since the table was built.
+                if fresh:
+                    return None
+
+                table = registry.build_table()
+                registry.save_table(table)
+                fresh = True
+
+        if not issubclass(plugin_class, ActionPlugin):
+            return None
+
+        plugin_class.name = action_name
+
+        return plugin_class
+
+    def action_descriptions(self):
+        """Get the names and short descriptions of all registered actions.
+
+        Returns a list of (name, description) pairs, sorted by name. The
+        description is None for actions that have none.
+
+        Descriptions are kept in the table of actions so that plugins don't
+        need to be imported every time actions are listed. Only the plugins
+        of actions that have no description in the table yet are imported, and
+        the table is then saved. If a plugin can't be imported, the table is
+        built again once, and plugins that still can't be are left out.
+
+        """
+        table = registry.load_table()
+        fresh = changed = table is None
+
+        if fresh:
+            table = registry.build_table()
+
+        descriptions = []
+        entries = sorted( table["actions"].items() )
+
+        while entries:
+            name, entry = entries.pop(0)
+
+            if "plugin" not in entry:
+                try:
+                    plugin_class = registry.load_plugin(entry)
+                except (ImportError, AttributeError):
+                    if not fresh:
+                        # The plugin moved or was removed since the table was
+                        # built. Start over with a new table.
+                        table = registry.build_table()
+                        fresh = changed = True
+                        descriptions = []
+                        entries = sorted( table["actions"].items() )
+                        continue
+
+                    plugin_class = None
+
+                # Entries that are not action plugins are remembered too, so
+                # they are not imported again.
+                entry["plugin"] = plugin_class is not None and \
+                    issubclass(plugin_class, ActionPlugin)
+                entry["description"] = None
+                if entry["plugin"]:
+                    entry["description"] = plugin_class.short_description
+
+                changed = True
+
+            if entry["plugin"]:
+                descriptions.append( (name, entry["description"]) )
+
+        if changed:
+            registry.save_table(table)
+
+        return descriptions
 
     def action_short_summaries(self):
         """Retrieve a list of available actions.
 
-        Get descriptions from the first line of the actions' docstring and
+        Get descriptions from the actions' short_description attribute and
         format them as a list of output lines for the help message. The names
-        of the modules will be listed as the action names.
+        of the entry points will be listed as the action names.
 
         """
-        actions = self.list_of_actions()
+        actions = self.action_descriptions()
 
         # Get longest name's length. We'll use this value to align descriptions.
         pad_up_to = reduce(
             max,
-            [len(a.name) for a in actions]
+            [len(name) for (name, description) in actions]
         )
 
         descriptions = []
-        for action in actions:
-            if action.short_description:
-                description_text = action.short_description
+        for name, description in actions:
+            if description:
+                description_text = description
             else:
                 description_text = "No description available."
 
             descriptions.append(
-                """  %s""" % action.name +
-                """%s """ % ( " " * (pad_up_to - len(action.name) ) ) +
+                """  %s""" % name +
+                """%s """ % ( " " * (pad_up_to - len(name) ) ) +
                 """: %s""" % description_text
             )
 
@@ -333,8 +698,66 @@ class CommandLine(object):
             print version_info
             sys.exit(0)
 
+        elif action == "shell":
+            # Imported here since the shell module needs this one.
+            from tomtom import shell
+
+            sys.exit( shell.main(arguments) )
+
+        elif action == "batch":
+            # Imported here since the batch module needs this one.
+            from tomtom import batch
+
+            sys.exit( batch.main(arguments) )
+
+        status = self.forward_to_daemon(action, arguments)
+        if status is not None:
+            sys.exit(status)
+
         self.dispatch(action, arguments)
 
+    def forward_to_daemon(self, action_name, arguments):
+        """Have the tomtomd daemon dispatch the action if it is running.
+
+        Output from the daemon is written to the standard streams. Returns the
+        exit status of the action, or None if the daemon is not running.
+
+        Arguments:
+            action_name -- A string representing the requested action
+            arguments   -- A list of all the other arguments from the cli
+
+        """
+        # Imported here since the daemon module needs this one.
+        from tomtom import daemon
+
+        return daemon.forward(action_name, arguments)
+
+def open_store(store_class, path, description):
+    """Open an sqlite cache or index, or get None if it can't be opened.
+
+    A warning is printed when the database can't be opened. Caches and indexes
+    only make things faster, so tomtom goes on without them.
+
+    Arguments:
+        store_class -- class of the cache or index, taking the path to open
+        path -- path to the sqlite database file
+        description -- what is opened, for the warning
+
+    """
+    import sqlite3
+
+    try:
+        return store_class(path)
+    except (sqlite3.Error, OSError), exc:
+        print >> sys.stderr, "%s: Warning: Could not open %s %s: %s" % (
+            os.path.basename(sys.argv[0]),
+            description,
+            path,
+            exc
+        )
+
+    return None
+
 def exception_wrapped_main():
     """Wrap around main function to handle general exceptions."""
     tomtom_cli = CommandLine()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Persistent cache of the contents of notes.
+
+Contents of notes can be large, and "display" and "search" would otherwise
+transfer the same contents from Tomboy or Gnote every time they run. Contents
+are kept compressed with zlib, keyed by the URI and the change date of their
+note: a note that was saved since is simply not found, and its new content is
+stored over the old one.
+
+The cache holds a limited amount of compressed data. Once it is full, the
+notes that were used least recently are evicted. Each content is stored with
+a CRC-32 checksum; contents that can't be decompressed or don't match their
+checksum are dropped and fetched again.
+
+Functions:
+    contents_path -- Path to the content cache file of an application.
+    compress      -- Compress a content for the cache.
+    decompress    -- Get a content back from the cache, checking it.
+
+Classes:
+    ContentCache -- sqlite cache of compressed note contents.
+
+"""
+import os
+import zlib
+import sqlite3
+
+from tomtom.cache import SqliteStore, cache_directory, chunks, text
+from tomtom.cache import SQL_VARIABLES_MAX
+
+# Version of the structure of the cache (see SqliteStore).
+CONTENTS_VERSION = 1
+
+# Amount of compressed data, in bytes, that the cache holds at most.
+CONTENTS_SIZE_MAX = 64 * 1024 * 1024
+
+def contents_path(application):
+    """Get the path to the content cache file for notes of an application.
+
+    Arguments:
+        application -- string name of either Tomboy or Gnote.
+
+    """
+    return os.path.join(
+        cache_directory(),
+        "%s-contents.sqlite" % application.lower()
+    )
+
+def compress(content):
+    """Compress a content for the cache.
+
+    Returns a (data, checksum) pair. The checksum is the CRC-32 of the content
+    encoded in UTF-8.
+
+    Arguments:
+        content -- Unicode or UTF-8 string, the content of a note
+
+    """
+    encoded = text(content).encode("utf-8")
+
+    return ( zlib.compress(encoded), zlib.crc32(encoded) & 0xffffffff )
+
+def decompress(data, checksum):
+    """Get a content back from the cache.
+
+    Returns the content as a unicode string, or None if the data is corrupted.
+
+    Arguments:
+        data -- String, the compressed content
+        checksum -- Integer, CRC-32 of the content encoded in UTF-8
+
+    """
+    try:
+        encoded = zlib.decompress( str(data) )
+    except zlib.error:
+        return None
+
+    if zlib.crc32(encoded) & 0xffffffff != checksum:
+        return None
+
+    try:
+        return encoded.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+class ContentCache(SqliteStore):
+    """Cache of compressed note contents, keyed by URI and change date.
+
+    The cache is an sqlite database. Each note has a single row, holding the
+    content of the note at its cached change date, its checksum and its
+    compressed size. A counter is bumped each time contents are looked up or
+    stored, and each row keeps the value of the counter when it was last used,
+    which gives the order of eviction.
+
+    """
+    version = CONTENTS_VERSION
+    schema = """
+        DROP TABLE IF EXISTS contents;
+        CREATE TABLE contents (
+            uri TEXT PRIMARY KEY,
+            date INTEGER NOT NULL,
+            checksum INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            used INTEGER NOT NULL,
+            data BLOB NOT NULL
+        );
+        CREATE INDEX contents_by_use ON contents (used);
+    """
+
+    def __init__(self, path, size_max=CONTENTS_SIZE_MAX):
+        """Open the cache, creating it if it doesn't exist.
+
+        Arguments:
+            path -- Path to the sqlite database file
+            size_max -- Amount of compressed data, in bytes, kept at most
+                (default: CONTENTS_SIZE_MAX)
+
+        """
+        super(ContentCache, self).__init__(path)
+
+        self.size_max = size_max
+
+    def next_use(self):
+        """Bump the counter of uses and get its new value."""
+        last = self.connection.execute(
+            "SELECT MAX(used) FROM contents"
+        ).fetchone()[0]
+
+        return (last or 0) + 1
+
+    def lookup(self, notes):
+        """Get the cached contents of notes that didn't change.
+
+        Returns a dictionary that maps URIs to contents, as unicode strings.
+        Notes that are not in the cache, that changed since they were cached
+        or whose content is corrupted are absent from the dictionary.
+        Corrupted contents are removed from the cache.
+
+        Arguments:
+            notes -- list of (uri, date) pairs
+
+        """
+        dates = dict( (unicode(uri), int(date)) for (uri, date) in notes )
+        found = {}
+        corrupted = []
+
+        for chunk in chunks(dates.keys(), SQL_VARIABLES_MAX):
+            for uri, date, checksum, data in self.connection.execute(
+                    "SELECT uri, date, checksum, data FROM contents "
+                    "WHERE uri IN (%s)" % ", ".join("?" * len(chunk)),
+                    chunk):
+                if date != dates[uri]:
+                    continue
+
+                content = decompress(data, checksum)
+                if content is None:
+                    corrupted.append(uri)
+                else:
+                    found[uri] = content
+
+        with self.connection:
+            if corrupted:
+                self.connection.executemany(
+                    "DELETE FROM contents WHERE uri = ?",
+                    [(uri, ) for uri in corrupted]
+                )
+
+            if found:
+                used = self.next_use()
+                self.connection.executemany(
+                    "UPDATE contents SET used = ? WHERE uri = ?",
+                    [(used, uri) for uri in found]
+                )
+
+        return found
+
+    def store(self, contents):
+        """Save the contents of notes in one transaction.
+
+        Contents that are larger than the whole cache once compressed are not
+        kept. Notes that were used least recently are then evicted until the
+        cache holds no more than its maximum size.
+
+        Arguments:
+            contents -- list of (uri, date, content) tuples
+
+        """
+        with self.connection:
+            used = self.next_use()
+
+            for uri, date, content in contents:
+                data, checksum = compress(content)
+                if len(data) > self.size_max:
+                    continue
+
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO contents "
+                    "(uri, date, checksum, size, used, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (unicode(uri), int(date), checksum, len(data), used,
+                        sqlite3.Binary(data))
+                )
+
+            self.evict()
+
+    def evict(self):
+        """Remove the notes used least recently until the cache is small enough.
+
+        This must be called inside a transaction.
+
+        """
+        total = self.connection.execute(
+            "SELECT SUM(size) FROM contents"
+        ).fetchone()[0] or 0
+
+        if total <= self.size_max:
+            return
+
+        evicted = []
+        for uri, size in self.connection.execute(
+                "SELECT uri, size FROM contents ORDER BY used"):
+            if total <= self.size_max:
+                break
+
+            evicted.append(uri)
+            total -= size
+
+        self.connection.executemany(
+            "DELETE FROM contents WHERE uri = ?",
+            [(uri, ) for uri in evicted]
+        )
+
+    def forget(self, uris):
+        """Remove the contents of notes from the cache.
+
+        Arguments:
+            uris -- list of note URIs
+
+        """
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM contents WHERE uri = ?",
+                [(unicode(uri), ) for uri in uris]
+            )
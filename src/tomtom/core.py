@@ -38,6 +38,7 @@ Exceptions:
 
 Classes:
     Tomtom             -- Communication object to Tomboy or Gnote
+    CallPipeline       -- Asynchronous dbus calls with bounded pending replies.
     TomboyNote         -- Object representation of a Tomboy or Gnote note.
 
 """
@@ -45,17 +46,68 @@ import dbus
 import datetime
 import time
 import os
+import heapq
+import itertools
 
-# This must be modified with all version bumps!
-TOMTOM_VERSION = "0.2"
+from tomtom import notefiles, index, TOMTOM_VERSION
+from tomtom.cache import chunks
+
+# Maximum number of asynchronous dbus calls that can be waiting for a reply at
+# the same time when Tomtom is in pipelined mode.
+MAX_PENDING_CALLS = 64
+
+# Number of notes whose information is fetched at once while building lists of
+# notes. Notes are given out batch by batch so that the first ones can be
+# printed before information about all the others is fetched.
+NOTE_BATCH_SIZE = 256
+
+# Fields of notes that are fetched while building lists of notes, unless
+# callers ask for less. Other fields are fetched when they are first used.
+NOTE_FIELDS = ("title", "date", "tags")
 
 class ConnectionError(Exception):
     """Simple exception raised dbus connection fails."""
     pass
 
 class NoteNotFound(Exception):
-    """Simple exception raised when a specific note does not exist."""
-    pass
+    """Exception raised when notes searched by name do not exist.
+
+    The names of all the notes that were not found are in the "names"
+    attribute.
+
+    """
+    def __init__(self, *names):
+        super(NoteNotFound, self).__init__(*names)
+        self.names = list(names)
+
+def application_is_running(application):
+    """Check if Tomboy or Gnote is running, without starting it.
+
+    Getting an object of an application from the session bus starts the
+    application if it isn't running (dbus activation). This only asks the bus
+    if the application's name has an owner. Without a session bus, the
+    application is not running.
+
+    A private connection is used and closed afterwards: the shared connection
+    would be set up before the main loop that the pipeline installs.
+
+    Arguments:
+        application -- string name of either Tomboy or Gnote.
+
+    """
+    try:
+        session_bus = dbus.SessionBus(private=True)
+    except dbus.DBusException:
+        return False
+
+    try:
+        return bool(
+            session_bus.name_has_owner("org.gnome.%s" % application)
+        )
+    except dbus.DBusException:
+        return False
+    finally:
+        session_bus.close()
 
 class Tomtom(object):
     """Application class for Tomtom.
@@ -65,16 +117,60 @@ class Tomtom(object):
     get_note_contents which get a list of notes according to a series of
     criteria, and get the contents of one note, respectively.
 
+    In pipelined mode, information about notes is fetched with asynchronous
+    dbus calls so that many requests can wait for a reply at the same time.
+
+    When a cache is given, titles and tags of notes that didn't change since
+    they were cached are taken from the cache instead of being fetched again.
+
+    When an index is given, searches use it to find which lines of which notes
+    can match, instead of searching through all notes.
+
+    When a content cache is given, contents of notes that didn't change since
+    they were cached are taken from it instead of being fetched again. It is
+    used by all the methods that get contents.
+
+    With the "files" backend, notes are read directly from the application's
+    note files instead of through dbus. The application doesn't need to be
+    running in that case.
+
+    Long-lived objects can follow changes to notes with the application's
+    signals (see listen). Listing notes then only asks for the change dates
+    of notes that changed.
+
     """
-    def __init__(self, application):
+    comm = None
+    pipelined = False
+    cache = None
+    index = None
+    contents = None
+    listener = None
+
+    def __init__(self, application, pipelined=False, cache=None,
+            backend="dbus", index=None, contents=None):
         """Create a link to Tomboy or Gnote upon instantiation.
 
         Arguments:
             application -- string name of either Tomboy or Gnote.
+            pipelined -- Boolean, fetch notes asynchronously (default: False)
+            cache -- A tomtom.cache.MetadataCache object (default: None)
+            backend -- "dbus" or "files" (default: "dbus")
+            index -- A tomtom.index.WordIndex object (default: None)
+            contents -- A tomtom.contents.ContentCache object (default: None)
 
         """
-        super(Tomtom, self).__init__(application)
+        super(Tomtom, self).__init__()
         self.application = application
+        self.cache = cache
+        self.index = index
+        self.contents = contents
+
+        if backend == "files":
+            self.comm = self.open_note_files(application)
+            return
+
+        if pipelined:
+            self.pipelined = self.use_main_loop()
 
         try:
             tb_bus = dbus.SessionBus()
@@ -96,21 +192,111 @@ class Tomtom(object):
             msg_map = (application, exc)
             raise ConnectionError(msg % msg_map)
 
+    def open_note_files(self, application):
+        """Get an object that reads notes from the application's files.
+
+        Arguments:
+            application -- string name of either Tomboy or Gnote.
+
+        """
+        directory = notefiles.note_directory(application)
+
+        if directory is None:
+            raise ConnectionError(
+                """Could not find the note files of %s.""" % application
+            )
+
+        return notefiles.NoteDirectory(application, directory)
+
+    def use_main_loop(self):
+        """Make dbus use the glib main loop for asynchronous calls.
+
+        This must be done before the connection to the session bus is
+        established. Returns False if the glib main loop or the gobject module
+        that runs it (see new_main_loop) is not available, in which case dbus
+        calls stay synchronous.
+
+        """
+        try:
+            from dbus.mainloop.glib import DBusGMainLoop
+            import gobject
+        except ImportError:
+            return False
+
+        DBusGMainLoop(set_as_default=True)
+        return True
+
+    def listen(self):
+        """Follow changes to notes with the application's signals.
+
+        Signals are only received while a main loop runs, so this is only
+        useful to objects that live in one, like those of the tomtomd daemon.
+        Returns False if the application can't send signals (with the "files"
+        backend).
+
+        """
+        if getattr(self.comm, "connect_to_signal", None) is None:
+            return False
+
+        # Imported here since only long-lived objects need it.
+        from tomtom.listener import NoteListener
+
+        if self.listener is None:
+            self.listener = NoteListener(
+                self.comm,
+                self.cache,
+                self.index,
+                self.contents
+            )
+
+        return True
+
+    def new_main_loop(self):
+        """Create a main loop that waits for replies to asynchronous calls."""
+        import gobject
+
+        return gobject.MainLoop()
+
+    def call_many(self, calls):
+        """Call a series of methods on the dbus interface.
+
+        Each call is a pair of a method name and a tuple of arguments. Replies
+        are returned in a list, in the same order as the calls. In pipelined
+        mode, the calls are issued asynchronously through a CallPipeline.
+
+        Arguments:
+            calls -- list of (method name, arguments) pairs
+
+        """
+        if not self.pipelined:
+            return [
+                getattr(self.comm, method)(*arguments)
+                for (method, arguments) in calls
+            ]
+
+        pipeline = CallPipeline(self.comm, self.new_main_loop())
+
+        return pipeline.run(calls)
+
     def get_notes(self, **kwargs):
-        """Get a list of notes from the application.
+        """Get an iterator over notes from the application.
 
-        This function gets a list of notes that match the given selection
-        options. Notes are automatically filtered. Keyword arguments used in
-        the note building part are "names" and  "count_limit". The rest of the
+        This function gets the notes that match the given selection options.
+        Notes are automatically filtered. Keyword arguments used in the note
+        building part are "names", "count_limit" and "fields". The rest of the
         arguments will be useful to the filtering method.
 
+        Notes are built and filtered lazily, a batch at a time, so callers can
+        start using the first notes before the last ones are fetched.
+
         Arguments:
             **kwargs -- Map of arguments used for getting and filtering notes.
 
         """
-        # Consumes "count_limit" and uses "names".
+        # Consumes "count_limit" and "fields", and uses "names".
         notes = self.build_note_list(**kwargs)
         kwargs.pop("count_limit", 0)
+        kwargs.pop("fields", None)
 
         # "names" is still needed for filter_notes
         return self.filter_notes(notes, **kwargs)
@@ -126,7 +312,36 @@ class Tomtom(object):
             note -- A TomboyNote object
 
         """
-        lines = self.comm.GetNoteContents(note.uri).splitlines()
+        if self.contents is not None:
+            return self.format_content( note, self.fetch_contents([note])[0] )
+
+        return self.format_content( note, self.comm.GetNoteContents(note.uri) )
+
+    def get_note_contents(self, notes):
+        """Get the contents of a list of notes, in the same order.
+
+        This is the same as calling get_note_content for each note, except that
+        in pipelined mode the requests for all notes are waiting for a reply
+        at the same time.
+
+        Arguments:
+            notes -- list of TomboyNote objects
+
+        """
+        return [
+            self.format_content(note, content)
+            for (note, content) in zip( notes, self.fetch_contents(notes) )
+        ]
+
+    def format_content(self, note, content):
+        """Add the tags of a note after its name in the note's content.
+
+        Arguments:
+            note -- A TomboyNote object
+            content -- String, the content as returned by the application
+
+        """
+        lines = content.splitlines()
         #TODO Oddly (but it is good), splitting the lines makes the indentation
         # bullets appear.. come up with a test for this to stay
         if note.tags:
@@ -134,22 +349,228 @@ class Tomtom(object):
 
         return os.linesep.join(lines)
 
-    def get_uris_for_n_notes(self, count_max):
+    def fetch_contents(self, notes):
+        """Get the raw contents of a list of notes, in the same order.
+
+        With a content cache, the change dates of notes are fetched, all at
+        once, for notes that don't have them yet. Only the contents that are
+        not in the cache at those dates are fetched, and they are then stored
+        in the cache.
+
+        Arguments:
+            notes -- list of TomboyNote objects
+
+        """
+        if self.contents is None:
+            return self.call_many(
+                [("GetNoteContents", (note.uri, )) for note in notes]
+            )
+
+        undated = [note for note in notes if note._date is None]
+        if undated:
+            dates = self.call_many(
+                [("GetNoteChangeDate", (note.uri, )) for note in undated]
+            )
+            for note, date in zip(undated, dates):
+                note.date = date
+
+        contents = self.contents.lookup(
+            [(note.uri, note.date) for note in notes]
+        )
+
+        missing = [note for note in notes if note.uri not in contents]
+        if missing:
+            fetched = self.call_many(
+                [("GetNoteContents", (note.uri, )) for note in missing]
+            )
+            self.contents.store([
+                (note.uri, note.date, content)
+                for (note, content) in zip(missing, fetched)
+            ])
+
+            contents.update(zip( [note.uri for note in missing], fetched ))
+
+        return [contents[note.uri] for note in notes]
+
+    def search_candidates(self, pattern, notes, application_search=False):
+        """Find which lines of which notes can match a search pattern.
+
+        The index is brought up to date with the notes that changed, then asked
+        which lines of which notes can match. Without an index, all notes are
+        searched, unless `application_search` is True: the application is then
+        asked which notes contain plain words. Its search misses words that are
+        split by formatting, so it is only used when asked for.
+
+        Returns a dictionary mapping URIs of notes to lists of line numbers, or
+        to None when all lines of the note must be searched. Notes absent from
+        the dictionary cannot match the pattern. None is returned if neither
+        the application nor the index can answer for this pattern.
+
+        Arguments:
+            pattern -- String, the search pattern
+            notes -- list of TomboyNote objects to search in
+            application_search -- Boolean, ask the application when there is
+                no index (default: False)
+
+        """
+        if self.index is None:
+            if not application_search or not index.is_plain(pattern):
+                return None
+
+            found = self.search_notes(pattern)
+            if found is None:
+                return None
+
+            return dict( [(n.uri, None) for n in notes if n.uri in found] )
+
+        if index.is_plain(pattern):
+            self.index.update(notes, self.fetch_contents)
+
+            return self.index.candidates(pattern, notes)
+
+        required = index.required_trigrams(pattern)
+        if not required:
+            return None
+
+        self.index.update(notes, self.fetch_contents)
+
+        return self.index.notes_with_trigrams(required, notes)
+
+    def search_notes(self, pattern):
+        """Ask the application for the notes that contain some words.
+
+        The application's own search looks for all the words of the pattern in
+        the notes it holds in memory. Notes that have the words on different
+        lines are found too, so the result only narrows down a search. Words
+        split by formatting (e.g. "<bold>foo</bold>bar") are not found.
+
+        Returns a set of URIs, or None if the application cannot search (the
+        "files" backend, or versions of the application that lack the
+        SearchNotes method).
+
+        Arguments:
+            pattern -- String, words to search for
+
+        """
+        search = getattr(self.comm, "SearchNotes", None)
+        if search is None:
+            return None
+
+        try:
+            return set( search(pattern, False) )
+        except dbus.DBusException:
+            return None
+
+    def get_uris_for_n_notes(self, count_max, selection=None):
         """Find the URIs for the `count_max` latest notes.
 
         This method retrieves URIs of notes. If count_max is None, it gets URIs
-        for all notes. Otherwise, it gets `count_max` number of URIs.
+        for all notes. Otherwise, it gets the URIs of the `count_max` most
+        recently changed notes, newest first. The change date of all notes is
+        fetched to find them, and the latest ones are selected with a heap of
+        `count_max` elements.
+
+        Notes left out by `selection` don't count: the application is asked
+        which notes are selected before the latest ones are taken. If it can't
+        tell, the latest selected notes are only known once the tags of notes
+        are, so all notes are given, newest first, and the selection is left
+        for the caller to apply.
+
+        Returns a list of (uri, None) pairs, a dictionary of the change dates
+        that were fetched, by URI, so they don't need to be fetched again, and
+        the selection that is left to apply (None if there is none).
+
+        With a listener, the list of notes and their dates come from it.
 
         Arguments:
             count_max -- Maximum number of notes to lookup
+            selection -- (tags, excluded_tags) pair from tag_selection, or None
 
         """
-        uris = self.comm.ListAllNotes()
+        if self.listener is not None:
+            uris, dates = self.get_dates_from_listener()
+        else:
+            uris = self.comm.ListAllNotes()
+
+            dates = None
+            if count_max is not None:
+                dates = self.call_many(
+                    [("GetNoteChangeDate", (uri, )) for uri in uris]
+                )
+
+        if selection is not None:
+            selected = self.select_uris_by_tags(uris, *selection)
+
+            if selected is not None:
+                if dates is not None:
+                    dates = [
+                        date for (date, uri) in zip(dates, uris)
+                        if uri in selected
+                    ]
+                uris = [uri for uri in uris if uri in selected]
+                selection = None
+
+        if count_max is None:
+            known_dates = {}
+            if dates is not None:
+                known_dates = dict( zip(uris, dates) )
+
+            return [(u, None) for u in uris], known_dates, selection
+
+        # Notes with the same date stay in the application's order.
+        if selection is None:
+            latest = heapq.nlargest(
+                count_max,
+                zip(dates, uris),
+                key=lambda date_and_uri: date_and_uri[0]
+            )
+        else:
+            latest = sorted(
+                zip(dates, uris),
+                key=lambda date_and_uri: date_and_uri[0],
+                reverse=True
+            )
+
+        return (
+            [(uri, None) for (date, uri) in latest],
+            dict( [(uri, date) for (date, uri) in latest] ),
+            selection
+        )
 
-        if count_max != None:
-            uris = uris[:count_max]
+    def get_dates_from_listener(self):
+        """Get the URIs and change dates of all notes, with the listener.
 
-        return [(u, None) for u in uris]
+        The first time, or after a note was added, all notes and their dates
+        are fetched. Otherwise, only the dates of notes that were saved since
+        are fetched. Returns a list of URIs and a list of dates in the same
+        order.
+
+        """
+        listener = self.listener
+
+        if listener.uris is None:
+            listener.start_listing()
+
+            uris = self.comm.ListAllNotes()
+            listener.remember(
+                uris,
+                self.call_many(
+                    [("GetNoteChangeDate", (uri, )) for uri in uris]
+                )
+            )
+        else:
+            changed = listener.take_changed()
+
+            listener.update_dates(
+                changed,
+                self.call_many(
+                    [("GetNoteChangeDate", (uri, )) for uri in changed]
+                )
+            )
+
+        uris = list(listener.uris)
+
+        return uris, [listener.dates[uri] for uri in uris]
 
     def get_uris_by_name(self, names):
         """Search for all the notes with the given names.
@@ -157,63 +578,343 @@ class Tomtom(object):
         This method retreives URIs of notes by searching for them by names. It
         searches for all names that are in the `names` list.
 
+        Names are first looked up in the cache. A cached note is used if its
+        change date did not change, and that date is kept. Dates known by the
+        listener are not fetched. The other names are searched with FindNote,
+        all at once. If some notes are not found, a NoteNotFound exception
+        naming all of them is raised.
+
+        Returns a list of (uri, name) pairs in the same order as the names, and
+        a dictionary of the change dates that were fetched, by URI.
+
         Arguments:
             names -- a list of note names
 
         """
-        uris = []
+        found = {}
+        dates = {}
+
+        if self.cache is not None:
+            cached = self.cache.find_titles(names)
+
+            known = {}
+            if self.listener is not None:
+                known = self.listener.known_dates(
+                    [uri for (uri, date) in cached.values()]
+                )
+
+            cached_names = [
+                name for name in names
+                if name in cached and cached[name][0] not in known
+            ]
+
+            current_dates = self.call_many([
+                ("GetNoteChangeDate", (cached[name][0], ))
+                for name in cached_names
+            ])
+
+            for name, date in zip(cached_names, current_dates):
+                known[ cached[name][0] ] = date
+
+            for name in names:
+                if name not in cached:
+                    continue
+
+                uri, cached_date = cached[name]
+                date = known[uri]
+                if date == cached_date:
+                    found[name] = uri
+                    dates[uri] = date
 
-        for name in names:
-            uri = self.comm.FindNote(name)
+        unresolved = [name for name in names if name not in found]
+
+        uris = self.call_many(
+            [("FindNote", (name, )) for name in unresolved]
+        )
+
+        missing = []
+        for name, uri in zip(unresolved, uris):
             if uri == dbus.String(""):
-                raise NoteNotFound(name)
+                missing.append(name)
+            else:
+                found[name] = uri
+
+        if missing:
+            raise NoteNotFound(*missing)
+
+        return [(found[name], name) for name in names], dates
+
+    def select_uris_by_tags(self, uris, tags, excluded_tags):
+        """Ask the application which notes have some tags.
+
+        Returns the set of URIs from `uris` of the notes that have at least one
+        of `tags` (or any note if `tags` is empty) and none of `excluded_tags`.
+        This is the same selection as filter_notes does, but without fetching
+        the tags of all notes.
+
+        None is returned if the application can't tell (the "files" backend,
+        or versions of the application that lack the GetAllNotesWithTag
+        method). Notes must then be filtered with their tags.
+
+        Arguments:
+            uris -- list of note URIs
+            tags -- list of tag strings to select notes by
+            excluded_tags -- list of tag strings to leave notes out by
 
-            uris.append( (uri, name) )
+        """
+        if getattr(self.comm, "GetAllNotesWithTag", None) is None:
+            return None
+
+        try:
+            replies = self.call_many([
+                ("GetAllNotesWithTag", (tag, ))
+                for tag in list(tags) + list(excluded_tags)
+            ])
+        except dbus.DBusException:
+            return None
+
+        included = set()
+        for tagged in replies[:len(tags)]:
+            included.update(tagged)
 
-        return uris
+        excluded = set()
+        for tagged in replies[len(tags):]:
+            excluded.update(tagged)
+
+        return set(
+            uri for uri in uris
+            if (not tags or uri in included) and uri not in excluded
+        )
 
     def filter_by_tags(self, notes, tag_list):
-        """Remove notes from the list if they have no tags from the list."""
-        tags = set(tag_list)
+        """Remove notes from the iterator if they have no tags from the list."""
+        tags = frozenset(tag_list)
 
-        return [
+        return (
             note for note in notes
-            if tags.intersection( set(note.tags) )
-        ]
+            if not tags.isdisjoint(note.tags)
+        )
 
     def filter_out_templates(self, notes):
         """Take out those annoying templates from display."""
-        return [n for n in notes if "system:template" not in n.tags]
+        return (n for n in notes if "system:template" not in n.tags)
 
     def build_note_list(self, **kwargs):
-        """Find notes and build a list of TomboyNote objects.
+        """Find notes and generate TomboyNote objects.
 
         This method gets a list of notes from the application and converts them
-        to TomboyNote objects. It then returns the notes in a list.
+        to TomboyNote objects. It is a generator: information about notes is
+        fetched NOTE_BATCH_SIZE notes at a time and the notes of a batch are
+        given out before the next batch is fetched.
+
+        Notes searched by name are all looked up before the first note is
+        given out so that a missing note is reported before any output.
+
+        The "fields" keyword argument lists the fields of notes that are
+        fetched in advance (default: NOTE_FIELDS). Other fields are fetched
+        when they are first used.
+
+        The filtering options "tags" and "exclude_templates" are looked at
+        (but not consumed) so that notes that would be filtered out are not
+        built at all and don't count towards "count_limit". The application is
+        asked for the notes with the tags. If it can't tell, the cache is used
+        for this when there is one.
 
         """
         names = kwargs.pop("names", [])
         count_limit = kwargs.pop("count_limit", None)
+        fields = kwargs.pop("fields", NOTE_FIELDS)
 
         if names:
-            pairs = self.get_uris_by_name(names)
+            pairs, dates = self.get_uris_by_name(names)
+            selection = None
         else:
-            pairs = self.get_uris_for_n_notes(count_limit)
+            pairs, dates, selection = self.get_uris_for_n_notes(
+                count_limit,
+                tag_selection(
+                    kwargs.get("tags", []),
+                    kwargs.get("exclude_templates", True)
+                )
+            )
+
+        notes = self.generate_notes(pairs, fields, dates, selection)
+
+        # All notes were listed, newest first: stop at the latest selected.
+        if selection is not None and count_limit is not None:
+            notes = itertools.islice(
+                self.filter_notes(
+                    notes,
+                    tags=kwargs.get("tags", []),
+                    exclude_templates=kwargs.get("exclude_templates", True)
+                ),
+                count_limit
+            )
+
+        return notes
+
+    def generate_notes(self, pairs, fields=NOTE_FIELDS, dates=None,
+            selection=None):
+        """Generate TomboyNote objects for (uri, title) pairs, in batches.
+
+        Arguments:
+            pairs -- list of (uri, title) pairs. title can be None.
+            fields -- fields of notes to fetch in advance (default: NOTE_FIELDS)
+            dates -- dictionary of change dates already known, by URI
+            selection -- (tags, excluded_tags) pair from tag_selection, used
+                with the cache to build only the selected notes.
+
+        """
+        for batch in chunks(pairs, NOTE_BATCH_SIZE):
+            if self.cache is not None:
+                notes = self.fetch_notes_with_cache(batch, dates, selection)
+            else:
+                notes = self.fetch_notes(batch, fields, dates)
+
+            for note in notes:
+                yield note
+
+    def fetch_notes(self, pairs, fields=NOTE_FIELDS, dates=None):
+        """Fetch information about notes and build TomboyNote objects.
+
+        Titles are fetched only for pairs that don't already have one, and
+        dates only for notes whose date is not known yet. Only the requested
+        fields are fetched here, the others are left for the notes to fetch if
+        they are used.
+
+        Arguments:
+            pairs -- list of (uri, title) pairs. title can be None.
+            fields -- fields of notes to fetch (default: NOTE_FIELDS)
+            dates -- dictionary of change dates already known, by URI
+
+        """
+        if dates is None:
+            dates = {}
+
+        # Gather all the calls first so that they can be pipelined.
+        calls = []
+        for uri, note_title in pairs:
+            if note_title is None and "title" in fields:
+                calls.append( ("GetNoteTitle", (uri, )) )
+
+            if "date" in fields and uri not in dates:
+                calls.append( ("GetNoteChangeDate", (uri, )) )
+
+            if "tags" in fields:
+                calls.append( ("GetTagsForNote", (uri, )) )
+
+        replies = iter( self.call_many(calls) )
 
         list_of_notes = []
-        for pair in pairs:
-            uri = pair[0]
-            note_title = pair[1]
+        for uri, note_title in pairs:
+            if note_title is None and "title" in fields:
+                note_title = replies.next()
 
-            if note_title is None:
-                note_title = self.comm.GetNoteTitle(uri)
+            date = dates.get(uri)
+            if "date" in fields and uri not in dates:
+                date = replies.next()
+
+            tags = None
+            if "tags" in fields:
+                tags = replies.next()
 
             list_of_notes.append(
                 TomboyNote(
                     uri=uri,
                     title=note_title,
-                    date=self.comm.GetNoteChangeDate(uri),
-                    tags=self.comm.GetTagsForNote(uri)
+                    date=date,
+                    tags=tags,
+                    source=self.comm
+                )
+            )
+
+        return list_of_notes
+
+    def fetch_notes_with_cache(self, pairs, known_dates=None,
+            selection=None):
+        """Build TomboyNote objects, using the cache for unchanged notes.
+
+        The change date of all notes is fetched first, unless it is already
+        known. The title and tags are then fetched only for notes that are not
+        in the cache or whose change date differs from the cached one. The
+        cache is updated with the information that was fetched.
+
+        Titles in `pairs` are not used: for notes searched by name, they are
+        the names that were asked for, which can differ from the titles in
+        case. Only titles that come from the application are kept.
+
+        Once the cache is up to date, its tag bitmaps tell which notes are
+        selected by `selection`. Only those notes are built.
+
+        Arguments:
+            pairs -- list of (uri, title) pairs. title can be None.
+            known_dates -- dictionary of change dates already known, by URI
+            selection -- (tags, excluded_tags) pair, or None to build all notes
+
+        """
+        if known_dates is None:
+            known_dates = {}
+
+        uris = [uri for (uri, note_title) in pairs]
+
+        missing = [uri for uri in uris if uri not in known_dates]
+        fetched_dates = dict( zip(
+            missing,
+            self.call_many(
+                [("GetNoteChangeDate", (uri, )) for uri in missing]
+            )
+        ) )
+        dates = [known_dates.get(uri, fetched_dates.get(uri)) for uri in uris]
+
+        cached = self.cache.lookup(uris)
+
+        stale = [
+            (uri, note_title, date)
+            for ((uri, note_title), date) in zip(pairs, dates)
+            if uri not in cached or cached[uri][1] != date
+        ]
+
+        calls = []
+        for uri, note_title, date in stale:
+            calls.append( ("GetNoteTitle", (uri, )) )
+            calls.append( ("GetTagsForNote", (uri, )) )
+
+        replies = iter( self.call_many(calls) )
+
+        fetched = {}
+        for uri, note_title, date in stale:
+            fetched[uri] = TomboyNote(
+                uri=uri,
+                title=replies.next(),
+                date=date,
+                tags=replies.next(),
+                source=self.comm
+            )
+
+        if fetched:
+            self.cache.store( fetched.values() )
+
+        selected = None
+        if selection is not None:
+            selected = self.cache.select(uris, *selection)
+
+        list_of_notes = []
+        for (uri, note_title), date in zip(pairs, dates):
+            if selected is not None and uri not in selected:
+                continue
+
+            if uri in fetched:
+                list_of_notes.append( fetched[uri] )
+                continue
+
+            cached_title, cached_date, cached_tags = cached[uri]
+
+            list_of_notes.append(
+                TomboyNote(
+                    uri=uri,
+                    title=cached_title,
+                    date=date,
+                    tags=cached_tags,
+                    source=self.comm
                 )
             )
 
@@ -221,14 +922,15 @@ class Tomtom(object):
 
     def filter_notes(self, notes, tags=[], names=[],
             exclude_templates=True):
-        """Filter a list of notes according to some criteria.
+        """Filter notes according to some criteria.
 
-        Filter a list of TomboyNote objects according to a list of filtering
-        options. "names" will filter out any notes but those whose names are in
-        the list.
+        Filter an iterable of TomboyNote objects according to a list of
+        filtering options. "names" will filter out any notes but those whose
+        names are in the list. Notes are filtered lazily, as they are
+        consumed.
 
         Arguments:
-            notes -- list of note objects
+            notes -- iterable of note objects
             tags -- list of tag strings to filter by
             names -- list of the only names to include
             exclude_templates -- Boolean, exclude templates (default: True)
@@ -248,32 +950,242 @@ class Tomtom(object):
 
         return notes
 
+class CallPipeline(object):
+    """Asynchronous dbus calls with a bounded number of pending replies.
+
+    Calls are issued in order, but no more than `max_pending` calls wait for a
+    reply at any given time. A new call is issued each time a reply arrives.
+    Replies are collected in the same order as the calls, whatever the order
+    in which they arrive. The first error that comes back stops the pipeline
+    and is raised by the run method.
+
+    """
+    def __init__(self, comm, main_loop, max_pending=MAX_PENDING_CALLS):
+        """Constructor.
+
+        Arguments:
+            comm -- The dbus interface to call methods on
+            main_loop -- Main loop that dispatches replies (gobject.MainLoop)
+            max_pending -- Maximum number of calls waiting for a reply
+
+        """
+        super(CallPipeline, self).__init__()
+        self.comm = comm
+        self.main_loop = main_loop
+        self.max_pending = max_pending
+
+        self.calls = []
+        self.replies = []
+        self.next_call = 0
+        self.pending = 0
+        self.received = 0
+        self.error = None
+        self.issuing = False
+
+    def run(self, calls):
+        """Issue all calls and wait for their replies.
+
+        Arguments:
+            calls -- list of (method name, arguments) pairs
+
+        """
+        self.calls = calls
+        self.replies = [None] * len(calls)
+        self.next_call = 0
+        self.pending = 0
+        self.received = 0
+        self.error = None
+
+        self.issue_calls()
+
+        # Replies can come back before the loop is started. Running the loop
+        # when everything is already received would block forever.
+        if self.error is None and self.received < len(calls):
+            self.main_loop.run()
+
+        if self.error is not None:
+            raise self.error
+
+        return self.replies
+
+    def issue_calls(self):
+        """Issue calls until the maximum number of pending calls is reached."""
+        self.issuing = True
+
+        while self.error is None and self.next_call < len(self.calls) \
+                and self.pending < self.max_pending:
+            index = self.next_call
+            method, arguments = self.calls[index]
+
+            self.next_call += 1
+            self.pending += 1
+
+            getattr(self.comm, method)(
+                *arguments,
+                reply_handler=self.reply_handler(index),
+                error_handler=self.handle_error
+            )
+
+        self.issuing = False
+
+    def reply_handler(self, index):
+        """Create a handler that stores the reply to call number `index`."""
+        def handle_reply(reply):
+            """Store the reply and keep the pipeline full."""
+            self.replies[index] = reply
+            self.received += 1
+            self.call_returned()
+
+        return handle_reply
+
+    def handle_error(self, exc):
+        """Remember the first error. It will be raised by run."""
+        if self.error is None:
+            self.error = exc
+
+        self.call_returned()
+
+    def call_returned(self):
+        """Issue more calls or stop the main loop when everything is done."""
+        self.pending -= 1
+
+        # Calls that reply right away are handled by the issuing loop.
+        if self.issuing:
+            return
+
+        if self.error is not None or self.received == len(self.calls):
+            self.main_loop.quit()
+            return
+
+        self.issue_calls()
+
+def tag_selection(tags, exclude_templates=True):
+    """Get the tags that select notes and the tags that leave them out.
+
+    Returns a (tags, excluded_tags) pair with the same meaning as the filtering
+    done by Tomtom.filter_notes, or None if notes are not filtered by tags.
+
+    Arguments:
+        tags -- list of tag strings to select notes by
+        exclude_templates -- Boolean, exclude templates (default: True)
+
+    """
+    excluded_tags = []
+    if exclude_templates and "system:template" not in tags:
+        excluded_tags.append("system:template")
+
+    if not tags and not excluded_tags:
+        return None
+
+    return (list(tags), excluded_tags)
+
+# Tags and sets of tags are shared by many notes. Notes keep references to the
+# same objects instead of each holding its own copies.
+_interned_text = {}
+_interned_tags = {}
+
+def native_text(value):
+    """Convert a dbus string to a plain unicode string.
+
+    Byte strings are left as is.
+
+    """
+    if isinstance(value, unicode):
+        return unicode(value)
+
+    return value
+
+def native_date(value):
+    """Convert a dbus.Int64 or a datetime object to a plain integer."""
+    if isinstance(value, datetime.datetime):
+        return int( time.mktime( value.timetuple() ) )
+
+    return int(value)
+
+def native_tags(tags):
+    """Convert a list of tags to a shared tuple of shared strings."""
+    tags = tuple([
+        _interned_text.setdefault( native_text(tag), native_text(tag) )
+        for tag in tags
+    ])
+
+    return _interned_tags.setdefault(tags, tags)
+
+def lazy_field(slot, method, convert, default):
+    """Build a property for a note field that is loaded on first access.
+
+    When the field was not given to the note, its value is fetched with the
+    `method` of the note's source and converted with `convert`. Without a
+    source, `default` is used.
+
+    Arguments:
+        slot -- Name of the slot holding the value
+        method -- Name of the RemoteControl method that gets the value
+        convert -- Function converting values to native types
+        default -- Value of the field when it can't be loaded
+
+    """
+    def get_field(note):
+        value = getattr(note, slot)
+
+        if value is None:
+            if note.source is None:
+                return default
+
+            value = convert( getattr(note.source, method)(note.uri) )
+            setattr(note, slot, value)
+
+        return value
+
+    def set_field(note, value):
+        if value is not None:
+            value = convert(value)
+
+        setattr(note, slot, value)
+
+    return property(get_field, set_field)
+
 class TomboyNote(object):
-    """Object corresponding to a Tomboy or Gnote note coming from dbus."""
-    def __init__(self, uri, title="", date=dbus.Int64(), tags=[]):
+    """Object corresponding to a Tomboy or Gnote note coming from dbus.
+
+    Notes are kept small since there can be many of them: they have no
+    instance dictionary and hold native values instead of dbus wrappers. Tags
+    are tuples shared between notes that have the same tags.
+
+    Fields that are not given to the constructor are fetched from the note's
+    source (the application's RemoteControl interface) the first time they are
+    used. This way, information that an action doesn't use is never fetched.
+
+    """
+    __slots__ = ("uri", "source", "_title", "_date", "_tags")
+
+    title = lazy_field("_title", "GetNoteTitle", native_text, "")
+    date = lazy_field("_date", "GetNoteChangeDate", native_date, 0)
+    tags = lazy_field("_tags", "GetTagsForNote", native_tags, ())
+
+    def __init__(self, uri, title=None, date=None, tags=None, source=None):
         """Constructor.
 
         This makes sure that instance attributes are set upon the note's
         instantiation. The date can either be a dbus.Int64 object or a datetime
-        object.
+        object. Fields that are None are loaded from the source when they are
+        first used.
 
         Arguments:
             uri -- A string representing the note's URI
             title -- A string representing the note's title
             date -- Can either be a dbus.Int64 or datetime object
             tags -- A list of strings that represent tags
+            source -- Object with the RemoteControl methods (default: None)
 
         """
         super(TomboyNote, self).__init__()
-        self.uri = uri
+        self.uri = native_text(uri)
+        self.source = source
         self.title = title
+        self.date = date
         self.tags = tags
 
-        if isinstance(date, datetime.datetime):
-            self.date = dbus.Int64( time.mktime(date.timetuple()) )
-        else:
-            self.date = date
-
     def listing(self):
         """Get a listing for this note.
 
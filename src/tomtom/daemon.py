@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Usage: %(tomtomd)s [-h|--help]
+
+The tomtom daemon keeps a connection to Tomboy or Gnote and information about
+notes in memory between commands. While it runs, the tomtom command forwards
+actions to it over a unix socket instead of doing all the work itself. If the
+daemon is not running, tomtom works as usual.
+
+When the glib main loop is available, the daemon serves requests from it and
+listens to the signals sent by Tomboy or Gnote when notes are added, saved or
+deleted. Listing notes then only asks for the dates of notes that changed.
+
+Functions:
+    socket_path -- Path to the daemon's unix socket.
+    is_private_directory -- Verify that only the user can use a directory.
+    forward     -- Have the daemon dispatch an action (client side).
+    glib_main_loop -- Get a glib main loop that dispatches dbus signals.
+    main        -- Entry point of the tomtomd script.
+
+Classes:
+    DaemonCommandLine -- CommandLine that keeps its state between actions.
+    OutputStream      -- File-like object that sends output to a client.
+    RequestHandler    -- Handles one action request from a client.
+    TomtomDaemon      -- Unix socket server that dispatches actions.
+
+Messages are JSON objects, one per line. The client sends a single request:
+{"action": ..., "arguments": [...], "program": ..., "cwd": ...}. The daemon
+answers with any number of {"stream": "stdout"|"stderr", "data": ...} messages
+followed by {"exit": <status>}.
+
+"""
+import sys
+import os
+import stat
+import errno
+import json
+import signal
+import socket
+import tempfile
+import optparse
+import SocketServer
+import traceback
+
+from tomtom import cli, cache
+
+def socket_path():
+    """Get the path to the daemon's unix socket.
+
+    The socket is kept in $XDG_RUNTIME_DIR if it is defined, or else in a
+    directory private to the user under the temporary directory.
+
+    """
+    runtime_directory = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_directory:
+        directory = os.path.join(runtime_directory, "tomtom")
+    else:
+        directory = os.path.join(
+            tempfile.gettempdir(),
+            "tomtom-%d" % os.getuid()
+        )
+
+    return os.path.join(directory, "daemon.socket")
+
+def is_private_directory(directory):
+    """Verify that a directory belongs to the user and only they can use it.
+
+    The socket's directory may be under the shared temporary directory, where
+    another user could create it first to receive forwarded actions, or to
+    answer them. Symbolic links are refused.
+
+    Arguments:
+        directory -- Path to the directory
+
+    """
+    try:
+        status = os.lstat(directory)
+    except OSError:
+        return False
+
+    return stat.S_ISDIR(status.st_mode) \
+        and status.st_uid == os.getuid() \
+        and status.st_mode & 077 == 0
+
+def send_message(stream, message):
+    """Write one message on a stream and flush it right away."""
+    stream.write(json.dumps(message) + "\n")
+    stream.flush()
+
+def connect_to_daemon(path):
+    """Get a socket connected to the daemon, or None if it's not running.
+
+    None is also returned, with a warning, when the socket's directory can be
+    used by other users.
+
+    """
+    if not os.path.exists(path):
+        return None
+
+    directory = os.path.dirname(path)
+    if not is_private_directory(directory):
+        print >> sys.stderr, \
+            "%s: Warning: Not using the daemon: %s is not private." % (
+                os.path.basename(sys.argv[0]),
+                directory
+            )
+        return None
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except socket.error:
+        client.close()
+        return None
+
+    return client
+
+def forward(action_name, arguments, path=None):
+    """Have the daemon dispatch an action and relay its output.
+
+    Returns the exit status of the action, or None if the daemon is not
+    running. Output sent by the daemon is written to sys.stdout and sys.stderr
+    as it arrives.
+
+    Arguments:
+        action_name -- A string representing the requested action
+        arguments -- A list of all the other arguments from the cli
+        path -- Path to the daemon's socket (default: socket_path())
+
+    """
+    if path is None:
+        path = socket_path()
+
+    client = connect_to_daemon(path)
+    if client is None:
+        return None
+
+    streams = {"stdout": sys.stdout, "stderr": sys.stderr}
+
+    try:
+        connection = client.makefile("rwb")
+        send_message(connection, {
+            "action": action_name,
+            "arguments": arguments,
+            "program": sys.argv[0],
+            "cwd": os.getcwd(),
+        })
+
+        for line in connection:
+            message = json.loads(line)
+
+            if "exit" in message:
+                return message["exit"]
+
+            stream = streams[ message["stream"] ]
+            stream.write( message["data"].encode("utf-8") )
+            stream.flush()
+    finally:
+        client.close()
+
+    # The daemon went away before the action was finished.
+    print >> sys.stderr, "%s: Error: Lost connection to the daemon." % (
+        os.path.basename(sys.argv[0]),
+    )
+    return cli.DAEMON_CONNECTION_LOST_RETURN_CODE
+
+class OutputStream(object):
+    """File-like object that sends what is written to it to a client."""
+    def __init__(self, connection, name):
+        """Constructor.
+
+        Arguments:
+            connection -- file object of the client's socket
+            name -- Name of the stream, "stdout" or "stderr"
+
+        """
+        super(OutputStream, self).__init__()
+        self.connection = connection
+        self.name = name
+        self.softspace = 0
+
+    def write(self, data):
+        """Send data to the client."""
+        if not isinstance(data, unicode):
+            data = data.decode("utf-8", "replace")
+
+        send_message(self.connection, {"stream": self.name, "data": data})
+
+    def flush(self):
+        """Nothing to do, data is sent as soon as it is written."""
+        pass
+
+class DaemonCommandLine(cli.CommandLine):
+    """CommandLine that keeps plugins and notes in memory between actions."""
+    def __init__(self, listen=False):
+        """Initialize the memory of actions and caches.
+
+        Arguments:
+            listen -- Boolean, follow changes to notes with the application's
+                signals. A main loop must be running. (default: False)
+
+        """
+        super(DaemonCommandLine, self).__init__()
+
+        self.listen = listen
+        self.actions = {}
+        self.caches = {}
+
+    def find_action(self, action_name):
+        """Look for each action plugin only once."""
+        if action_name not in self.actions:
+            self.actions[action_name] = \
+                super(DaemonCommandLine, self).find_action(action_name)
+
+        return self.actions[action_name]
+
+    def connect(self, application, options):
+        """Get a connection that follows changes to notes, if listening."""
+        tomtom = super(DaemonCommandLine, self).connect(application, options)
+
+        if self.listen:
+            tomtom.listen()
+
+        return tomtom
+
+    def close_connections(self):
+        """Forget all connections and stop listening to their signals."""
+        for tomtom in self.connections.values():
+            if tomtom.listener is not None:
+                tomtom.listener.stop()
+
+        self.connections.clear()
+
+    def open_cache(self, application):
+        """Keep notes in memory, in front of the persistent cache."""
+        if application not in self.caches:
+            self.caches[application] = cache.MemoryCache(
+                super(DaemonCommandLine, self).open_cache(application)
+            )
+
+        return self.caches[application]
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+    """Handle one action request from a client."""
+    def handle(self):
+        """Read the request, dispatch it and send the exit status."""
+        try:
+            request = json.loads( self.rfile.readline() )
+        except ValueError:
+            return
+
+        try:
+            status = self.server.run_request(request, self.wfile)
+            send_message(self.wfile, {"exit": status})
+        except socket.error, exc:
+            # The client went away. There is no one left to report to.
+            if exc.errno != errno.EPIPE:
+                raise
+
+class TomtomDaemon(SocketServer.UnixStreamServer):
+    """Unix socket server that dispatches actions for tomtom clients.
+
+    Requests are handled one at a time since actions write to the standard
+    streams, which are redirected to the client during the action.
+
+    """
+    def __init__(self, path, command_line=None):
+        """Start listening on the socket.
+
+        Arguments:
+            path -- Path to the unix socket
+            command_line -- CommandLine used to dispatch actions
+
+        """
+        SocketServer.UnixStreamServer.__init__(self, path, RequestHandler)
+
+        if command_line is None:
+            command_line = DaemonCommandLine()
+
+        self.command_line = command_line
+
+    def run_request(self, request, connection):
+        """Dispatch an action with output sent to the client.
+
+        Returns the exit status of the action.
+
+        Arguments:
+            request -- dictionary decoded from the client's request
+            connection -- file object of the client's socket
+
+        """
+        old_streams = (sys.stdout, sys.stderr)
+        old_argv = sys.argv
+        old_directory = os.getcwd()
+
+        sys.stdout = OutputStream(connection, "stdout")
+        sys.stderr = OutputStream(connection, "stderr")
+        sys.argv = [request["program"]] + request["arguments"]
+
+        try:
+            os.chdir(request["cwd"])
+            self.command_line.dispatch(
+                request["action"],
+                request["arguments"]
+            )
+            status = 0
+        except SystemExit, exc:
+            status = exit_status(exc.code)
+        except socket.error:
+            raise
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout, sys.stderr = old_streams
+            sys.argv = old_argv
+            os.chdir(old_directory)
+
+        # The application may have gone away. Reconnect on the next request.
+        if status in [cli.DBUS_CONNECTION_ERROR_RETURN_CODE,
+                cli.MALFORMED_ACTION_RETURN_CODE]:
+            self.command_line.close_connections()
+
+        return status
+
+def exit_status(code):
+    """Convert the argument of a SystemExit to an exit status."""
+    if code is None:
+        return 0
+
+    if isinstance(code, int):
+        return code
+
+    print >> sys.stderr, code
+    return 1
+
+def glib_main_loop():
+    """Get a glib main loop that dispatches dbus signals.
+
+    This makes the glib main loop the default one of dbus, which must be done
+    before connecting to the session bus. Returns None if the glib main loop
+    is not available.
+
+    """
+    try:
+        import gobject
+        from dbus.mainloop.glib import DBusGMainLoop
+    except ImportError:
+        return None
+
+    DBusGMainLoop(set_as_default=True)
+
+    return gobject.MainLoop()
+
+def serve_from_main_loop(server, main_loop):
+    """Serve requests from the glib main loop until it is quit.
+
+    Pipelined calls run a nested main loop while an action waits for replies.
+    The socket is not watched while a request is handled, so that the nested
+    loop doesn't start the request of another client in the middle of the
+    action: both would share the Tomtom objects and the standard streams.
+
+    Arguments:
+        server -- The TomtomDaemon
+        main_loop -- A gobject.MainLoop
+
+    """
+    import gobject
+
+    # Identifier of the current watch on the socket.
+    watch = []
+
+    def watch_socket():
+        """Handle the next client that connects."""
+        watch[:] = [gobject.io_add_watch(
+            server.fileno(),
+            gobject.IO_IN,
+            handle_request
+        )]
+
+    def handle_request(source, condition):
+        """Handle the request of a client that connected."""
+        gobject.source_remove(watch[0])
+
+        try:
+            server.handle_request()
+        finally:
+            watch_socket()
+
+        # This watch was removed, a new one took its place.
+        return False
+
+    def wake_up():
+        """Give Python a chance to run its signal handlers."""
+        return True
+
+    watch_socket()
+    # Python signal handlers only run when glib returns control to Python.
+    gobject.timeout_add(500, wake_up)
+
+    main_loop.run()
+
+def main():
+    """Entry point of the tomtomd script.
+
+    Serves requests until it is interrupted or receives SIGTERM.
+
+    """
+    app_name = os.path.basename(sys.argv[0])
+    usage = __doc__.splitlines()[0] % {"tomtomd": app_name}
+
+    parser = optparse.OptionParser(usage=usage)
+    parser.parse_args()
+
+    path = socket_path()
+
+    directory = os.path.dirname(path)
+    if not os.path.lexists(directory):
+        os.makedirs(directory, 0700)
+
+    if not is_private_directory(directory):
+        print >> sys.stderr, \
+            "%s: Error: %s must be a directory that only you can use." % (
+                app_name,
+                directory
+            )
+        sys.exit(1)
+
+    client = connect_to_daemon(path)
+    if client is not None:
+        client.close()
+        print >> sys.stderr, "%s: Error: A daemon is already running." % (
+            app_name,
+        )
+        sys.exit(1)
+
+    # Nothing answered on the socket: it was left by a daemon that died.
+    if os.path.exists(path):
+        os.unlink(path)
+
+    main_loop = glib_main_loop()
+    server = TomtomDaemon(
+        path,
+        DaemonCommandLine(listen=main_loop is not None)
+    )
+
+    def terminate(signal_number, frame):
+        """Stop serving on SIGTERM like on Ctrl-C."""
+        raise KeyboardInterrupt()
+
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        if main_loop is None:
+            server.serve_forever()
+        else:
+            serve_from_main_loop(server, main_loop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
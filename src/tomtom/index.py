@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Full-text indexes of note contents.
+
+Indexes make it possible to find which notes, and which lines of those notes,
+can contain a search pattern without fetching the content of every note. They
+only narrow down candidates: lines still need to be matched against the
+pattern to get exact results.
+
+Plain words are looked up in an inverted index of words, which gives
+candidate lines. Other regular expressions are looked up in an index of
+trigrams (sequences of three characters), which gives candidate notes: the
+literal parts that any match must contain are extracted from the expression,
+and only notes containing all the trigrams of those literals can match.
+
+Functions:
+    index_path        -- Path to the index file of an application.
+    tokenize          -- Split a line of text into lower-case words.
+    is_plain          -- Verify if a search pattern is made of plain words.
+    trigrams          -- Get the set of lower-case trigrams of a text.
+    required_literals -- Get the literal strings that a regex's matches contain.
+    required_trigrams -- Get the trigrams that a regex's matches contain.
+
+Classes:
+    WordIndex -- Inverted index of the words and trigrams of note contents.
+
+"""
+import os
+import re
+import sre_parse
+import sre_constants
+
+from tomtom.cache import SqliteStore, cache_directory, chunks
+from tomtom.cache import SQL_VARIABLES_MAX
+
+# Version of the structure of the index (see SqliteStore).
+INDEX_VERSION = 2
+
+# Number of notes whose content is fetched at once while updating the index.
+UPDATE_BATCH_SIZE = 200
+
+WORD_REGEX = re.compile(r"\w+", re.UNICODE)
+PLAIN_PATTERN_REGEX = re.compile(r"^[\w ]*\w[\w ]*$", re.UNICODE)
+
+def index_path(application):
+    """Get the path to the index file for notes of an application.
+
+    Arguments:
+        application -- string name of either Tomboy or Gnote.
+
+    """
+    return os.path.join(
+        cache_directory(),
+        "%s-index.sqlite" % application.lower()
+    )
+
+def tokenize(line):
+    """Split a line of text into a list of lower-case words."""
+    if isinstance(line, str):
+        line = line.decode("utf-8", "replace")
+
+    return WORD_REGEX.findall( line.lower() )
+
+def is_plain(pattern):
+    """Verify if a search pattern is made only of words and spaces.
+
+    Such patterns have no special meaning as regular expressions, so the
+    word index can find all the lines that they match.
+
+    """
+    return PLAIN_PATTERN_REGEX.match(pattern) is not None
+
+def trigrams(text):
+    """Get the set of trigrams found in the lower-cased text."""
+    if isinstance(text, str):
+        text = text.decode("utf-8", "replace")
+
+    text = text.lower()
+
+    return set( [text[i:i + 3] for i in xrange( len(text) - 2 )] )
+
+def literal_runs(parsed):
+    """Get runs of literal characters that a parsed expression must contain.
+
+    Only the parts of the expression that every match goes through are
+    considered: alternatives and optional parts are skipped, and they end the
+    current run of literals. Only ASCII characters are kept since case
+    insensitive matching only folds the case of ASCII characters.
+
+    Arguments:
+        parsed -- sre_parse.SubPattern object, or list of (op, argument)
+
+    """
+    runs = []
+    current = []
+
+    for op, argument in parsed:
+        if op == sre_constants.LITERAL and argument < 128:
+            current.append( unichr(argument) )
+            continue
+
+        if op == sre_constants.AT:
+            # Anchors don't consume characters, so they don't end the run.
+            continue
+
+        runs.append( u"".join(current) )
+        current = []
+
+        if op == sre_constants.SUBPATTERN:
+            runs.extend( literal_runs(argument[-1]) )
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            minimum, maximum, item = argument
+            if minimum >= 1:
+                runs.extend( literal_runs(item) )
+
+    runs.append( u"".join(current) )
+
+    return runs
+
+def required_literals(pattern):
+    """Get the literal strings that all matches of a search pattern contain.
+
+    The pattern is parsed the same way searches compile it, case
+    insensitively. Returns None if the pattern is not a valid regular
+    expression.
+
+    Arguments:
+        pattern -- String, the search pattern
+
+    """
+    if isinstance(pattern, str):
+        pattern = pattern.decode("utf-8", "replace")
+
+    try:
+        parsed = sre_parse.parse(u"(?i)%s" % pattern)
+    except (sre_constants.error, OverflowError):
+        return None
+
+    return [run.lower() for run in literal_runs(parsed) if run]
+
+def required_trigrams(pattern):
+    """Get the set of trigrams that all matches of a search pattern contain.
+
+    Returns an empty set when nothing can be required, in which case all notes
+    need to be searched.
+
+    Arguments:
+        pattern -- String, the search pattern
+
+    """
+    required = set()
+
+    for literal in required_literals(pattern) or []:
+        required.update( trigrams(literal) )
+
+    return required
+
+def note_lines(content):
+    """Get the lines of a note's content that are searched.
+
+    The first line is the note's title, which searches skip.
+
+    """
+    return content.splitlines()[1:]
+
+class WordIndex(SqliteStore):
+    """Inverted index of the words and trigrams of note contents.
+
+    Words point to the lines of notes they appear on, and trigrams point to
+    the notes they appear in. The index is an sqlite database. For each note,
+    it remembers the change date of the note when it was indexed so that only
+    notes that changed are indexed again. Line numbers start at 0 with the
+    line that follows the note's title, like in search results.
+
+    """
+    version = INDEX_VERSION
+    schema = """
+        DROP TABLE IF EXISTS indexed_notes;
+        DROP TABLE IF EXISTS terms;
+        DROP TABLE IF EXISTS postings;
+        DROP TABLE IF EXISTS trigrams;
+        CREATE TABLE indexed_notes (
+            id INTEGER PRIMARY KEY,
+            uri TEXT UNIQUE NOT NULL,
+            date INTEGER NOT NULL
+        );
+        CREATE TABLE terms (
+            id INTEGER PRIMARY KEY,
+            term TEXT UNIQUE NOT NULL
+        );
+        CREATE TABLE postings (
+            term_id INTEGER NOT NULL,
+            uri TEXT NOT NULL,
+            lines TEXT NOT NULL
+        );
+        CREATE INDEX postings_by_term ON postings (term_id);
+        CREATE INDEX postings_by_uri ON postings (uri);
+        CREATE TABLE trigrams (
+            trigram TEXT NOT NULL,
+            note_id INTEGER NOT NULL
+        );
+        CREATE INDEX trigrams_by_trigram ON trigrams (trigram);
+        CREATE INDEX trigrams_by_note ON trigrams (note_id);
+    """
+
+    def stale_notes(self, notes):
+        """Get the notes that are not indexed or changed since indexed.
+
+        Arguments:
+            notes -- list of TomboyNote objects
+
+        """
+        indexed = dict(
+            self.connection.execute("SELECT uri, date FROM indexed_notes")
+        )
+
+        return [n for n in notes if indexed.get(n.uri) != n.date]
+
+    def update(self, notes, fetch_contents):
+        """Index the notes that changed since they were last indexed.
+
+        Arguments:
+            notes -- list of TomboyNote objects
+            fetch_contents -- function that gets a list of contents for a list
+                              of notes
+
+        """
+        stale = self.stale_notes(notes)
+
+        for batch in chunks(stale, UPDATE_BATCH_SIZE):
+            contents = fetch_contents(batch)
+
+            with self.connection:
+                for note, content in zip(batch, contents):
+                    self.index_note(note, content)
+
+    def index_note(self, note, content):
+        """Replace the postings of a note. Must be called in a transaction.
+
+        Arguments:
+            note -- TomboyNote object
+            content -- String, the note's content
+
+        """
+        uri = unicode(note.uri)
+
+        self.delete_note(uri)
+
+        lines_by_term = {}
+        for line_number, line in enumerate( note_lines(content) ):
+            for term in tokenize(line):
+                lines = lines_by_term.setdefault(term, [])
+                if not lines or lines[-1] != line_number:
+                    lines.append(line_number)
+
+        for term, lines in lines_by_term.items():
+            self.connection.execute(
+                "INSERT OR IGNORE INTO terms (term) VALUES (?)",
+                (term, )
+            )
+            self.connection.execute(
+                "INSERT INTO postings (term_id, uri, lines) "
+                "SELECT id, ?, ? FROM terms WHERE term = ?",
+                (uri, ",".join([str(l) for l in lines]), term)
+            )
+
+        note_id = self.connection.execute(
+            "INSERT INTO indexed_notes (uri, date) VALUES (?, ?)",
+            (uri, int(note.date))
+        ).lastrowid
+
+        self.connection.executemany(
+            "INSERT INTO trigrams (trigram, note_id) VALUES (?, ?)",
+            [(trigram, note_id) for trigram in trigrams(content)]
+        )
+
+    def delete_note(self, uri):
+        """Remove all traces of a note. Must be called in a transaction."""
+        self.connection.execute("DELETE FROM postings WHERE uri = ?", (uri, ))
+        self.connection.execute(
+            "DELETE FROM trigrams WHERE note_id IN "
+            "(SELECT id FROM indexed_notes WHERE uri = ?)",
+            (uri, )
+        )
+        self.connection.execute(
+            "DELETE FROM indexed_notes WHERE uri = ?", (uri, )
+        )
+
+    def forget(self, uris):
+        """Remove notes from the index.
+
+        Arguments:
+            uris -- list of note URIs
+
+        """
+        with self.connection:
+            for uri in uris:
+                self.delete_note( unicode(uri) )
+
+    def lines_for_word(self, word, uris):
+        """Find lines with a word that contains `word`, in a set of notes.
+
+        Words are matched by substring since search patterns can match only
+        part of a word. Returns a dictionary mapping URIs to sets of line
+        numbers.
+
+        Arguments:
+            word -- lower-case word
+            uris -- set of note URIs to look into
+
+        """
+        found = {}
+
+        term_ids = [
+            row[0] for row in self.connection.execute(
+                "SELECT id FROM terms WHERE term LIKE ?",
+                (u"%" + word + u"%", )
+            )
+        ]
+
+        for chunk in chunks(term_ids, SQL_VARIABLES_MAX):
+            for uri, lines in self.connection.execute(
+                    "SELECT uri, lines FROM postings WHERE term_id IN (%s)" %
+                    ", ".join("?" * len(chunk)), chunk):
+                if uri in uris:
+                    found.setdefault(uri, set()).update(
+                        [int(l) for l in lines.split(",")]
+                    )
+
+        return found
+
+    def candidates(self, pattern, notes):
+        """Find the lines of notes that can match a plain pattern.
+
+        Only lines that contain all of the pattern's words are candidates.
+        Returns a dictionary mapping URIs of candidate notes to sorted lists
+        of line numbers. Notes must already be indexed.
+
+        Arguments:
+            pattern -- String, a plain search pattern (see is_plain)
+            notes -- list of TomboyNote objects to look into
+
+        """
+        uris = set( [unicode(n.uri) for n in notes] )
+        found = None
+
+        for word in set( tokenize(pattern) ):
+            lines_by_uri = self.lines_for_word(word, uris)
+
+            if found is None:
+                found = lines_by_uri
+            else:
+                found = dict(
+                    (uri, found[uri] & lines_by_uri[uri])
+                    for uri in found if uri in lines_by_uri
+                )
+
+            if not found:
+                return {}
+
+        return dict(
+            (uri, sorted(lines)) for (uri, lines) in found.items() if lines
+        )
+
+    def notes_with_trigrams(self, required, notes):
+        """Find the notes that contain all of a set of trigrams.
+
+        Returns a dictionary mapping URIs of candidate notes to None, meaning
+        that all of their lines need to be searched. Notes must already be
+        indexed.
+
+        Arguments:
+            required -- set of trigrams
+            notes -- list of TomboyNote objects to look into
+
+        """
+        uris = set( [unicode(n.uri) for n in notes] )
+        found = None
+
+        # Posting lists are intersected one trigram at a time, starting with
+        # the rarest so that the candidate set shrinks fast.
+        counted = []
+        for trigram in required:
+            count = self.connection.execute(
+                "SELECT COUNT(*) FROM trigrams WHERE trigram = ?",
+                (trigram, )
+            ).fetchone()[0]
+            counted.append( (count, trigram) )
+
+        for count, trigram in sorted(counted):
+            note_ids = set([
+                row[0] for row in self.connection.execute(
+                    "SELECT note_id FROM trigrams WHERE trigram = ?",
+                    (trigram, )
+                )
+            ])
+
+            if found is None:
+                found = note_ids
+            else:
+                found &= note_ids
+
+            if not found:
+                return {}
+
+        candidates = {}
+        for chunk in chunks(list(found), SQL_VARIABLES_MAX):
+            for (uri, ) in self.connection.execute(
+                    "SELECT uri FROM indexed_notes WHERE id IN (%s)" %
+                    ", ".join("?" * len(chunk)), chunk):
+                if uri in uris:
+                    candidates[uri] = None
+
+        return candidates
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Following changes to notes with the signals of Tomboy or Gnote.
+
+The RemoteControl interface emits a signal when a note is added, saved or
+deleted. A NoteListener subscribes to those signals so that a long-lived
+Tomtom object (in the tomtomd daemon, for example) knows which notes changed
+without asking for the change date of every note each time notes are listed.
+
+Once it has seen the list of all notes and their change dates, the listener
+keeps them up to date:
+
+    NoteSaved   -- The note's date is fetched again the next time it's needed.
+                   The cache and index see the new date and update the note.
+    NoteDeleted -- The note is taken out of the list, the cache, the index and
+                   the cache of contents.
+    NoteAdded   -- The list of all notes is fetched again the next time it's
+                   needed, since only the application knows where the new
+                   note goes in it.
+
+Signals are only received while a main loop is running, like the glib main
+loop that tomtomd runs.
+
+Classes:
+    NoteListener -- Keeps the list of notes and their dates up to date.
+
+"""
+
+class NoteListener(object):
+    """Keeps the list of notes and their change dates up to date.
+
+    The "uris" attribute is the list of all notes in the order given by the
+    application, or None when the list needs to be fetched. "dates" maps URIs
+    to change dates, and "changed" is the set of notes whose date needs to be
+    fetched again.
+
+    """
+    def __init__(self, comm, cache=None, index=None, contents=None):
+        """Subscribe to the signals of the application.
+
+        Arguments:
+            comm -- The dbus interface to the application
+            cache -- A tomtom.cache.MetadataCache object (default: None)
+            index -- A tomtom.index.WordIndex object (default: None)
+            contents -- A tomtom.contents.ContentCache object (default: None)
+
+        """
+        super(NoteListener, self).__init__()
+        self.cache = cache
+        self.index = index
+        self.contents = contents
+
+        self.uris = None
+        self.dates = {}
+        self.changed = set()
+
+        self.receivers = [
+            comm.connect_to_signal("NoteAdded", self.note_added),
+            comm.connect_to_signal("NoteSaved", self.note_saved),
+            comm.connect_to_signal("NoteDeleted", self.note_deleted),
+        ]
+
+    def stop(self):
+        """Unsubscribe from the signals."""
+        for receiver in self.receivers:
+            receiver.remove()
+
+        self.receivers = []
+        self.uris = None
+
+    def start_listing(self):
+        """Note that the list of all notes and their dates is being fetched.
+
+        Notes that are saved from now on are marked as changed, even if their
+        new date is the one that gets fetched.
+
+        """
+        self.changed.clear()
+
+    def remember(self, uris, dates):
+        """Keep the list of all notes and their change dates.
+
+        Arguments:
+            uris -- list of the URIs of all notes, in the application's order
+            dates -- list of the change dates of the notes, in the same order
+
+        """
+        self.uris = list(uris)
+        self.dates = dict( zip(uris, dates) )
+
+    def take_changed(self):
+        """Get the list of notes whose date needs to be fetched again.
+
+        The notes are not marked as changed anymore, unless they are saved
+        again before their date is fetched.
+
+        """
+        changed = [uri for uri in self.changed if uri in self.dates]
+        self.changed.clear()
+
+        return changed
+
+    def known_dates(self, uris):
+        """Get the dates of notes that didn't change since they were fetched.
+
+        Returns a dictionary of dates by URI. Notes whose date is not known
+        are left out.
+
+        Arguments:
+            uris -- list of note URIs
+
+        """
+        if self.uris is None:
+            return {}
+
+        return dict(
+            (uri, self.dates[uri]) for uri in uris
+            if uri in self.dates and uri not in self.changed
+        )
+
+    def update_dates(self, uris, dates):
+        """Keep the dates that were fetched again for changed notes.
+
+        Arguments:
+            uris -- list of note URIs
+            dates -- list of the change dates of the notes, in the same order
+
+        """
+        self.dates.update( zip(uris, dates) )
+
+    def note_added(self, uri):
+        """Fetch the list of notes again the next time it's needed."""
+        self.uris = None
+
+    def note_saved(self, uri):
+        """Fetch the note's date again the next time it's needed."""
+        self.changed.add(uri)
+
+    def note_deleted(self, uri, title):
+        """Forget about a note that was deleted."""
+        if self.uris is not None and uri in self.dates:
+            self.uris.remove(uri)
+
+        self.dates.pop(uri, None)
+        self.changed.discard(uri)
+
+        if self.cache is not None:
+            self.cache.forget([uri])
+
+        if self.index is not None:
+            self.index.forget([uri])
+
+        if self.contents is not None:
+            self.contents.forget([uri])
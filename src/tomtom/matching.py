@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Matching of search patterns against the contents of notes.
+
+Searches are case insensitive and report the lines of notes that match a
+pattern. A Matcher compiles the pattern once for all notes. Patterns without
+any special character are literals: they are looked for with str.find in the
+lower-cased content of a note, in a single pass over the content, and
+occurrences are mapped to lines with an array of the offsets where lines
+start. Other patterns are regular expressions, which are searched in each line.
+
+Results are the same as searching each line with re.search("(?i)" + pattern).
+Regular expressions only fold the case of ASCII characters while lower()
+folds all of them, so each occurrence of a literal is verified with the
+compiled pattern.
+
+Functions:
+    is_literal  -- Verify if a search pattern has no special meaning.
+    line_bounds -- Get the offsets where lines of a text start and end.
+
+Classes:
+    Matcher -- A search pattern compiled once for all notes.
+
+"""
+import re
+import bisect
+
+# Characters that split lines in unicode.splitlines.
+LINE_BREAKS = u"\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+
+# Literals can't span lines, so line breaks are not allowed in them.
+LITERAL_PATTERN_REGEX = re.compile(
+    u"[^%s]+\\Z" % re.escape(u".^$*+?{}[]\\|()" + LINE_BREAKS)
+)
+
+def is_literal(pattern):
+    """Verify if a search pattern has no special meaning as a regex.
+
+    Such a pattern only matches itself, regardless of case.
+
+    """
+    return LITERAL_PATTERN_REGEX.match(pattern) is not None
+
+def line_bounds(text):
+    """Get the offsets where lines of a text start and end.
+
+    Lines are the same as the ones given by text.splitlines(). Returns a
+    (starts, ends) pair of lists with one offset for each line. Ends are the
+    offsets of line breaks, which are not part of lines.
+
+    Only the lengths of lines are kept. Getting them from splitlines is
+    quicker than looking for line breaks with a regex, and lines are split
+    in exactly the same places.
+
+    Arguments:
+        text -- String, the text to split in lines
+
+    """
+    starts = []
+    ends = []
+    position = 0
+
+    for line, bare_line in zip( text.splitlines(True), text.splitlines() ):
+        starts.append(position)
+        ends.append( position + len(bare_line) )
+        position += len(line)
+
+    return starts, ends
+
+class Matcher(object):
+    """A search pattern compiled once for all notes.
+
+    Lines of a note's content are numbered from 0 starting with the line that
+    follows the note's title. The title is not searched.
+
+    """
+    def __init__(self, pattern):
+        """Compile the pattern.
+
+        Raises re.error if the pattern is not a valid regular expression.
+
+        Arguments:
+            pattern -- String, the search pattern
+
+        """
+        super(Matcher, self).__init__()
+        self.pattern = pattern
+        self.regex = re.compile("(?i)%s" % (pattern, ))
+
+        self.literal = None
+        if is_literal(pattern):
+            self.literal = pattern.lower()
+
+    def matching_lines(self, content, line_numbers=None):
+        """Get the lines of a note's content that match the pattern.
+
+        Returns a list of (line number, line) pairs, in the order of lines or
+        in the order of the given line numbers.
+
+        Arguments:
+            content -- String, the content of a note, starting with its title
+            line_numbers -- List of the numbers of the lines to search
+                (default: None, search all lines)
+
+        """
+        # str.find can't look for unicode in str or the other way around.
+        if self.literal is None or type(content) is not type(self.literal):
+            return self.search_lines(content, line_numbers)
+
+        folded = content.lower()
+
+        # Most notes don't contain the pattern. Lines are only needed when
+        # they do.
+        position = folded.find(self.literal)
+        if position == -1:
+            return []
+
+        starts, ends = line_bounds(content)
+
+        # Line numbers in starts and ends count the title.
+        if line_numbers is None:
+            lines = self.find_lines(content, folded, starts, position)
+        else:
+            lines = [
+                number + 1 for number in line_numbers
+                if number + 1 < len(starts) and self.line_matches(
+                    content, folded, starts[number + 1], ends[number + 1]
+                )
+            ]
+
+        return [
+            (line - 1, content[ starts[line]:ends[line] ])
+            for line in lines
+        ]
+
+    def find_lines(self, content, folded, starts, position=0):
+        """Find the lines, except the title, that contain the literal.
+
+        Arguments:
+            content -- String, the content of a note
+            folded -- String, the content of the note in lower case
+            starts -- List of the offsets where lines start
+            position -- Offset where the search starts (default: 0)
+
+        """
+        lines = []
+        if len(starts) < 2:
+            return lines
+
+        # The title is not searched.
+        position = folded.find( self.literal, max(position, starts[1]) )
+
+        while position != -1:
+            if not self.regex.match(content, position):
+                position = folded.find(self.literal, position + 1)
+                continue
+
+            line = bisect.bisect_right(starts, position) - 1
+            lines.append(line)
+
+            # One match is enough, go on with the next line.
+            if line + 1 >= len(starts):
+                break
+
+            position = folded.find(self.literal, starts[line + 1])
+
+        return lines
+
+    def line_matches(self, content, folded, start, end):
+        """Verify if the literal appears between two offsets of the content.
+
+        Arguments:
+            content -- String, the content of a note
+            folded -- String, the content of the note in lower case
+            start -- Offset where the line starts
+            end -- Offset where the line ends
+
+        """
+        position = folded.find(self.literal, start, end)
+
+        while position != -1:
+            if self.regex.match(content, position):
+                return True
+
+            position = folded.find(self.literal, position + 1, end)
+
+        return False
+
+    def search_lines(self, content, line_numbers=None):
+        """Search each line of a note's content with the regular expression.
+
+        Arguments:
+            content -- String, the content of a note, starting with its title
+            line_numbers -- List of the numbers of the lines to search
+                (default: None, search all lines)
+
+        """
+        lines = content.splitlines()[1:]
+
+        if line_numbers is None:
+            numbered_lines = enumerate(lines)
+        else:
+            numbered_lines = [
+                (number, lines[number]) for number in line_numbers
+                if number < len(lines)
+            ]
+
+        search = self.regex.search
+
+        return [
+            (number, line) for (number, line) in numbered_lines
+            if search(line)
+        ]
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Read notes directly from the .note files of Tomboy or Gnote.
+
+Tomboy and Gnote save each note as an XML file in their data directory. This
+module reads those files without going through dbus, so that notes can be
+read without starting the application.
+
+Functions:
+    note_directory -- Find the directory where an application keeps notes.
+    parse_date     -- Convert a date from a note file to a unix timestamp.
+
+Classes:
+    NoteFile      -- Information parsed out of one .note file.
+    NoteDirectory -- Read-only replacement for the RemoteControl interface.
+
+"""
+import os
+import sys
+import glob
+import time
+import calendar
+import xml.parsers.expat
+
+def note_directory(application):
+    """Find the directory where an application keeps its note files.
+
+    Both the XDG data directory and the older directory in the user's home
+    are looked for. Returns None if none of them exists.
+
+    Arguments:
+        application -- string name of either Tomboy or Gnote.
+
+    """
+    data_home = os.environ.get("XDG_DATA_HOME")
+    if not data_home:
+        data_home = os.path.join(os.path.expanduser("~"), ".local", "share")
+
+    candidates = [
+        os.path.join(data_home, application.lower()),
+        os.path.join(os.path.expanduser("~"), "." + application.lower()),
+    ]
+
+    for directory in candidates:
+        if os.path.isdir(directory):
+            return directory
+
+    return None
+
+def parse_date(text):
+    """Convert a date from a note file to a unix timestamp.
+
+    Dates look like "2009-11-02T10:15:03.1234560-05:00".
+
+    Arguments:
+        text -- date string from a note file
+
+    """
+    text = text.strip()
+
+    moment = time.strptime(text[:19], "%Y-%m-%dT%H:%M:%S")
+    timestamp = calendar.timegm(moment)
+
+    offset = text[-6:]
+    if offset[0] in "+-" and offset[3] == ":":
+        seconds = int(offset[1:3]) * 3600 + int(offset[4:6]) * 60
+        if offset[0] == "+":
+            seconds = -seconds
+        timestamp += seconds
+
+    return timestamp
+
+class NoteFile(object):
+    """Information parsed out of one .note file.
+
+    Files are parsed with expat, which streams through the file without
+    building a document tree. The note's content is kept only if it is asked
+    for since listing notes doesn't need it.
+
+    """
+    def __init__(self, path, with_content=False):
+        """Parse the file.
+
+        Arguments:
+            path -- Path to the .note file
+            with_content -- Boolean, keep the content of the note
+
+        """
+        super(NoteFile, self).__init__()
+
+        self.path = path
+        self.title = u""
+        self.date = 0
+        self.tags = []
+        self.content = None
+
+        self.with_content = with_content
+        self.elements = []
+        self.text = []
+        self.content_parts = []
+
+        parser = xml.parsers.expat.ParserCreate()
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+
+        note_file = open(path, "rb")
+        try:
+            parser.ParseFile(note_file)
+        finally:
+            note_file.close()
+
+        if with_content:
+            self.content = u"".join(self.content_parts)
+
+        del self.elements, self.text, self.content_parts
+
+    def start_element(self, name, attributes):
+        """Keep track of where we are in the document."""
+        self.elements.append(name)
+        self.text = []
+
+    def end_element(self, name):
+        """Save the text of the elements that we're interested in."""
+        self.elements.pop()
+        text = u"".join(self.text)
+
+        if name == "title":
+            self.title = text
+        elif name == "last-change-date":
+            self.date = parse_date(text)
+        elif name == "tag":
+            self.tags.append(text)
+
+        self.text = []
+
+    def character_data(self, data):
+        """Collect text for the current element."""
+        if "note-content" in self.elements:
+            if self.with_content:
+                self.content_parts.append(data)
+        else:
+            self.text.append(data)
+
+class NoteDirectory(object):
+    """Read-only replacement for the RemoteControl dbus interface.
+
+    This object answers the same method calls as the RemoteControl interface
+    for reading notes, but gets its information from the note files. It can
+    be used as the "comm" attribute of a tomtom.core.Tomtom object.
+
+    Parsed files are kept in memory and parsed again only if they changed on
+    disk.
+
+    """
+    def __init__(self, application, directory):
+        """Constructor.
+
+        Arguments:
+            application -- string name of either Tomboy or Gnote.
+            directory -- Path to the directory containing the note files
+
+        """
+        super(NoteDirectory, self).__init__()
+
+        self.application = application
+        self.directory = directory
+        self.parsed = {}
+
+    def uri_for_path(self, path):
+        """Build a note URI out of a file's name."""
+        guid = os.path.splitext( os.path.basename(path) )[0]
+
+        return u"note://%s/%s" % (self.application.lower(), guid)
+
+    def path_for_uri(self, uri):
+        """Find the file of a note from its URI."""
+        guid = uri.rsplit("/", 1)[-1]
+
+        return os.path.join(self.directory, guid + ".note")
+
+    def note_file(self, path, with_content=False):
+        """Get the parsed note file, parsing it only if needed.
+
+        Returns None if there is no such file, or if it can't be parsed. A
+        warning is printed for files that can't be parsed, once until they
+        change, and they are treated like missing notes.
+
+        """
+        try:
+            modification_time = os.stat(path).st_mtime
+        except OSError:
+            self.parsed.pop(path, None)
+            return None
+
+        known = self.parsed.get(path)
+        if known is not None and known[0] == modification_time:
+            note_file = known[1]
+            if (note_file is None or not with_content
+                    or note_file.content is not None):
+                return note_file
+
+        try:
+            note_file = NoteFile(path, with_content)
+        except (xml.parsers.expat.ExpatError, ValueError), exc:
+            print >> sys.stderr, "%s: Warning: Skipping note file %s: %s" % (
+                os.path.basename(sys.argv[0]),
+                path,
+                exc
+            )
+            note_file = None
+
+        self.parsed[path] = (modification_time, note_file)
+
+        return note_file
+
+    def note_paths(self):
+        """List the paths of all the note files."""
+        return glob.glob( os.path.join(self.directory, "*.note") )
+
+    def ListAllNotes(self):
+        """Get the URIs of all notes, the most recently changed first."""
+        notes = [self.note_file(path) for path in self.note_paths()]
+        # Files can be removed while they are listed.
+        notes = [n for n in notes if n is not None]
+        notes.sort(key=lambda n: n.date, reverse=True)
+
+        return [self.uri_for_path(n.path) for n in notes]
+
+    def NoteExists(self, uri):
+        """Verify if a note with the given URI exists."""
+        return os.path.isfile( self.path_for_uri(uri) )
+
+    def FindNote(self, title):
+        """Get the URI of a note by its title. Returns "" if not found."""
+        wanted = title.lower()
+
+        for path in self.note_paths():
+            note_file = self.note_file(path)
+            if note_file is not None and note_file.title.lower() == wanted:
+                return self.uri_for_path(path)
+
+        return u""
+
+    # Like Tomboy, the following methods return an empty value (-1 for
+    # dates) for notes that don't exist instead of raising an error. This way,
+    # notes that were removed since they were cached look changed.
+
+    def GetNoteTitle(self, uri):
+        """Get the title of a note."""
+        note_file = self.note_file( self.path_for_uri(uri) )
+        if note_file is None:
+            return u""
+
+        return note_file.title
+
+    def GetNoteChangeDate(self, uri):
+        """Get the last change date of a note as a unix timestamp."""
+        note_file = self.note_file( self.path_for_uri(uri) )
+        if note_file is None:
+            return -1
+
+        return note_file.date
+
+    def GetTagsForNote(self, uri):
+        """Get the list of tags of a note."""
+        note_file = self.note_file( self.path_for_uri(uri) )
+        if note_file is None:
+            return []
+
+        return note_file.tags
+
+    def GetNoteContents(self, uri):
+        """Get the text content of a note, without formatting."""
+        note_file = self.note_file( self.path_for_uri(uri), True )
+        if note_file is None:
+            return u""
+
+        return note_file.content
+
+    def Version(self):
+        """There is no application to get a version from."""
+        return u"(read from note files)"
@@ -41,12 +41,16 @@ Classes:
     FilteringGroup -- OptionGroup library. defines common options for filtering.
 
 """
+import sys
 import optparse
 
 class ActionPlugin(object):
     """Base class for action plugins"""
     short_description = None
     usage = "%prog [options] <arguments>"
+    # Actions that can be answered from note files set this to False. With the
+    # "auto" backend, the others start the application if it's not running.
+    needs_application = True
 
     def __init__(self):
         """Setup the Tomboy interface.
@@ -165,6 +169,23 @@ class ActionPlugin(object):
         """
         pass
 
+    def write_lines(self, lines):
+        """Print lines of text as they come.
+
+        Nothing needs to be gathered before printing, so output shows up as
+        soon as stdout's buffer fills, or after each line on a terminal, where
+        stdout is line buffered. Output is flushed once all lines are printed.
+        Lines are encoded to UTF-8.
+
+        Arguments:
+            lines -- An iterable of unicode strings
+
+        """
+        for line in lines:
+            print line.encode('utf-8')
+
+        sys.stdout.flush()
+
 class OptionGroup(object):
     """An optparse.OptionGroup without attachement to a parser."""
     def __init__(self, name, description):
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Table of the action plugins that are installed.
+
+Action plugins are registered as entry points of the "tomtom.actions" group.
+Scanning entry points needs pkg_resources, which takes a long time to import
+and to go through installed distributions. The table of actions is built from
+the entry points once, and kept in the cache directory with a stamp of the
+directories where packages are installed. It is built again when a package is
+installed or removed, which changes the stamp, or when an action is not in it.
+
+Descriptions of actions are added to the table the first time actions are
+listed, so that listing them doesn't import all plugins every time.
+
+Functions:
+    table_path  -- Path to the file holding the table of actions.
+    path_stamp  -- Modification times of the directories in sys.path.
+    load_table  -- Read the table of actions, if it is still valid.
+    build_table -- Build the table of actions from entry points.
+    save_table  -- Write the table of actions.
+    load_plugin -- Import the plugin class of an entry of the table.
+
+"""
+import os
+import sys
+import json
+
+from tomtom.cache import cache_directory
+
+# Entry point group under which action plugins are registered.
+ACTIONS_GROUP = "tomtom.actions"
+
+# File in the cache directory holding the table of actions.
+TABLE_FILE = "actions.json"
+
+def table_path():
+    """Get the path to the file holding the table of actions."""
+    return os.path.join(cache_directory(), TABLE_FILE)
+
+def path_stamp():
+    """Get the modification times of the directories in sys.path.
+
+    Installing or removing a package changes the modification time of the
+    directory it is installed in. The current directory (an empty entry) is
+    left out: it changes all the time and doesn't hold installed packages.
+
+    """
+    stamp = []
+
+    for entry in sys.path:
+        if not entry:
+            continue
+
+        try:
+            modification_time = os.stat(entry).st_mtime
+        except OSError:
+            modification_time = None
+
+        stamp.append( [entry, modification_time] )
+
+    return stamp
+
+def load_table():
+    """Read the table of actions.
+
+    Returns None if there is no table, or if it was built before packages were
+    installed or removed.
+
+    """
+    try:
+        with open( table_path() ) as table_file:
+            table = json.load(table_file)
+    except (IOError, ValueError):
+        return None
+
+    if not isinstance(table, dict) or table.get("stamp") != path_stamp():
+        return None
+
+    return table
+
+def build_table():
+    """Build the table of actions from entry points.
+
+    Plugins are not imported. Each action's entry only tells where to find
+    its plugin class.
+
+    """
+    import pkg_resources
+
+    actions = {}
+    for entrypoint in pkg_resources.iter_entry_points(group=ACTIONS_GROUP):
+        actions.setdefault(entrypoint.name, {
+            "module": entrypoint.module_name,
+            "attrs": list(entrypoint.attrs),
+        })
+
+    return {"stamp": path_stamp(), "actions": actions}
+
+def save_table(table):
+    """Write the table of actions.
+
+    Failures are ignored: the table will simply be built again next time.
+
+    Arguments:
+        table -- The table, as returned by build_table
+
+    """
+    path = table_path()
+
+    try:
+        if not os.path.isdir( os.path.dirname(path) ):
+            os.makedirs( os.path.dirname(path) )
+
+        with open(path, "w") as table_file:
+            json.dump(table, table_file)
+    except (IOError, OSError):
+        pass
+
+def load_plugin(entry):
+    """Import the plugin class of an action.
+
+    Arguments:
+        entry -- dictionary describing the action in the table
+
+    """
+    plugin = __import__( str(entry["module"]), fromlist=["__name__"] )
+
+    for attribute in entry["attrs"]:
+        plugin = getattr( plugin, str(attribute) )
+
+    return plugin
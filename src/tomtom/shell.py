@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Interactive shell that runs actions in a single process.
+
+"tomtom shell" reads actions from the user, one per line, and dispatches them
+like the tomtom command does. The connection to the application, the action
+plugins and the notes seen by earlier actions are kept between actions, like
+in the tomtomd daemon, so only the first action pays for starting up.
+
+Lines are split in arguments like a shell would, with quotes and backslashes.
+When readline is available, the tab key completes action names and the titles
+of the notes that earlier actions went through.
+
+Functions:
+    split_arguments  -- Split a line in unicode arguments.
+    run_action       -- Dispatch an action and get its exit status.
+    partial_argument -- Get the argument that is being typed on a line.
+    escape_argument  -- Escape the characters that split arguments.
+    main             -- Run the shell for "tomtom shell".
+
+Classes:
+    TomtomShell -- Reads actions from the user and dispatches them.
+
+"""
+import sys
+import os
+import cmd
+import shlex
+import optparse
+import traceback
+
+from tomtom import cli
+from tomtom.daemon import DaemonCommandLine, exit_status
+
+USAGE = "%prog shell [-h]"
+
+INTRO = """Type an action and its arguments, "help" for a list of actions """ \
+    """or "quit" to leave."""
+
+# Commands of the shell itself. Anything else is an action.
+SHELL_COMMANDS = ["exit", "help", "quit"]
+
+def split_arguments(line):
+    """Split a line in arguments like a shell would.
+
+    Raises ValueError if quotes are not balanced.
+
+    Arguments:
+        line -- The line, encoded in UTF-8
+
+    """
+    return [argument.decode("utf-8") for argument in shlex.split(line)]
+
+def run_action(command_line, arguments):
+    """Dispatch an action and return its exit status.
+
+    Exiting from the action, or failing, only ends the action. When the
+    application can't be reached, connections are closed so that the next
+    action connects again.
+
+    Arguments:
+        command_line -- CommandLine used to dispatch the action
+        arguments -- List of unicode strings, the action name first
+
+    """
+    try:
+        command_line.dispatch(arguments[0], arguments[1:])
+        status = 0
+    except SystemExit, exc:
+        status = exit_status(exc.code)
+    except Exception:
+        traceback.print_exc()
+        status = 1
+
+    if status in [cli.DBUS_CONNECTION_ERROR_RETURN_CODE,
+            cli.MALFORMED_ACTION_RETURN_CODE]:
+        command_line.close_connections()
+
+    return status
+
+def partial_argument(line):
+    """Get the argument that is being typed at the end of a line.
+
+    Quotes and backslashes are handled like shlex.split does, except that
+    backslashes are taken literally between quotes. Returns a (quote, argument)
+    pair where quote is the quote character that is still open, or None.
+
+    Arguments:
+        line -- The line, up to the cursor
+
+    """
+    quote = None
+    argument = ""
+    escaped = False
+
+    for character in line:
+        if escaped:
+            argument += character
+            escaped = False
+        elif quote is not None:
+            if character == quote:
+                quote = None
+            else:
+                argument += character
+        elif character == "\\":
+            escaped = True
+        elif character in "\"'":
+            quote = character
+        elif character.isspace():
+            argument = ""
+        else:
+            argument += character
+
+    return (quote, argument)
+
+def escape_argument(text):
+    """Escape the characters that would split an argument with backslashes.
+
+    Arguments:
+        text -- The argument, without quotes
+
+    """
+    return "".join([
+        "\\" + character
+        if character.isspace() or character in "\"'\\" else character
+        for character in text
+    ])
+
+class TomtomShell(cmd.Cmd):
+    """Reads actions from the user and dispatches them in this process."""
+    prompt = "tomtom> "
+
+    def __init__(self, command_line=None, stdin=None, stdout=None):
+        """Constructor.
+
+        Arguments:
+            command_line -- CommandLine used to dispatch actions. It should
+                keep its state between actions. (default: a DaemonCommandLine)
+            stdin -- File to read lines from (default: sys.stdin)
+            stdout -- File to write prompts and help to (default: sys.stdout)
+
+        """
+        # cmd.Cmd is an old-style class.
+        cmd.Cmd.__init__(self, stdin=stdin, stdout=stdout)
+
+        if command_line is None:
+            command_line = DaemonCommandLine()
+
+        self.command_line = command_line
+
+    def run(self):
+        """Read and dispatch actions until the user leaves.
+
+        Ctrl-C drops the line being typed, like in a shell. Ctrl-D, "quit" and
+        "exit" leave the shell.
+
+        """
+        while True:
+            try:
+                self.cmdloop()
+                return
+            except KeyboardInterrupt:
+                print >> self.stdout
+                self.intro = None
+
+    def run_action(self, arguments):
+        """Dispatch an action and return its exit status.
+
+        Arguments:
+            arguments -- List of unicode strings, the action name first
+
+        """
+        try:
+            return run_action(self.command_line, arguments)
+        except KeyboardInterrupt:
+            # Ctrl-C stops the action, not the shell.
+            print >> sys.stderr
+            return 1
+        finally:
+            sys.stdout.flush()
+
+    def default(self, line):
+        """Split a line in arguments and dispatch the action it names.
+
+        Arguments:
+            line -- The line typed by the user, encoded in UTF-8
+
+        """
+        try:
+            arguments = split_arguments(line)
+        except ValueError, exc:
+            print >> sys.stderr, "%s: Error: %s" % (
+                os.path.basename(sys.argv[0]),
+                exc
+            )
+            return
+
+        self.run_action(arguments)
+
+    def emptyline(self):
+        """Do nothing. cmd.Cmd would repeat the last action."""
+        pass
+
+    def do_help(self, argument):
+        """Print the list of actions, or the help of one action."""
+        if argument:
+            self.run_action([argument.decode("utf-8"), u"-h"])
+            return
+
+        print >> self.stdout, "Here is a list of all the available actions:"
+        print >> self.stdout, os.linesep.join(
+            self.command_line.action_short_summaries()
+        )
+        print >> self.stdout, os.linesep + \
+            """Use "help <action>" for details on an action's options, and """ \
+            """"quit" to leave."""
+
+    def do_quit(self, argument):
+        """Leave the shell."""
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self, argument):
+        """Leave the shell on Ctrl-D, or at the end of the input."""
+        # End the line of the prompt.
+        if self.prompt:
+            print >> self.stdout
+
+        return True
+
+    def action_names(self):
+        """Get the names of the actions and of the shell's commands."""
+        names = [name for (name, description) in
+            self.command_line.action_descriptions()]
+
+        return sorted(names + SHELL_COMMANDS)
+
+    def titles(self):
+        """Get the titles of the notes that earlier actions went through."""
+        titles = set()
+        for memory_cache in self.command_line.caches.values():
+            titles.update( memory_cache.titles() )
+
+        return sorted(titles)
+
+    def completenames(self, text, *ignored):
+        """Complete the name of an action."""
+        return [name for name in self.action_names() if name.startswith(text)]
+
+    def complete_help(self, text, line, begidx, endidx):
+        """Complete the name of an action after "help"."""
+        return self.completenames(text)
+
+    def completedefault(self, text, line, begidx, endidx):
+        """Complete the title of a note in the arguments of an action.
+
+        Readline splits words on spaces, quotes and punctuation, so "text" may
+        only be the end of the argument being typed. The argument is found by
+        going through the line, and only its part from "text" on is replaced.
+        Characters that would split the argument are escaped unless it is
+        quoted.
+
+        Arguments:
+            text -- The word that readline completes, encoded in UTF-8
+            line -- The line typed so far, encoded in UTF-8
+            begidx -- The position of "text" in the line
+            endidx -- The position of the cursor in the line
+
+        """
+        quote, typed = partial_argument(line[:endidx])
+        if quote is None and typed.startswith("-"):
+            return []
+
+        typed = typed.decode("utf-8", "replace")
+        text = text.decode("utf-8", "replace")
+        if not typed.endswith(text):
+            return []
+
+        start = len(typed) - len(text)
+        typed = typed.lower()
+
+        completions = []
+        for title in self.titles():
+            if not title.lower().startswith(typed):
+                continue
+
+            completion = title[start:]
+            if quote is None:
+                completion = escape_argument(completion)
+
+            completions.append( completion.encode("utf-8") )
+
+        return completions
+
+def main(arguments):
+    """Run the shell for "tomtom shell" and return the exit status.
+
+    Arguments:
+        arguments -- A list of the arguments that follow "shell"
+
+    """
+    parser = optparse.OptionParser(usage=USAGE)
+    options, positional = parser.parse_args(arguments)
+    if positional:
+        parser.error("The shell takes no arguments.")
+
+    tomtom_shell = TomtomShell()
+
+    # Prompts would only clutter the output when lines come from a pipe.
+    if sys.stdin.isatty():
+        tomtom_shell.intro = INTRO
+    else:
+        tomtom_shell.prompt = ""
+
+    tomtom_shell.run()
+
+    return 0
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+###############################################################################
+#
+# Copyright (c) 2009, Gabriel Filion
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#     * Redistributions of source code must retain the above copyright notice,
+#       this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice,
+#     * this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the copyright holder nor the names of its
+#       contributors may be used to endorse or promote products derived from
+#       this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+###############################################################################
+"""Accounting of where time goes during one tomtom action.
+
+When the "--stats" option is used, calls made to the application go through
+an InstrumentedComm object, which counts calls to each method of the
+RemoteControl interface, the size of the replies received and the time each
+call took. Time is also split by phase: loading the action's plugin, parsing
+options, connecting to the application, fetching notes, filtering them,
+formatting output and writing it.
+
+The same records can be written as a trace in the Chrome trace event format
+(with the "--trace-file" option), which can be opened in chrome://tracing or
+Perfetto. Each call and each time a phase is entered is a span in the trace.
+
+Phases can be nested: time spent in a phase doesn't include the time spent in
+the phases entered while it was running. So filtering notes doesn't count the
+time spent fetching the notes that are filtered. The action's own work, like
+formatting lines or matching searches, is counted as "format".
+
+Functions:
+    reply_size -- Approximate size in bytes of a reply.
+    percentile -- Get a percentile from a list of values.
+    trace_event -- Create an event of the Chrome trace event format.
+
+Classes:
+    Stats -- Calls and phase times of one action.
+    InstrumentedComm -- Wrapper of the interface to the application.
+
+"""
+import os
+import math
+import time
+import json
+import types
+
+PHASES = [
+    "plugin loading",
+    "option parsing",
+    "connection",
+    "fetch",
+    "filter",
+    "format",
+    "write",
+]
+
+# Methods of the Tomtom object that are timed, and the phase they count in.
+TIMED_METHODS = [
+    ("build_note_list", "fetch"),
+    ("call_many", "fetch"),
+    ("filter_notes", "filter"),
+]
+
+def reply_size(value):
+    """Get the approximate size in bytes of a reply.
+
+    Strings count for their length in UTF-8 and other values for 8 bytes, which
+    is about what they take in a dbus message.
+
+    Arguments:
+        value -- A reply from the application
+
+    """
+    if isinstance(value, unicode):
+        return len( value.encode("utf-8") )
+
+    if isinstance(value, str):
+        return len(value)
+
+    if isinstance(value, dict):
+        return sum(
+            reply_size(k) + reply_size(v) for (k, v) in value.iteritems()
+        )
+
+    if isinstance(value, (list, tuple)):
+        return sum(reply_size(v) for v in value)
+
+    if value is None:
+        return 0
+
+    return 8
+
+def percentile(values, fraction):
+    """Get a percentile from a list of values, by nearest rank.
+
+    Arguments:
+        values -- A list of numbers. It must not be empty.
+        fraction -- The percentile, between 0 and 1 (e.g. 0.9 for the 90th)
+
+    """
+    values = sorted(values)
+    rank = int( math.ceil(fraction * len(values)) )
+
+    return values[ max(rank, 1) - 1 ]
+
+def trace_event(name, category, start, end, **fields):
+    """Create a complete event ("X") of the Chrome trace event format.
+
+    Arguments:
+        name -- Name of the span
+        category -- Category of the span, "phase" or "dbus"
+        start -- Time at which the span started, in seconds
+        end -- Time at which the span ended, in seconds
+        **fields -- Other fields of the event, which replace the defaults
+
+    """
+    event = {
+        "name": name,
+        "cat": category,
+        "ph": "X",
+        "ts": int(start * 1000000),
+        "dur": int( (end - start) * 1000000 ),
+        "pid": os.getpid(),
+        "tid": 0,
+    }
+    event.update(fields)
+
+    return event
+
+class Stats(object):
+    """Calls and phase times of one action.
+
+    Phase times are kept in seconds. Latencies of calls are kept in seconds by
+    method name, along with the number of bytes received from each method.
+
+    When created with trace=True, a list of trace events is also kept in the
+    "events" attribute. Otherwise, "events" is None.
+
+    """
+    def __init__(self, trace=False):
+        """Constructor.
+
+        Arguments:
+            trace -- Boolean, keep trace events (default: False)
+
+        """
+        super(Stats, self).__init__()
+
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.stack = []
+        self.mark = None
+
+        self.events = None
+        self.spans = []
+        if trace:
+            self.events = []
+
+        self.latencies = {}
+        self.received = {}
+        self.errors = 0
+
+        self.instrumented = None
+        self.saved_comm = None
+
+    def add_phase(self, phase, start, end):
+        """Add time measured elsewhere to a phase.
+
+        Arguments:
+            phase -- Name of the phase
+            start -- Time at which the phase started, in seconds
+            end -- Time at which the phase ended, in seconds
+
+        """
+        self.phases[phase] += end - start
+
+        if self.events is not None:
+            self.events.append( trace_event(phase, "phase", start, end) )
+
+    def enter(self, phase, name=None, traced=True):
+        """Start counting time in a phase, until leave is called.
+
+        Time is not counted in the current phase until the new one is left.
+
+        Arguments:
+            phase -- Name of the phase
+            name -- Name of the span in the trace (default: the phase name)
+            traced -- Boolean, add a span to the trace (default: True)
+
+        """
+        now = time.time()
+
+        if self.stack:
+            self.phases[ self.stack[-1] ] += now - self.mark
+
+        self.stack.append(phase)
+        self.mark = now
+
+        if self.events is not None:
+            span = None
+            if traced:
+                span = (name or phase, now)
+
+            self.spans.append(span)
+
+    def leave(self):
+        """Stop counting time in the last phase entered."""
+        now = time.time()
+
+        phase = self.stack.pop()
+        self.phases[phase] += now - self.mark
+        self.mark = now
+
+        if self.events is not None:
+            span = self.spans.pop()
+
+            if span is not None:
+                name, start = span
+                self.events.append(
+                    trace_event(
+                        name, "phase", start, now, args={"phase": phase}
+                    )
+                )
+
+    def timed_iterator(self, phase, iterable, name=None):
+        """Count time spent getting each item of an iterable in a phase.
+
+        Arguments:
+            phase -- Name of the phase
+            iterable -- The iterable to time
+            name -- Name of the spans in the trace (default: the phase name)
+
+        """
+        iterator = iter(iterable)
+
+        while True:
+            self.enter(phase, name)
+            try:
+                item = iterator.next()
+            except StopIteration:
+                return
+            finally:
+                self.leave()
+
+            yield item
+
+    def timed_function(self, phase, function):
+        """Wrap a function so that calls to it are counted in a phase.
+
+        Generators returned by the function are also timed while they run.
+
+        Arguments:
+            phase -- Name of the phase
+            function -- The function to time
+
+        """
+        name = function.__name__
+
+        def timed(*args, **kwargs):
+            """Call the function in the phase."""
+            self.enter(phase, name)
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                self.leave()
+
+            if isinstance(result, types.GeneratorType):
+                return self.timed_iterator(phase, result, name)
+
+            return result
+
+        return timed
+
+    def record_call(self, method, start, end, reply=None, error=False,
+            pipelined=False):
+        """Record a call made to the application.
+
+        Arguments:
+            method -- Name of the method that was called
+            start -- Time at which the call was made, in seconds
+            end -- Time at which the reply came back, in seconds
+            reply -- The reply that was received (default: None)
+            error -- Boolean, the call failed (default: False)
+            pipelined -- Boolean, the call was asynchronous (default: False)
+
+        """
+        size = reply_size(reply)
+
+        self.latencies.setdefault(method, []).append(end - start)
+        self.received[method] = self.received.get(method, 0) + size
+
+        if error:
+            self.errors += 1
+
+        if self.events is not None:
+            # Asynchronous calls overlap, so each one gets its own line.
+            tid = 0
+            if pipelined:
+                tid = len(self.events) + 1
+
+            self.events.append(
+                trace_event(
+                    method, "dbus", start, end, tid=tid,
+                    args={"bytes": size, "error": error}
+                )
+            )
+
+    def write_trace(self, path):
+        """Write the trace events to a file in the Chrome trace event format.
+
+        Arguments:
+            path -- Path of the file to write
+
+        """
+        trace_file = open(path, "w")
+        try:
+            json.dump(
+                {"traceEvents": self.events, "displayTimeUnit": "ms"},
+                trace_file
+            )
+        finally:
+            trace_file.close()
+
+    def instrument(self, action):
+        """Count the calls and phases of an action.
+
+        The interface of the action's Tomtom object is replaced by an
+        InstrumentedComm, and some of its methods and the action's write_lines
+        method are timed. Everything is put back by calling restore.
+
+        Arguments:
+            action -- A tomtom.plugins.ActionPlugin with a "tomboy_interface"
+
+        """
+        tomtom = action.tomboy_interface
+
+        self.instrumented = action
+        self.saved_comm = tomtom.comm
+        tomtom.comm = InstrumentedComm(tomtom.comm, self)
+
+        for (name, phase) in TIMED_METHODS:
+            setattr(
+                tomtom, name,
+                self.timed_function( phase, getattr(tomtom, name) )
+            )
+
+        write_lines = action.write_lines
+
+        def timed_write_lines(lines):
+            """Count the time spent writing in "write", one line at a time."""
+            for line in lines:
+                self.enter("write")
+                try:
+                    write_lines([line])
+                finally:
+                    self.leave()
+
+        action.write_lines = timed_write_lines
+
+    def restore(self):
+        """Put back what was replaced by instrument."""
+        action = self.instrumented
+        tomtom = action.tomboy_interface
+
+        tomtom.comm = self.saved_comm
+        for (name, phase) in TIMED_METHODS:
+            delattr(tomtom, name)
+
+        del action.write_lines
+
+        self.instrumented = None
+        self.saved_comm = None
+
+    def report(self, stream):
+        """Write a report of the calls and phase times.
+
+        Arguments:
+            stream -- A file object to write to
+
+        """
+        total = sum( self.phases.values() )
+
+        print >> stream, "%-16s %10s %7s" % ("phase", "time (ms)", "share")
+        for phase in PHASES:
+            elapsed = self.phases[phase]
+            share = 0.0
+            if total:
+                share = elapsed * 100 / total
+
+            print >> stream, "%-16s %10.1f %6.1f%%" % (
+                phase, elapsed * 1000, share
+            )
+        print >> stream, "%-16s %10.1f" % ("total", total * 1000)
+
+        print >> stream
+        print >> stream, "%-20s %6s %10s %8s %8s %8s %8s" % (
+            "method", "calls", "bytes", "p50 (ms)", "p90", "p99", "max"
+        )
+
+        all_latencies = []
+        for method in sorted(self.latencies):
+            latencies = self.latencies[method]
+            all_latencies.extend(latencies)
+
+            self.report_method(
+                stream, method, latencies, self.received[method]
+            )
+
+        if all_latencies:
+            self.report_method(
+                stream, "total", all_latencies, sum( self.received.values() )
+            )
+
+        if self.errors:
+            print >> stream, "%d calls failed" % self.errors
+
+    def report_method(self, stream, method, latencies, received):
+        """Write one line of the report of calls."""
+        print >> stream, "%-20s %6d %10d %8.2f %8.2f %8.2f %8.2f" % (
+            method,
+            len(latencies),
+            received,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.9) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            max(latencies) * 1000,
+        )
+
+class InstrumentedComm(object):
+    """Wrapper of the interface to the application that records calls.
+
+    Methods of the wrapped object are called the same way. Synchronous calls
+    are counted in the "fetch" phase. The latency of asynchronous calls is the
+    time between the call and its reply handler being called.
+
+    """
+    def __init__(self, comm, stats):
+        """Constructor.
+
+        Arguments:
+            comm -- The interface to wrap (dbus.Interface or NoteDirectory)
+            stats -- The Stats object that records calls
+
+        """
+        super(InstrumentedComm, self).__init__()
+        self.comm = comm
+        self.stats = stats
+
+    def __getattr__(self, name):
+        """Get a wrapper of a method of the interface.
+
+        Methods that the interface lacks raise AttributeError, like they do
+        on the interface itself.
+
+        """
+        method = getattr(self.comm, name)
+
+        def call(*args, **kwargs):
+            """Call the method and record the call."""
+            start = time.time()
+
+            if "reply_handler" in kwargs:
+                return self.call_async(name, start, method, args, kwargs)
+
+            # The call is traced by record_call.
+            self.stats.enter("fetch", traced=False)
+            try:
+                reply = method(*args, **kwargs)
+            except:
+                self.stats.record_call(name, start, time.time(), error=True)
+                raise
+            finally:
+                self.stats.leave()
+
+            self.stats.record_call(name, start, time.time(), reply)
+
+            return reply
+
+        return call
+
+    def call_async(self, name, start, method, args, kwargs):
+        """Make an asynchronous call, recording it when a reply comes back."""
+        reply_handler = kwargs["reply_handler"]
+        error_handler = kwargs["error_handler"]
+
+        def handle_reply(reply):
+            """Record the call and pass the reply on."""
+            self.stats.record_call(
+                name, start, time.time(), reply, pipelined=True
+            )
+            reply_handler(reply)
+
+        def handle_error(exc):
+            """Record the failed call and pass the error on."""
+            self.stats.record_call(
+                name, start, time.time(), error=True, pipelined=True
+            )
+            error_handler(exc)
+
+        kwargs["reply_handler"] = handle_reply
+        kwargs["error_handler"] = handle_error
+
+        return method(*args, **kwargs)